@@ -0,0 +1,289 @@
+# coding: UTF-8
+
+import signal
+import threading
+from time import perf_counter
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Generator, Iterator, List, Dict, Tuple, Union, Optional, Any
+
+from util.text_tool_base import TextProcessorBase
+
+
+class BudgetTimeout(Exception):
+    pass
+
+
+class BudgetGuard(TextProcessorBase):
+    """
+    重いstage（形態素解析・品詞タグ付けなど）の前で文書の長さを制限し、1回の呼び出しの時間を制限するラッパー
+    長さや時間の上限を超えた文書は""（除去）にし、理由を self.reasons に数える
+    除去した文書ごとの (入力の通し番号, 理由) は self.dropped に追加し、on_drop を指定した場合は on_drop(通し番号, 理由) も呼ぶ
+
+        sentence_cleaner = BudgetGuard(PartsFilterSpacy(), max_chars=nlp.max_length, mode='chunk', time_budget=2.0)
+
+    - max_chars を超える文書は mode に従って処理する
+        'drop': 除去する（理由: 'too_long'）
+        'truncate': max_chars 文字以内の区切り文字（改行・句点・空白など）までに切り詰める
+        'chunk': 区切り文字で max_chars 文字以内に分け、それぞれstageで処理した結果を結合する
+                 （フィルタの場合は分けた部分ごとに判定される）
+    - time_budget（秒/文書）を超えたstageの呼び出しは打ち切り、その文書を除去する（理由: 'timeout'）
+        メインスレッドではSIGALRMで打ち切る（Pythonに処理が戻った時点で中断されるので、
+        C拡張の1回の呼び出しは終わるまで止まらない。長い文書はmax_charsで先に分けておく）
+        メインスレッド以外やSIGALRMが既に使われている場合は中断できないので、処理後に時間を確認して除去する
+        中断はstageの処理の途中（e.g. TreeTaggerのパイプの読み書きの途中）でも起こるので、中断した後は reset() を呼ぶ
+        reset を指定しない場合は stage.restart() があればそれを使う（PartsFilterTreetaggerなど）
+        reset も restart() もない場合は、中断しても状態が壊れないstage（外部プロセスなどの状態を持たないもの）にだけ使うこと
+    - time_budgetを指定した場合、process_batch()は1件ずつ制限して処理する
+      batch_budget（秒/呼び出し）も指定すると、まずまとめてその制限で処理し、超えた場合だけ1件ずつ処理し直す
+      （まとめて処理すると速いstage用。典型的なバッチの処理時間の数倍程度にする）
+    """
+
+    def __init__(
+            self,
+            stage: Callable[..., Any],
+            max_chars: Optional[int] = None,
+            mode: str = 'chunk',
+            time_budget: Optional[float] = None,
+            batch_budget: Optional[float] = None,
+            boundaries: str = '\n。．.!?！？ ',
+            reset: Optional[Callable[[], Any]] = None,
+            on_drop: Optional[Callable[[int, str], Any]] = None,
+    ):
+        assert mode in ('drop', 'truncate', 'chunk'), f'unknown mode: {mode}'
+        self._stage = stage
+        self._max_chars: Optional[int] = max_chars
+        self._mode: str = mode
+        self._time_budget: Optional[float] = time_budget
+        self._batch_budget: Optional[float] = batch_budget
+        self._boundaries: str = boundaries
+        self._reset: Optional[Callable[[], Any]] = reset if reset is not None else getattr(stage, 'restart', None)
+        self._on_drop: Optional[Callable[[int, str], Any]] = on_drop
+        # 理由ごとの件数 e.g. {'too_long': 3, 'timeout': 1, 'truncated': 2, 'chunked': 5}
+        self.reasons: Counter = Counter()
+        # 除去した文書の (入力の通し番号, 理由) e.g. [(50, 'too_long'), (120, 'timeout')]
+        self.dropped: List[Tuple[int, str]] = []
+        # 次の入力の文書の通し番号
+        self._next_index: int = 0
+
+    def cut_position(
+            self,
+            text: str,
+            start: int,
+    ) -> int:
+        """ text[start:]をmax_chars文字以内で区切る位置（後半に区切り文字がなければmax_chars文字目） """
+        end = start + self._max_chars
+        if end >= len(text):
+            return len(text)
+        low = start + self._max_chars // 2
+        pos = max(text.rfind(c, low, end) for c in self._boundaries)
+        return pos + 1 if pos >= 0 else end
+
+    def split_chunks(self, text: str) -> List[str]:
+        chunks = []
+        start = 0
+        while start < len(text):
+            end = self.cut_position(text, start)
+            chunks.append(text[start:end])
+            start = end
+        return chunks
+
+    def prepare(self, text: str) -> Optional[List[str]]:
+        """ 長さの上限に従って、stageに渡す部分のリストにする（除去する場合はNone） """
+        if self._max_chars is None or len(text) <= self._max_chars:
+            return [text]
+        if self._mode == 'drop':
+            return None
+        if self._mode == 'truncate':
+            self.reasons['truncated'] += 1
+            return [text[:self.cut_position(text, 0)]]
+        self.reasons['chunked'] += 1
+        return self.split_chunks(text)
+
+    @staticmethod
+    def can_interrupt() -> bool:
+        return hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread() \
+            and signal.getitimer(signal.ITIMER_REAL)[0] == 0
+
+    @contextmanager
+    def deadline(self, seconds: float):
+        """ メインスレッドでは、seconds秒後にBudgetTimeoutを送出する """
+        if not self.can_interrupt():
+            yield
+            return
+
+        def handler(signum, frame):
+            raise BudgetTimeout()
+
+        previous = signal.signal(signal.SIGALRM, handler)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+    def run_stage(self, texts: List[str]) -> List[str]:
+        if isinstance(self._stage, TextProcessorBase):
+            return self._stage.process_batch(texts)
+        return ["".join(list(self._stage(text))) for text in texts]
+
+    def run_with_budget(
+            self,
+            texts: List[str],
+            budget: float,
+    ) -> Optional[List[str]]:
+        """ budget秒以内に処理できればその結果、できなければNone """
+        start = perf_counter()
+        try:
+            with self.deadline(budget):
+                results = self.run_stage(texts)
+        except BudgetTimeout:
+            # stageの途中で中断したので、状態を戻す
+            if self._reset is not None:
+                self._reset()
+            return None
+        if perf_counter() - start > budget:
+            return None
+        return results
+
+    def drop(self, index: int, reason: str):
+        """ 通し番号indexの文書を理由reasonで除去したことを記録する """
+        self.reasons[reason] += 1
+        self.dropped.append((index, reason))
+        if self._on_drop is not None:
+            self._on_drop(index, reason)
+
+    def process_documents(self, texts: List[str]) -> List[str]:
+        first_index = self._next_index
+        self._next_index += len(texts)
+        pieces = [self.prepare(text if text is not None else "") for text in texts]
+        for k, document in enumerate(pieces):
+            if document is None:
+                self.drop(first_index + k, 'too_long')
+        pieces = [[] if document is None else document for document in pieces]
+        flat = [piece for document in pieces for piece in document]
+
+        if self._time_budget is None:
+            flat_results: List[Optional[str]] = self.run_stage(flat)
+        else:
+            flat_results = None
+            if self._batch_budget is not None and len(flat) > 1:
+                flat_results = self.run_with_budget(flat, self._batch_budget)
+            if flat_results is None:
+                # 1件ずつ処理し直し、時間を超えたものだけNoneにする
+                flat_results = []
+                for piece in flat:
+                    result = self.run_with_budget([piece], self._time_budget)
+                    flat_results.append(None if result is None else result[0])
+
+        results = []
+        offset = 0
+        for k, document in enumerate(pieces):
+            outputs = flat_results[offset:offset + len(document)]
+            offset += len(document)
+            if any(output is None for output in outputs):
+                self.drop(first_index + k, 'timeout')
+                results.append("")
+            else:
+                results.append("".join(outputs))
+        return results
+
+    def process_handling(
+            self,
+            text: str,
+    ) -> str:
+        return self.process_documents([text])[0]
+
+    def process_batch(
+            self,
+            texts: List[str],
+    ) -> List[str]:
+        return self.process_documents(texts)
+
+
+if __name__ == "__main__":
+    '''
+    > python -m cleaner.budget_guard
+    '''
+
+    from util.versatile_tool import stop_watch
+
+
+    class RepeatedCharFilter(TextProcessorBase):
+        """ 同じ文字が多い文書を除去する（文字数の2乗の時間がかかる、遅いstageの例） """
+
+        def process_handling(self, text: str) -> str:
+            repeated = sum(1 for i, c in enumerate(text) for d in text[i + 1:] if c == d)
+            return "" if len(text) > 1 and repeated / (len(text) * (len(text) - 1) / 2) > 0.5 else text
+
+
+    texts = [
+        'まとめ|エキサイトブログ生八つ橋のタグまとめ.',
+        'ブログ、生八つ橋、日記,記録、写真、レビュー、噂、まとめ。',
+        'Between the golden-yellow lotus leaves and stalks, we see swaying white lotus flowers with thick black.',
+    ] * 100
+    # 1件だけ巨大な文書
+    texts.insert(50, '生八つ橋いろいろ。京都旅行のお土産に色々な生八つ橋を買ってきました。' * 200)
+
+    stage = RepeatedCharFilter()
+    guards = {
+        'chunk': BudgetGuard(stage, max_chars=500, mode='chunk'),
+        'drop': BudgetGuard(stage, max_chars=500, mode='drop'),
+        'timeout': BudgetGuard(stage, time_budget=0.05),
+        'batch': BudgetGuard(stage, time_budget=0.05, batch_budget=0.1),
+    }
+
+
+    @stop_watch
+    def func_unguarded():
+        return list(stage(texts))
+
+
+    @stop_watch
+    def func_chunk():
+        return list(guards['chunk'](texts))
+
+
+    @stop_watch
+    def func_drop():
+        return list(guards['drop'](texts))
+
+
+    @stop_watch
+    def func_timeout():
+        return guards['timeout'].process_batch(texts)
+
+
+    @stop_watch
+    def func_batch():
+        return [text for head in range(0, len(texts), 100) for text in guards['batch'].process_batch(texts[head:head + 100])]
+
+
+    unguarded = func_unguarded()
+    for results, name in ((func_chunk(), 'chunk'), (func_drop(), 'drop'), (func_timeout(), 'timeout'),
+                          (func_batch(), 'batch')):
+        # 巨大な文書以外の結果は変わらない
+        assert results[:50] + results[51:] == unguarded[:50] + unguarded[51:]
+        print(name, dict(guards[name].reasons), guards[name].dropped, len(results[50]))
+    # 除去した文書ごとに、入力の通し番号と理由が記録される
+    assert guards['drop'].dropped == [(50, 'too_long')] and guards['chunk'].dropped == []
+    assert all(reason == 'timeout' for _, reason in guards['timeout'].dropped) and (50, 'timeout') in guards['timeout'].dropped
+    # unguarded: 0.8s, chunk: 0.07s, drop: 0.02s, timeout: 0.08s, batch: 0.17s 程度
+
+    # 中断した後はstageのrestart()で状態を戻す（パイプの途中で止まったプロセスの出力を次の文書で読まないように）
+    class StatefulFilter(RepeatedCharFilter):
+        def __init__(self):
+            self.restarts = 0
+
+        def restart(self):
+            self.restarts += 1
+
+
+    stateful = StatefulFilter()
+    dropped = []
+    stateful_guard = BudgetGuard(stateful, time_budget=0.05, on_drop=lambda index, reason: dropped.append(index))
+    assert stateful_guard.process_batch(texts) == guards['timeout'].process_batch(texts)
+    if BudgetGuard.can_interrupt():
+        assert stateful.restarts == len(dropped) > 0
+    assert dropped == [index for index, _ in stateful_guard.dropped]
@@ -1,24 +1,35 @@
 # coding: UTF-8
 
-from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload, Any
+from typing import Generator, Iterable, Iterator, List, Dict, Tuple, Union, Optional, overload, Any
 import itertools
 
-from util.text_tool_base import TextProcessorBase, TextSplitterBase
+from util.text_tool_base import TextProcessorBase, TextSplitterBase, iter_line_spans
+
+# 連続重複の判定で、どの文とも一致しない初期値
+_NOTHING = object()
 
 
 class ParagraphCleaningDirector(TextProcessorBase):
     """ Director of cleaning process for each paragraph
 
+    window_size: int
+        2以上の場合は、window_size個の文書の段落・文をまとめて
+        paragraph_splitter.split_batch() / sentence_cleaner.process_batch() に渡し、文書ごとに組み立て直す
+        （spaCyのnlp.pipe(), NLTKのpos_tag_sents(), wtpsplitなど、まとめて処理すると速いものを活かせる）
+        メモリ使用量はwindow_size個の文書の文の数に比例する。process_batch()は常にまとめて処理する
     """
 
     def __init__(
             self,
             paragraph_splitter: [TextSplitterBase] = None,
-            sentence_cleaner: [TextProcessorBase] = None
+            sentence_cleaner: [TextProcessorBase] = None,
+            window_size: int = 1,
     ):
         self._paragraph_splitter: [TextSplitterBase] = paragraph_splitter
         self._sentence_cleaner: [TextProcessorBase] = sentence_cleaner
+        self._window_size: int = window_size
         self._sentence_endings: List[str] = ['。', '！', '？', '.', '!', '?', "．", "」", '"']
+        self._sentence_endings_set: frozenset = frozenset(self._sentence_endings)
 
     @staticmethod
     def split_text_into_paragraphs(text: str) -> List[str]:
@@ -71,8 +82,16 @@ class ParagraphCleaningDirector(TextProcessorBase):
     def paragraphs_cleaner(self, paragraphs: List[List[str]]) -> List[List[str]]:
         """
         List[List[文章]]の要素（List[文章]）をself.sentences_cleaner()でクリーニング
+        self._sentence_cleaner がTextProcessorBaseの場合は、文書内の文をまとめてprocess_batch()で処理する
         """
-        new_paragraphs = [self.sentences_cleaner(paragraph) for paragraph in paragraphs]
+        if not isinstance(self._sentence_cleaner, TextProcessorBase):
+            new_paragraphs = [self.sentences_cleaner(paragraph) for paragraph in paragraphs]
+            return new_paragraphs
+
+        # 文書内の全ての文をまとめてprocess_batch()に渡し、段落ごとに戻してから重複削除
+        cleaned = iter(self._sentence_cleaner.process_batch(list(itertools.chain.from_iterable(paragraphs))))
+        new_paragraphs = [self.remove_duplicate_elements(list(itertools.islice(cleaned, len(paragraph))))
+                          for paragraph in paragraphs]
         return new_paragraphs
 
     @staticmethod
@@ -84,6 +103,68 @@ class ParagraphCleaningDirector(TextProcessorBase):
         paragraphs = [[s for s in p if (s[-1] in endings) or (len(p) < 2)] for p in paragraphs]
         return paragraphs
 
+    def clean_paragraph_sentences(
+            self,
+            paragraph: str,
+            cache: Optional[Dict[str, str]] = None,
+    ) -> Iterator[str]:
+        """
+        段落を文に分割し、self._sentence_cleaner()でクリーニングした文を順に返す
+        self._sentence_cleaner がTextProcessorBaseの場合は、段落内の文をまとめてprocess_batch()で処理する
+        cacheを渡した場合は、cacheにない文だけを1回ずつprocess_batch()に渡し、結果をcacheに追加する
+        （文書内で繰り返し出てくる文を、段落をまたいでも1回だけ解析する）
+        """
+        sentences = self._paragraph_splitter(paragraph)
+        if not isinstance(self._sentence_cleaner, TextProcessorBase):
+            return itertools.chain.from_iterable(self._sentence_cleaner(sentence) for sentence in sentences)
+        if cache is None:
+            return iter(self._sentence_cleaner.process_batch(list(sentences)))
+        sentences = list(sentences)
+        new_sentences = [sentence for sentence in dict.fromkeys(sentences) if sentence not in cache]
+        if new_sentences:
+            cache.update(zip(new_sentences, self._sentence_cleaner.process_batch(new_sentences)))
+        return (cache[sentence] for sentence in sentences)
+
+    def assemble_paragraph(self, cleaned_sentences: Iterable[str]) -> str:
+        """
+        クリーニングした段落内の文を 連続重複削除 → 空要素除去 → 文末記号のチェック → 結合 する
+        """
+        kept = []
+        previous = _NOTHING
+        for sentence in cleaned_sentences:
+            # 連続重複削除は空要素除去の前に行う（以前の処理と同じ順番）
+            if sentence == previous:
+                continue
+            previous = sentence
+            if sentence != '':
+                kept.append(sentence)
+        if len(kept) < 2:
+            return "".join(kept)
+        endings = self._sentence_endings_set
+        return "".join([sentence for sentence in kept if sentence[-1] in endings])
+
+    def clean_paragraph(
+            self,
+            paragraph: str,
+            cache: Optional[Dict[str, str]] = None,
+    ) -> str:
+        """
+        1つの段落を 文に分割 → クリーニング → assemble_paragraph() する
+        （以前の処理の1段落分と同じ結果）
+        """
+        return self.assemble_paragraph(self.clean_paragraph_sentences(paragraph, cache))
+
+    def assemble_text(self, paragraphs: Iterable[str]) -> str:
+        """ 段落を連続重複削除して結合する """
+        new_paragraphs = []
+        previous = _NOTHING
+        for paragraph in paragraphs:
+            if paragraph == previous:
+                continue
+            previous = paragraph
+            new_paragraphs.append(paragraph)
+        return self.concat_paragraphs_into_text(new_paragraphs)
+
     def process_handling(
             self,
             text: str,
@@ -91,29 +172,59 @@ class ParagraphCleaningDirector(TextProcessorBase):
         """
         単純なパイプラインの連結だけでは実現できない sentence segmentation, cleaning, concatenation
         といった複数の処理をまとめたもの
+        段落を1つずつ 分割 → クリーニング → 文末記号のチェック → 連続重複削除 して出力に追加する
+        （文書全体の List[段落], List[List[文]] などの中間リストを作らない）
+        文のクリーニングの結果は文書の間だけ 文 -> 結果 で保持し、繰り返し出てくる文は1回だけ解析する
         """
+        cache = {} if isinstance(self._sentence_cleaner, TextProcessorBase) else None
+        return self.assemble_text(self.clean_paragraph(text[start:end], cache) for start, end in iter_line_spans(text))
 
-        '''---- normalize ----'''
-        # 別途用意したものをpipelineで前処理として連結すれば良いと思う。ここでは行わない
-
-        '''---- sentence segmentation ----'''
-        paragraphs = self.split_text_into_paragraphs(text)
-        paragraphs_divided_into_sentences = self.split_paragraphs_into_sentences(paragraphs)
+    def split_paragraphs_batch(self, paragraphs: List[str]) -> List[List[str]]:
+        """ 段落をまとめて文に分割する（TextSplitterBaseの場合はsplit_batch()） """
+        if isinstance(self._paragraph_splitter, TextSplitterBase):
+            return self._paragraph_splitter.split_batch(paragraphs)
+        return [list(self._paragraph_splitter(paragraph)) for paragraph in paragraphs]
 
-        '''---- paragraphs cleaning ----'''
-        new_paragraphs = self.paragraphs_cleaner(paragraphs_divided_into_sentences)
-        new_paragraphs = self.clean_line_endings(new_paragraphs, self._sentence_endings)
-        # print('removed', new_paragraphs)
-
-        '''---- concat paragraphs ----'''
-        new_paragraphs = self.concat_sentences_into_paragraphs(new_paragraphs)
-        new_paragraphs = self.remove_duplicate_elements(new_paragraphs)
-        text = self.concat_paragraphs_into_text(new_paragraphs)
-
-        '''---- text filter ----'''
-        # 別途用意したものをパイプラインで後処理として連結すれば良いと思う。ここでは行わない
-
-        return text
+    def process_batch(
+            self,
+            texts: List[str],
+    ) -> List[str]:
+        """
+        複数の文書の段落・文をまとめて分割・クリーニングし、文書ごとに組み立て直す
+        結果はprocess_handling()を1文書ずつ呼んだ場合と同じ
+        """
+        paragraph_counts = []
+        paragraphs = []
+        for text in texts:
+            spans = list(iter_line_spans(text)) if text else []
+            paragraph_counts.append(len(spans))
+            paragraphs.extend(text[start:end] for start, end in spans)
+
+        paragraph_sentences = self.split_paragraphs_batch(paragraphs)
+        if isinstance(self._sentence_cleaner, TextProcessorBase):
+            cleaned = iter(self._sentence_cleaner.process_batch(list(itertools.chain.from_iterable(paragraph_sentences))))
+            cleaned_paragraphs = (self.assemble_paragraph(itertools.islice(cleaned, len(sentences)))
+                                  for sentences in paragraph_sentences)
+        else:
+            cleaned_paragraphs = (self.assemble_paragraph(itertools.chain.from_iterable(
+                self._sentence_cleaner(sentence) for sentence in sentences)) for sentences in paragraph_sentences)
+
+        return [self.assemble_text(itertools.islice(cleaned_paragraphs, count)) for count in paragraph_counts]
+
+    def process(
+            self,
+            input_data: Union[str, List[str], Iterator[str]],
+    ) -> Generator[str, None, None]:
+        """ window_size個ずつまとめて処理し、入力の順番で返す """
+        if self._window_size <= 1:
+            yield from super().process(input_data)
+            return
+        texts = iter([input_data]) if isinstance(input_data, str) else iter(input_data)
+        while True:
+            window = list(itertools.islice(texts, self._window_size))
+            if not window:
+                return
+            yield from self.process_batch(window)
 
 
 if __name__ == "__main__":
@@ -124,17 +235,12 @@ if __name__ == "__main__":
     from util.versatile_tool import stop_watch
     from cleaner.filter_mecab import PartsFilterMecab
 
-    import functools
-    from ja_sentence_segmenter.concatenate.simple_concatenator import concatenate_matching
-    from ja_sentence_segmenter.normalize.neologd_normalizer import normalize
-    from ja_sentence_segmenter.split.simple_splitter import split_newline, split_punctuation
+    from cleaner.splitter_fused_ja import FusedSplitJa
 
     parts_filter = PartsFilterMecab(threshold=0.9, min_length=10, parts_index=4, split_key="-")
     # parts_filter = PartsFilterMecab(threshold=0.9, min_length=10, parts_index=1, split_key=",")
 
-    split_punc2 = functools.partial(split_punctuation, punctuations=r"。!?")
-    concat_tail_te = functools.partial(concatenate_matching, remove_former_matched=False)
-    splitter = make_pipeline(normalize, split_newline, concat_tail_te, split_punc2)
+    splitter = FusedSplitJa(punctuations=r"。!?")
 
     cleaner = ParagraphCleaningDirector(
         paragraph_splitter=splitter,
@@ -157,3 +263,72 @@ if __name__ == "__main__":
 
 
     func()
+
+    # 以前の処理との比較（長い文書での中間リストのメモリ量と速度）
+    import tracemalloc
+
+
+    def process_handling_legacy(director: ParagraphCleaningDirector, text: str) -> str:
+        """
+        以前のprocess_handling()（比較用）
+        文書全体の List[段落], List[List[文]] などを段階ごとに作ってから処理する
+        """
+        paragraphs = director.split_text_into_paragraphs(text)
+        paragraphs_divided_into_sentences = director.split_paragraphs_into_sentences(paragraphs)
+        new_paragraphs = director.paragraphs_cleaner(paragraphs_divided_into_sentences)
+        new_paragraphs = director.clean_line_endings(new_paragraphs, director._sentence_endings)
+        new_paragraphs = director.concat_sentences_into_paragraphs(new_paragraphs)
+        new_paragraphs = director.remove_duplicate_elements(new_paragraphs)
+        return director.concat_paragraphs_into_text(new_paragraphs)
+
+
+    long_text = "\n".join(texts[0].splitlines() * 3_000)
+    assert cleaner.process_handling(long_text) == process_handling_legacy(cleaner, long_text)
+
+
+    def peak_memory(func, text: str) -> int:
+        tracemalloc.start()
+        func(text)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+
+
+    @stop_watch
+    def func_legacy():
+        return process_handling_legacy(cleaner, long_text)
+
+
+    @stop_watch
+    def func_streaming():
+        return cleaner.process_handling(long_text)
+
+
+    func_legacy()
+    func_streaming()
+    print(f'text: {len(long_text.encode("utf-8")) / 1024 ** 2:.2f}MB, '
+          f'peak legacy: {peak_memory(lambda text: process_handling_legacy(cleaner, text), long_text) / 1024 ** 2:.2f}MB, '
+          f'streaming: {peak_memory(cleaner.process_handling, long_text) / 1024 ** 2:.2f}MB')
+    # legacy: 0.29s, streaming: 0.31s / ピークメモリ legacy: 18MB, streaming: 1.2MB 程度（文書 1.5MB）
+    # streamingも文書内のcacheで、繰り返し出てくる文の解析は1回だけ
+
+    # 複数の文書の文をまとめてsentence_cleaner.process_batch()に渡す場合
+    windowed_cleaner = ParagraphCleaningDirector(
+        paragraph_splitter=splitter,
+        sentence_cleaner=parts_filter,
+        window_size=64,
+    )
+    many_texts = texts * 500
+
+
+    @stop_watch
+    def func_each():
+        return list(cleaner(many_texts))
+
+
+    @stop_watch
+    def func_window():
+        return list(windowed_cleaner(iter(many_texts)))
+
+
+    assert func_each() == func_window()
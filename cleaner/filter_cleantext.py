@@ -2,30 +2,80 @@
 
 from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload, Type, Any
 from collections import Counter
+import re
 
 from cleantext import clean
+from cleantext.clean import fix_strange_quotes, normalize_whitespace, replace_urls, replace_emails, replace_phone_numbers
+from cleantext.specials import specials_map, escape_sequence
+from emoji import emojize
 
 from util.text_tool_base import TextProcessorBase
 
 
+# ASCIIのうち、fix_bad_unicode()で変化しうる文字
+UNSAFE_ASCII_RE = re.compile(r'[\\&\x00-\x08\x0b-\x1f\x7f]')
+
+
 class FilterCleantext(TextProcessorBase):
     """
     以下を参考にしました
     https://github.com/jfilter/clean-text
 
     !pip install clean-text[gpl]
+
+    fast_path=Trueの場合、clean()の fix_unicode（ftfy）と to_ascii（unidecode）で変化しないことが明らかなASCIIのtextは、
+    その2つを飛ばして 引用符の置換, emojize, URL・メール・電話番号の置換, 空白の正規化 だけを行います（結果はclean()と同じ）
     """
 
     def __init__(
             self,
             lang: str = 'en',
+            fast_path: bool = True,
     ):
         self._lang = lang
+        self._fast_path: bool = fast_path
+        # save_replace()の戻し処理で変化しうる文字列
+        self._unsafe_substring: Optional[str] = escape_sequence if lang.lower() in specials_map else None
+
+    def is_clean_ascii(
+            self,
+            text: str,
+    ) -> bool:
+        """
+        fix_bad_unicode()とunidecode()でtextが変わらないか
+        - ASCII以外の文字: unidecode, ftfyで変わる
+        - "\\": unicode-escapeのデコードで変わる
+        - "&": ftfyでHTMLエンティティとして変わる
+        - "\r", 制御文字: ftfyで改行の統一・制御文字の除去が行われる
+        """
+        if not text.isascii() or UNSAFE_ASCII_RE.search(text):
+            return False
+        return self._unsafe_substring is None or self._unsafe_substring not in text
+
+    def clean_ascii(
+            self,
+            text: str,
+    ) -> str:
+        """
+        is_clean_ascii(text)がTrueのtextに対して、process_handling()のclean()と同じ処理を行う
+        """
+        text = fix_strange_quotes(text)
+        if ':' in text:
+            text = emojize(text, language="alias")
+        text = replace_urls(text, "")
+        text = replace_emails(text, "")
+        text = replace_phone_numbers(text, "")
+        return normalize_whitespace(text, no_line_breaks=False, strip_lines=True, keep_two_line_breaks=False)
 
     def process_handling(
             self,
             text: str,
     ) -> str:
+        if text is None:
+            return ""
+        if self._fast_path and self.is_clean_ascii(text):
+            return self.clean_ascii(text)
+
         clean_text = clean(text,
                            fix_unicode=True,  # fix various unicode errors
                            to_ascii=True,  # transliterate to closest ASCII representation
@@ -53,7 +103,7 @@ class FilterCleantext(TextProcessorBase):
 
 if __name__ == "__main__":
     '''
-    > python -m cleaner.filter_hojichar
+    > python -m cleaner.filter_cleantext
     '''
 
     from util.versatile_tool import stop_watch
@@ -80,3 +130,30 @@ if __name__ == "__main__":
 
 
     func()
+
+    # clean()との一致確認と速度比較
+    texts = [
+        'Between the golden-yellow lotus leaves and stalks, we see swaying white lotus flowers with thick black.\n\n',
+        'Contact us at info@example.com or call 555-123-4567. Visit https://example.com/about   for more.',
+        "It's a `quoted` text :thumbs_up: with\ttabs and \r\n line breaks & entities &amp; \\n",
+        'Caf\u00e9 na\u00efve r\u00e9sum\u00e9 \u201cquoted\u201d \u2014 \u3053\u3093\u306b\u3061\u306f',
+    ]
+    reference_filter = FilterCleantext(fast_path=False)
+    for text in texts:
+        assert parts_filter.process_handling(text) == reference_filter.process_handling(text)
+
+    texts = texts[:2] * 5_000
+
+
+    @stop_watch
+    def func_clean():
+        return [reference_filter.process_handling(text) for text in texts]
+
+
+    @stop_watch
+    def func_fast_path():
+        return [parts_filter.process_handling(text) for text in texts]
+
+
+    assert func_clean() == func_fast_path()
+    # clean(): 1.61s, fast_path: 0.46s 程度
@@ -4,7 +4,7 @@ from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, over
 from collections import Counter
 
 import hojichar
-from hojichar import Compose, document_filters
+from hojichar import Compose, Document, document_filters
 import json
 
 from util.text_tool_base import TextProcessorBase
@@ -80,6 +80,19 @@ class FilterHojichar(TextProcessorBase):
         text = json.loads(parsed)["text"]
         return text
 
+    def reject_reason(
+            self,
+            text: str,
+    ) -> Optional[str]:
+        """
+        textを除去するフィルタの名前（e.g. '3-DocumentLengthFilter'）、残す場合はNone
+        """
+        document = self._cleaner.apply(Document(json.dumps({"text": text})))
+        if not document.is_rejected:
+            return None
+        reason = getattr(document, 'reject_reason', None)
+        return reason.get('name', 'rejected') if isinstance(reason, dict) else 'rejected'
+
 
 if __name__ == "__main__":
     '''
@@ -0,0 +1,444 @@
+# coding: UTF-8
+
+import re
+from collections import deque
+from os import PathLike
+from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, Any
+
+import hojichar
+from hojichar import Document, document_filters
+
+from cleaner.filter_hojichar import base_path
+
+# NgWordsFilterJa(ignore_confused=True)でカタカナとして扱う文字
+KATAKANA_RE = re.compile(r"[ァ-ヴー]+")
+
+_fold_table: Optional[Dict[str, str]] = None
+
+
+def fold_table() -> Dict[str, str]:
+    """
+    re.IGNORECASEでASCIIの英字に一致する文字 -> 小文字の英字 の変換テーブル
+    大文字の英字の他に、'İ', 'ı', 'ſ', 'K'（ケルビン記号）なども含む
+    """
+    global _fold_table
+    if _fold_table is None:
+        letters = re.compile('[a-z]', re.IGNORECASE)
+        table = {}
+        for code in range(0x10000):
+            c = chr(code)
+            if not ('a' <= c <= 'z') and letters.fullmatch(c):
+                table[c] = next(a for a in 'abcdefghijklmnopqrstuvwxyz' if re.fullmatch(a, c, re.IGNORECASE))
+        _fold_table = table
+    return _fold_table
+
+
+def load_keywords(dict_path: Union[str, PathLike]) -> List[str]:
+    """ hojicharのNgWordsFilterJa, NgWordsFilterEn, DiscardAdsと同じ読み込み方 """
+    with open(dict_path, encoding="utf-8") as fp:
+        words = fp.read().split("\n")
+    return [w.strip() for w in words if not len(w) == 0]
+
+
+class KeywordAutomaton(object):
+    def __init__(
+            self,
+            keywords: List[str],
+    ):
+        """
+        Aho-Corasick法で、複数のキーワードの出現位置をtextの1回の走査で全て見つける
+        scan()は (開始位置, キーワードの番号) を終了位置の順に返す（重なる出現も全て返す）
+        match_at()は、指定した位置から始まるキーワードだけをトライを辿って探す
+        """
+        self.keywords: List[str] = keywords
+        self._goto: List[Dict[str, int]] = [{}]
+        # 状態で終わるキーワードの番号（失敗遷移先のものは含まない）
+        self._ends: List[Tuple[int, ...]] = [()]
+        # 状態で終わるキーワードの (番号, 長さ)（失敗遷移先のものも含む）
+        self._outputs: List[Tuple[Tuple[int, int], ...]] = [()]
+        fail = [0]
+
+        for index, keyword in enumerate(keywords):
+            state = 0
+            for c in keyword:
+                next_state = self._goto[state].get(c)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._ends.append(())
+                    self._outputs.append(())
+                    fail.append(0)
+                    self._goto[state][c] = next_state
+                state = next_state
+            self._ends[state] = self._ends[state] + (index,)
+            self._outputs[state] = self._outputs[state] + ((index, len(keyword)),)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                f = fail[state]
+                while f and c not in self._goto[f]:
+                    f = fail[f]
+                f = self._goto[f].get(c, 0)
+                fail[next_state] = f if f != next_state else 0
+                self._outputs[next_state] = self._outputs[next_state] + self._outputs[fail[next_state]]
+        self._fail: List[int] = fail
+
+    def scan(
+            self,
+            text: str,
+    ) -> List[Tuple[int, int]]:
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        hits = []
+        state = 0
+        for i, c in enumerate(text):
+            while True:
+                next_state = goto[state].get(c)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            if outputs[state]:
+                hits.extend((i + 1 - length, index) for index, length in outputs[state])
+        return hits
+
+    def match_at(
+            self,
+            text: str,
+            start: int,
+            table: Optional[Dict[str, str]] = None,
+    ) -> List[Tuple[int, int]]:
+        """ text[start:]の先頭に一致するキーワードの (番号, 終了位置)（tableで文字を変換してから比べる） """
+        goto = self._goto
+        ends = self._ends
+        hits = []
+        state = 0
+        for j in range(start, len(text)):
+            c = text[j]
+            if table is not None:
+                c = table.get(c, c)
+            state = goto[state].get(c)
+            if state is None:
+                break
+            for index in ends[state]:
+                hits.append((index, j + 1))
+        return hits
+
+
+class DiscardKeywords(hojichar.Filter):
+    """
+    hojicharのキーワードによるフィルタ（NgWordsFilterJa, NgWordsFilterEn, DiscardAds とそのサブクラス）を
+    1つのAho-Corasickのオートマトンにまとめ、文書を1回だけ走査してカテゴリごとに判定するフィルタ
+    判定は元のフィルタと同じ（いずれかのカテゴリで除去される文書を除去する）
+
+        DiscardKeywords([
+            ('adult_ja', 'ja', base_path + "adult_keywords_ja.txt"),
+            ('adult_en', 'en', base_path + "adult_keywords_en.txt"),
+            ('ads', 'count', base_path + "advertisement_keywords_ja.txt"),
+        ])
+
+    categories: (名前, 種類, 辞書のパス[, 設定]) のリスト
+    - 'ja': NgWordsFilterJa と同じ。キーワードを含む文書を除去
+            設定 {'ignore_confused': True} の場合、カタカナのキーワードは前後がカタカナでない場合のみ
+    - 'en': NgWordsFilterEn と同じ。大文字小文字を区別せず、前が文書の先頭か空白、
+            後ろが空白・','・'.'・文書の末尾（末尾の改行の前を含む）のキーワードを含む文書を除去
+    - 'count': DiscardAds と同じ。正規表現のfindall()と同じく、左から重ならないように
+               （同じ位置では辞書の先の方のキーワードを優先して）数え、設定 {'max_allowed_num': 14} より多い文書を除去
+
+    'ja', 'count'のカテゴリは1つのオートマトンでtextを1回走査し、
+    'en'のカテゴリは文書の先頭と空白の次の位置からだけ、re.IGNORECASEと同じように英字を小文字にしてトライを辿ります
+    キーワードが空のカテゴリ（空の辞書など、元の正規表現が空文字列に一致する場合）や、
+    'en'で英字以外を含むキーワードがあるカテゴリは、元のフィルタの正規表現で判定します
+    除去したカテゴリの名前は self.matched_category に入ります
+    """
+
+    def __init__(
+            self,
+            categories: List[Tuple[Any, ...]],
+            *args: Any,
+            **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._names: List[str] = []
+        self._modes: List[str] = []
+        self._options: List[Dict[str, Any]] = []
+        # 正規表現で判定するカテゴリの元のフィルタ
+        self._fallbacks: Dict[int, hojichar.Filter] = {}
+
+        # キーワードの番号 -> (カテゴリの番号, 辞書の中の番号, キーワード)
+        keywords: Dict[str, List[str]] = {'exact': [], 'en': []}
+        self._keyword_info: Dict[str, List[Tuple[int, int, str]]] = {'exact': [], 'en': []}
+
+        for c, category in enumerate(categories):
+            name, mode, dict_path = category[:3]
+            options = category[3] if len(category) > 3 else {}
+            assert mode in ('ja', 'en', 'count'), f'unknown mode: {mode}'
+            self._names.append(name)
+            self._modes.append(mode)
+            self._options.append(options)
+
+            words = load_keywords(dict_path)
+            if self.needs_fallback(mode, words, options):
+                self._fallbacks[c] = self.make_fallback(mode, dict_path, options)
+                continue
+            kind = 'en' if mode == 'en' else 'exact'
+            table = fold_table() if mode == 'en' else {}
+            for k, word in enumerate(words):
+                keywords[kind].append(''.join(table.get(ch, ch) for ch in word))
+                self._keyword_info[kind].append((c, k, word))
+
+        self._automaton = KeywordAutomaton(keywords['exact'])
+        self._en_trie = KeywordAutomaton(keywords['en'])
+        # 'en'のキーワードが始まりうる位置（文書の先頭か空白の次で、キーワードの先頭の文字）
+        first_chars = ''.join(map(re.escape, sorted({word[0] for word in keywords['en']})))
+        self._en_starts = re.compile(rf'(?:^|(?<= ))[{first_chars}]', re.IGNORECASE) if first_chars else None
+        self.matched_category: Optional[str] = None
+
+    @staticmethod
+    def needs_fallback(
+            mode: str,
+            words: List[str],
+            options: Dict[str, Any],
+    ) -> bool:
+        """ 元の正規表現が空文字列に一致する場合など、オートマトンでは同じ判定にならない場合 """
+        if not words or '' in words:
+            return True
+        if mode == 'ja' and options.get('ignore_confused', False):
+            katakana = [bool(KATAKANA_RE.fullmatch(w)) for w in words]
+            return all(katakana) or not any(katakana)
+        if mode == 'en':
+            return not all(w.isascii() for w in words)
+        return False
+
+    @staticmethod
+    def make_fallback(
+            mode: str,
+            dict_path: Union[str, PathLike],
+            options: Dict[str, Any],
+    ) -> hojichar.Filter:
+        if mode == 'ja':
+            return document_filters.NgWordsFilterJa(dict_path, ignore_confused=options.get('ignore_confused', False))
+        if mode == 'en':
+            return document_filters.NgWordsFilterEn(dict_path)
+        return document_filters.DiscardAds(dict_path, max_allowed_num=options.get('max_allowed_num', 14))
+
+    @staticmethod
+    def is_en_boundary(
+            text: str,
+            start: int,
+            end: int,
+    ) -> bool:
+        """ (?:^| )キーワード(?:( |,|\\.)|$) の前後の条件 """
+        if start > 0 and text[start - 1] != ' ':
+            return False
+        n = len(text)
+        return end == n or text[end] in ' ,.' or (end == n - 1 and text[end] == '\n')
+
+    @staticmethod
+    def is_katakana_boundary(
+            text: str,
+            start: int,
+            end: int,
+    ) -> bool:
+        """ (?<![ァ-ヴー])キーワード(?![ァ-ヴー]) の前後の条件 """
+        return (start == 0 or not KATAKANA_RE.match(text[start - 1])) and \
+            (end == len(text) or not KATAKANA_RE.match(text[end]))
+
+    @staticmethod
+    def count_leftmost(
+            occurrences: List[Tuple[int, int, int]],
+    ) -> int:
+        """
+        (開始位置, 辞書の中の番号, 終了位置) の出現から、正規表現のfindall()と同じように
+        左から重ならないように選んだ数（同じ開始位置では辞書の中の番号が小さいものを選ぶ）
+        """
+        count = 0
+        position = 0
+        for start, _, end in sorted(occurrences):
+            if start < position:
+                continue
+            count += 1
+            position = end
+        return count
+
+    def find_en(
+            self,
+            text: str,
+            found: List[bool],
+    ):
+        """ 'en'のカテゴリのキーワードを、文書の先頭と空白の次の位置から探す """
+        info = self._keyword_info['en']
+        remaining = {c for c, _, _ in info}
+        table = fold_table()
+        for match in self._en_starts.finditer(text):
+            start = match.start()
+            for index, end in self._en_trie.match_at(text, start, table):
+                c = info[index][0]
+                if c in remaining and self.is_en_boundary(text, start, end):
+                    found[c] = True
+                    remaining.discard(c)
+            if not remaining:
+                return
+
+    def judge(
+            self,
+            text: str,
+    ) -> Optional[str]:
+        """ textを除去するカテゴリの名前（残す場合はNone） """
+        found = [False] * len(self._names)
+        counts: Dict[int, List[Tuple[int, int, int]]] = {}
+        info = self._keyword_info['exact']
+        if info:
+            for start, index in self._automaton.scan(text):
+                c, k, word = info[index]
+                if found[c]:
+                    continue
+                end = start + len(word)
+                if self._modes[c] == 'ja':
+                    found[c] = not (self._options[c].get('ignore_confused', False) and KATAKANA_RE.fullmatch(word)) \
+                               or self.is_katakana_boundary(text, start, end)
+                else:
+                    counts.setdefault(c, []).append((start, k, end))
+        if self._keyword_info['en']:
+            self.find_en(text, found)
+
+        for c, name in enumerate(self._names):
+            if c in self._fallbacks:
+                if self._fallbacks[c].apply(Document(text)).is_rejected:
+                    return name
+            elif self._modes[c] == 'count':
+                if self.count_leftmost(counts.get(c, [])) > self._options[c].get('max_allowed_num', 14):
+                    return name
+            elif found[c]:
+                return name
+        return None
+
+    def apply(self, doc: Document) -> Document:
+        self.matched_category = self.judge(doc.text)
+        if self.matched_category is not None:
+            doc.is_rejected = True
+        return doc
+
+
+JA_KEYWORD_CATEGORIES: List[Tuple[Any, ...]] = [
+    ('adult_ja', 'ja', base_path + "adult_keywords_ja.txt"),
+    ('adult_en', 'en', base_path + "adult_keywords_en.txt"),
+    ('discrimination_ja', 'ja', base_path + "discrimination_keywords_ja.txt"),
+    ('violence_ja', 'ja', base_path + "violence_keywords_ja.txt"),
+    ('ads', 'count', base_path + "advertisement_keywords_ja.txt", {'max_allowed_num': 14}),
+]
+
+EN_KEYWORD_CATEGORIES: List[Tuple[Any, ...]] = [
+    ('adult_en', 'en', base_path + "adult_keywords_en.txt"),
+    ('ng_en', 'en', base_path + "ng_keywords_en.txt"),
+]
+
+# JA_LIST, EN_LIST のキーワードのフィルタをDiscardKeywordsにまとめたもの（判定は同じ）
+# キーワードのフィルタの間のDiscardBBSCommentsは文書を変更しないので、順番を入れ替えても結果は変わらない
+JA_LIST_FAST: List[hojichar.Filter] = [
+    document_filters.JSONLoader(key="text"),
+    document_filters.AcceptJapanese(),
+    document_filters.DiscardRareKuten(),
+    document_filters.DocumentLengthFilter(min_doc_len=100, max_doc_len=50000),
+    DiscardKeywords(JA_KEYWORD_CATEGORIES),
+    document_filters.DiscardBBSComments(),
+    document_filters.MaskPersonalInformation(),
+    document_filters.JSONDumper()
+]
+
+EN_LIST_FAST: List[hojichar.Filter] = [
+    document_filters.JSONLoader(key="text"),
+    document_filters.DocumentLengthFilter(min_doc_len=100, max_doc_len=50000),
+    DiscardKeywords(EN_KEYWORD_CATEGORIES),
+    document_filters.DiscardBBSComments(),
+    document_filters.MaskPersonalInformation(),
+    document_filters.JSONDumper()
+]
+
+
+if __name__ == "__main__":
+    '''
+    > python -m cleaner.filter_keyword
+    '''
+    import random
+
+    from util.versatile_tool import stop_watch
+    from cleaner.filter_hojichar import FilterHojichar, JA_LIST, EN_LIST
+
+    rng = random.Random(0)
+    ja_words = {name: load_keywords(path) for name, _, path, *_ in JA_KEYWORD_CATEGORIES}
+    en_words = load_keywords(base_path + "adult_keywords_en.txt")
+    base_ja = "吾輩は猫である。名前はまだ無い。どこで生れたかとんと見当がつかぬ。何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。"
+    base_en = "Between the golden-yellow lotus leaves and stalks, we see swaying white lotus flowers with thick black."
+
+
+    def random_en_word() -> str:
+        word = rng.choice(en_words)
+        word = ''.join(c.upper() if rng.random() < 0.3 else c for c in word)
+        return word.replace('k', 'K') if rng.random() < 0.1 else word
+
+
+    def make_document() -> str:
+        pieces = [base_ja[:rng.randint(0, len(base_ja))], base_en[:rng.randint(0, len(base_en))]]
+        for _ in range(rng.choice([0, 0, 1, 3, 20])):
+            kind = rng.random()
+            if kind < 0.15:
+                pieces.append(rng.choice(ja_words['adult_ja']))
+            elif kind < 0.25:
+                pieces.append(rng.choice(ja_words['discrimination_ja'] + ja_words['violence_ja']))
+            elif kind < 0.45:
+                pieces.append(rng.choice(['', ' ', 'x']) + random_en_word() + rng.choice(['', ' ', ',', '.', '\n', 's']))
+            else:
+                pieces.append(rng.choice(ja_words['ads']))
+        rng.shuffle(pieces)
+        return rng.choice(['', ' ', '\n']).join(pieces) * rng.choice([1, 1, 3])
+
+
+    texts = [make_document() for _ in range(3_000)]
+
+    # カテゴリごとに元のフィルタと同じ判定
+    fast = DiscardKeywords(JA_KEYWORD_CATEGORIES)
+    originals = [
+        document_filters.DiscardAdultContentJa(base_path + "adult_keywords_ja.txt"),
+        document_filters.DiscardAdultContentEn(base_path + "adult_keywords_en.txt"),
+        document_filters.DiscardDiscriminationContentJa(base_path + "discrimination_keywords_ja.txt"),
+        document_filters.DiscardViolenceContentJa(base_path + "violence_keywords_ja.txt"),
+        document_filters.DiscardAds(base_path + "advertisement_keywords_ja.txt"),
+    ]
+    for text in texts:
+        expected = next((name for (name, *_), original in zip(JA_KEYWORD_CATEGORIES, originals)
+                         if original.apply(Document(text)).is_rejected), None)
+        assert fast.judge(text) == expected, (text, fast.judge(text), expected)
+
+    katakana = DiscardKeywords([('adult_ja', 'ja', base_path + "adult_keywords_ja.txt", {'ignore_confused': True})])
+    original = document_filters.NgWordsFilterJa(base_path + "adult_keywords_ja.txt", ignore_confused=True)
+    for text in texts:
+        assert (katakana.judge(text) is not None) == original.apply(Document(text)).is_rejected
+
+    # JA_LIST, EN_LIST と同じ結果
+    for slow_list, fast_list in ((JA_LIST, JA_LIST_FAST), (EN_LIST, EN_LIST_FAST)):
+        slow_filter = FilterHojichar(filter_list=slow_list)
+        fast_filter = FilterHojichar(filter_list=fast_list)
+
+
+        @stop_watch
+        def func_hojichar():
+            return list(slow_filter(texts))
+
+
+        @stop_watch
+        def func_keyword():
+            return list(fast_filter(texts))
+
+
+        slow_results = func_hojichar()
+        fast_results = func_keyword()
+        assert slow_results == fast_results
+        print(sum(1 for text in slow_results if text), len(texts))
+    # JA_LIST: 0.53s -> 0.24s, EN_LIST: 0.23s -> 0.24s 程度（EN_LISTのキーワードのフィルタは1回の走査で済むものだけなので差がない）
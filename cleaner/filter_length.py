@@ -0,0 +1,61 @@
+# coding: UTF-8
+
+from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from util.text_tool_base import TextProcessorBase
+
+
+class TextLengthFilter(TextProcessorBase):
+    """
+    文字数が min_length 以上 max_length 以下のtextのみを残す（それ以外は""を返す）
+    ArrowPipelineではpyarrow.compute.utf8_length()で列のまま判定します
+    """
+
+    def __init__(
+            self,
+            min_length: int = 0,
+            max_length: Optional[int] = None,
+    ):
+        self._min_length: int = min_length
+        self._max_length: Optional[int] = max_length
+
+    def process_handling(
+            self,
+            text: str,
+    ) -> str:
+        if text is None:
+            return ""
+        length = len(text)
+        if length < self._min_length or (self._max_length is not None and length > self._max_length):
+            return ""
+        return text
+
+    def arrow_handling(
+            self,
+            texts: pa.Array,
+    ) -> pa.Array:
+        lengths = pc.utf8_length(texts)
+        mask = pc.greater_equal(lengths, self._min_length)
+        if self._max_length is not None:
+            mask = pc.and_(mask, pc.less_equal(lengths, self._max_length))
+        return pc.if_else(mask, texts, pa.scalar('', type=texts.type))
+
+
+if __name__ == "__main__":
+    '''
+    > python -m cleaner.filter_length
+    '''
+
+    texts = [
+        'まとめ|エキサイトブログ生八つ橋のタグまとめ.',
+        'ブログ、生八つ橋。',
+        '',
+    ]
+
+    length_filter = TextLengthFilter(min_length=10, max_length=100)
+    for text in length_filter(texts):
+        print(repr(text))
+    print(length_filter.arrow_handling(pa.array(texts)).to_pylist())
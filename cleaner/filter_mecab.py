@@ -3,10 +3,10 @@ from collections import Counter
 
 import MeCab
 
-from util.text_tool_base import TextProcessorBase
+from cleaner.parts_filter_base import PartsFilterBase
 
 
-class PartsFilterMecab(TextProcessorBase):
+class PartsFilterMecab(PartsFilterBase):
     """
     以下を参考にしました
     https://github.com/KanHatakeyama/JapaneseWarcParser/blob/main/mc4s/src/cleaner/parts_filter.py
@@ -37,13 +37,19 @@ class PartsFilterMecab(TextProcessorBase):
             parts_index: int = 4,
             split_key: str = "-",
     ):
-        self._target_parts: List[str] = ['名詞', '記号', '補助記号'] if target_parts is None else target_parts
-        self._threshold: float = threshold
-        self._min_length: int = min_length
+        super().__init__(
+            target_parts=['名詞', '記号', '補助記号'] if target_parts is None else target_parts,
+            threshold=threshold,
+            min_length=min_length,
+        )
         self._parts_index: int = parts_index
         self._split_key: str = split_key
         self._tagger = MeCab.Tagger()
 
+    def count_tag(self, tag: str) -> bool:
+        """ MeCabでは記号を含む全ての形態素を数える """
+        return True
+
     def parts_count(
             self,
             text: str,
@@ -83,27 +89,43 @@ class PartsFilterMecab(TextProcessorBase):
         else:
             return pos_counter, all_counts
 
-    def process_handling(
+    def parsed_tags(
             self,
-            text: str,
-    ) -> str:
-        if text is None:
-            # return None
-            return ""
-
-        pos_counter, all_counts = self.parts_count(text, return_word_count=False)
-
-        parts_counts = 0
-        for parts in self._target_parts:
-            parts_counts += pos_counter.get(parts, 0)
-
-        ratio = parts_counts / all_counts
-        # print(ratio, pos_counter)
+            parsed: str,
+    ) -> List[str]:
+        """ parseの結果から、形態素ごとの品詞のリスト """
+        parts_index = self._parts_index
+        split_key = self._split_key
+        return [line.split('\t')[parts_index].split(split_key)[0] for line in parsed.split('\n')
+                if line != 'EOS' and line != '']
+
+    def tags(self, text: str) -> List[str]:
+        return self.parsed_tags(self._tagger.parse(text))
+
+    def parts_count_batch(
+            self,
+            texts: List[str],
+    ) -> List[Tuple[Counter, int]]:
+        """ tags_batch()の結果から、文ごとに品詞を数える """
+        return [(Counter(tags), len(tags)) for tags in self.tags_batch(texts)]
 
-        if ratio > self._threshold and len(text) > self._min_length:
-            # return None
-            return ""
-        return text
+    def tags_batch(
+            self,
+            texts: List[str],
+    ) -> List[List[str]]:
+        """
+        同じ文は1回だけparseする（ウェブの文書には定型文が繰り返し出てくるため）
+        MeCabの解析結果は前後の語に影響されるので、複数の文を連結して1回でparseすることはせず、
+        1文ずつparseする（結果はtags()を1文ずつ呼んだ場合と同じ）
+        """
+        cache: Dict[str, List[str]] = {}
+        tags_list = []
+        for text in texts:
+            tags = cache.get(text)
+            if tags is None:
+                tags = cache[text] = self.tags(text)
+            tags_list.append(tags)
+        return tags_list
 
 
 if __name__ == "__main__":
@@ -138,3 +160,45 @@ if __name__ == "__main__":
             # pass
 
     func()
+
+    # 1文ずつparseした場合と、同じ文を1回だけparseした場合の比較
+    # （定型文が半分、残りは文書ごとに異なる文。結果は常に同じ）
+    parts_filter = PartsFilterMecab(threshold=0.5, min_length=3, parts_index=4, split_key="-")
+    sentences = [
+        '吾輩は猫である。', '名前はまだ無い。', 'どこで生れたかとんと見当がつかぬ。',
+        '何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。',
+        'まとめ|エキサイトブログ生八つ橋のタグまとめ。', 'ブログ、生八つ橋、日記、記録、写真、レビュー、噂、まとめ。',
+    ]
+    texts = [sentences[i % 6] if i % 2 else f'{i}番目の記事では{sentences[i % 6]}' for i in range(12_000)]
+
+
+    @stop_watch
+    def func_each():
+        return [parts_filter.process_handling(text) for text in texts]
+
+
+    @stop_watch
+    def func_batch():
+        return parts_filter.process_batch(texts)
+
+
+    assert func_each() == func_batch()
+    # unidic-liteの場合、1文ずつ: 0.47s, 同じ文を1回だけparse: 0.20s 程度
+
+    # parts_count()とjudge()で1文ずつ判定した場合と、bincountでまとめて判定した場合の比較
+    parts_filter = PartsFilterMecab(threshold=0.5, min_length=3, parts_index=4, split_key="-")
+    texts = texts + ['', ' ', '　']
+
+
+    @stop_watch
+    def func_counter():
+        return [parts_filter.judge(text, *parts_filter.parts_count(text, return_word_count=False)) for text in texts]
+
+
+    @stop_watch
+    def func_bincount():
+        return parts_filter.process_batch(texts)
+
+
+    assert func_counter() == func_bincount()
+    # counter: 0.70s, bincount: 0.30s 程度（bincountの方は同じ文を1回だけparseする分も速い）
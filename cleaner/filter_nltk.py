@@ -3,10 +3,10 @@ from collections import Counter
 
 import nltk
 
-from util.text_tool_base import TextProcessorBase
+from cleaner.parts_filter_base import PartsFilterBase
 
 
-class PartsFilterNltk(TextProcessorBase):
+class PartsFilterNltk(PartsFilterBase):
     """
     以下を参考にしました
     https://github.com/KanHatakeyama/JapaneseWarcParser/blob/main/mc4s/src/cleaner/parts_filter.py
@@ -17,10 +17,18 @@ class PartsFilterNltk(TextProcessorBase):
             target_parts: Optional[List[str]] = None,
             threshold: float = 0.9,
             min_length: int = 10,
+            batch_size: int = 1000,
     ):
-        self._target_parts: List[str] = ['NN', 'NNS', 'NNPS', 'NNP', 'SYM'] if target_parts is None else target_parts
-        self._threshold: float = threshold
-        self._min_length: int = min_length
+        """
+        batch_size:
+            process_batch()で1回のpos_tag_sents()にまとめる文の数
+        """
+        super().__init__(
+            target_parts=['NN', 'NNS', 'NNPS', 'NNP', 'SYM'] if target_parts is None else target_parts,
+            threshold=threshold,
+            min_length=min_length,
+        )
+        self._batch_size: int = batch_size
 
         # word_tokenize（分かち書き）のダウンロード
         nltk.download('punkt')
@@ -34,7 +42,14 @@ class PartsFilterNltk(TextProcessorBase):
     ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
         morph = nltk.word_tokenize(text)
         parsed = nltk.pos_tag(morph)
+        return PartsFilterNltk.count_tags(parsed, return_word_count)
 
+    @staticmethod
+    def count_tags(
+            parsed: List[Tuple[str, str]],
+            return_word_count: bool
+    ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
+        """ pos_tag()の結果 [(単語, 品詞), ...] の品詞を数える """
         # 品詞をカウントするためのCounterオブジェクト
         pos_counter = Counter()
         word_counter = Counter()
@@ -54,29 +69,22 @@ class PartsFilterNltk(TextProcessorBase):
 
         return counts
 
-    def process_handling(
-            self,
-            text: str,
-    ) -> str:
-        if text is None:
-            # return None
-            return ""
-
-        pos_counter, all_counts = self.parts_count(text, return_word_count=False)
-
-        parts_counts = 0
-        for parts in self._target_parts:
-            parts_counts += pos_counter.get(parts, 0)
+    def tags(self, text: str) -> List[str]:
+        return [pos for _, pos in nltk.pos_tag(nltk.word_tokenize(text))]
 
-        # print(text, pos_counter, all_counts)
-        ratio = 1.0 if all_counts == 0 else parts_counts / all_counts
-        # ratio = parts_counts / all_counts
-        # print(ratio, pos_counter)
-
-        if ratio > self._threshold and len(text) > self._min_length:
-            # return None
-            return ""
-        return text
+    def tags_batch(
+            self,
+            texts: List[str],
+    ) -> List[List[str]]:
+        """
+        self._batch_size文ずつpos_tag_sents()の1回の呼び出しでまとめてタグ付けする
+        （タガーの取得と言語のチェックが、文ごとではなくbatch_size文ごとに1回になる）
+        """
+        tags_list = []
+        for head in range(0, len(texts), self._batch_size):
+            tagged = nltk.pos_tag_sents([nltk.word_tokenize(text) for text in texts[head:head + self._batch_size]])
+            tags_list.extend([pos for _, pos in parsed] for parsed in tagged)
+        return tags_list
 
 
 if __name__ == "__main__":
@@ -105,3 +113,11 @@ if __name__ == "__main__":
             pass
 
     func()
+
+
+    @stop_watch
+    def func_batch():
+        return parts_filter.process_batch(texts)
+
+
+    assert func_batch() == list(parts_filter(texts))
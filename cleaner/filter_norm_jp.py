@@ -1,11 +1,15 @@
 # coding: UTF-8
 
-from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload
+from typing import Callable, Generator, Iterator, List, Dict, Tuple, Union, Optional, overload
 from collections import Counter
 import re
 import unicodedata
 
+import pyarrow as pa
+import pyarrow.compute as pc
+
 from util.text_tool_base import TextProcessorBase
+from util.arrow_pipeline import PY_WHITESPACE, CONTEXT_SENSITIVE_LOWER, to_re2_class, divergent_chars, fix_divergent_rows
 
 UNICODE_PUNCT = {
     # 日本語の場合は句読点は、。のままがよいでしょう
@@ -259,6 +263,59 @@ class NormalizeFilterJp(TextProcessorBase):
         line = remove_non_printing_char(line)
         return line
 
+    def arrow_handling(
+            self,
+            texts: pa.Array,
+    ) -> pa.Array:
+        """
+        process_handling()と同じ処理をpyarrow.computeで列のまま行う
+        PythonとpyarrowでUnicodeのバージョンが違い結果が変わる文字や、前後の文字で小文字が変わるΣを含む行は、
+        process_handling()で処理し直す
+        """
+        steps = self.arrow_steps()
+        results = texts
+        for arrow_func, _ in steps:
+            results = arrow_func(results)
+        key = (type(self).__name__, self._accent, self._case, self._numbers, self._punct)
+        chars = divergent_chars(key, steps)
+        if self._case:
+            chars += CONTEXT_SENSITIVE_LOWER
+        return fix_divergent_rows(texts, results, chars, self.process_handling)
+
+    def arrow_steps(self) -> List[Tuple[Callable[[pa.Array], pa.Array], Callable[[str], str]]]:
+        """ process_handling()の各処理に対応する (pyarrow.computeの処理, Pythonの処理) のリスト """
+        steps = [(lambda a: pc.utf8_trim(a, characters=PY_WHITESPACE), lambda t: t.strip())]
+        if self._case:
+            steps.append((pc.utf8_lower, lambda t: t.lower()))
+        if self._accent:
+            steps.append((lambda a: pc.replace_substring_regex(pc.utf8_normalize(a, form='NFKC'),
+                                                               pattern=r'\p{Mn}', replacement=''),
+                          strip_accents))
+        if self._numbers:
+            steps.append((lambda a: pc.replace_substring_regex(a, pattern=r'\p{Nd}', replacement='0'),
+                          lambda t: DIGIT_RE.sub("0", t)))
+        if self._punct == 1:
+            steps.append((replace_unicode_punct_arrow, replace_unicode_punct))
+        elif self._punct == 2:
+            steps.append((lambda a: pc.replace_substring_regex(a, pattern=UNICODE_PUNCT_RE2, replacement=''),
+                          remove_unicode_punct))
+        steps.append((lambda a: pc.replace_substring_regex(a, pattern=NON_PRINTING_CHARS_RE2, replacement=''),
+                      remove_non_printing_char))
+        return steps
+
+
+# pyarrow.compute用（RE2）の文字クラス
+UNICODE_PUNCT_RE2 = to_re2_class(''.join(UNICODE_PUNCT.keys()))
+NON_PRINTING_CHARS_RE2 = to_re2_class(''.join(map(chr, list(range(0, 10)) + list(range(11, 32)) + list(range(127, 160)))))
+
+
+def replace_unicode_punct_arrow(texts: pa.Array) -> pa.Array:
+    """ replace_unicode_punct()と同じ置換（置換後の文字はUNICODE_PUNCTのキーに含まれないので順に置換してよい） """
+    for before, after in UNICODE_PUNCT.items():
+        if before != after:
+            texts = pc.replace_substring(texts, pattern=before, replacement=after)
+    return texts
+
 
 if __name__ == "__main__":
     '''
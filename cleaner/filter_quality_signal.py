@@ -0,0 +1,273 @@
+# coding: UTF-8
+
+from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload
+from collections import Counter
+import itertools
+
+import numpy as np
+
+from util.text_tool_base import TextProcessorBase
+from util.codepoint_tool import make_class_table, count_codepoint_classes, to_codepoints, segment_ids
+
+# 信号の名前 -> (最小値, 最大値)。Noneはその側を判定しない
+JA_RULES: Dict[str, Tuple[Optional[float], Optional[float]]] = {
+    'hiragana_ratio': (0.05, None),
+    'symbol_ratio': (None, 0.3),
+    'digit_ratio': (None, 0.3),
+    'kuten_density': (0.002, None),
+    'mean_line_length': (5, None),
+    'duplicate_line_ratio': (None, 0.5),
+}
+
+EN_RULES: Dict[str, Tuple[Optional[float], Optional[float]]] = {
+    'ascii_ratio': (0.9, None),
+    'latin_ratio': (0.5, None),
+    'symbol_ratio': (None, 0.25),
+    'digit_ratio': (None, 0.2),
+    'mean_line_length': (10, None),
+    'duplicate_line_ratio': (None, 0.5),
+}
+
+# str.splitlines()で行の区切りになる文字と、str.strip()で除かれる空白文字（isspace()）
+LINE_BREAKS: np.ndarray = np.array([0x0a, 0x0b, 0x0c, 0x0d, 0x1c, 0x1d, 0x1e, 0x85, 0x2028, 0x2029], dtype=np.uint32)
+WHITESPACES: np.ndarray = np.array([c for c in range(0x3001) if chr(c).isspace()], dtype=np.uint32)
+
+SIGNAL_NAMES: List[str] = [
+    'length', 'hiragana_ratio', 'katakana_ratio', 'kanji_ratio', 'latin_ratio', 'ascii_ratio',
+    'symbol_ratio', 'digit_ratio', 'kuten_density', 'mean_line_length', 'duplicate_line_ratio',
+]
+
+
+class QualitySignalFilter(TextProcessorBase):
+    """
+    文字種の割合などの軽い品質の信号で、明らかに質の低い文書を除去する（""を返す）
+    ParagraphCleaningDirector（MeCabなど）やhojicharの前に置き、重い処理に流す文書を減らすためのもの
+
+        quality_filter = QualitySignalFilter(rules=JA_RULES)
+        processor = make_pipeline(text_normalizer, quality_filter, paragraph_cleaner, text_filter)
+
+    batch_size個ずつ連結してUTF-32のコードポイント配列にし、numpyで文字種を一括で数えて信号を計算します
+    （duplicate_line_ratioだけは行のsetで数える）。空白文字は割合の分母に含めません
+
+    信号
+    - hiragana_ratio, katakana_ratio, kanji_ratio, latin_ratio（ASCIIの英字）, ascii_ratio, digit_ratio:
+      空白以外の文字に対する割合
+    - symbol_ratio: 記号（codepoint_toolの'punct'と、どの文字種にも含まれない'other'）の割合
+    - kuten_density: 「。」の数 / 空白以外の文字数
+    - mean_line_length: 空行（空白だけの行を含む）以外の行の平均文字数（空行の文字は数えない）
+    - duplicate_line_ratio: 空行（空白だけの行を含む）以外の行のうち、前に同じ行があるものの割合
+    - length: 文字数
+
+    rules: 信号の名前 -> (最小値, 最大値)。全ての信号が範囲内の文書を残す（JA_RULES, EN_RULES）
+    除去した文書の数は、最初に範囲外になった信号ごとに self.reasons に数える
+    """
+
+    def __init__(
+            self,
+            rules: Optional[Dict[str, Tuple[Optional[float], Optional[float]]]] = None,
+            batch_size: int = 1000,
+    ):
+        self._rules: Dict[str, Tuple[Optional[float], Optional[float]]] = JA_RULES if rules is None else rules
+        unknown = [name for name in self._rules if name not in SIGNAL_NAMES]
+        assert not unknown, f'unknown signals: {unknown}'
+        self._batch_size: int = batch_size
+
+        self._table, self._class_names = make_class_table()
+        index = {name: i for i, name in enumerate(self._class_names)}
+        self._space = index['space']
+        self._classes = {name: index[name] for name in ['hiragana', 'katakana', 'kanji', 'latin', 'digit']}
+        self._symbols = [index['punct'], index['other']]
+
+        # 除去した理由（信号の名前）ごとの件数
+        self.reasons: Counter = Counter()
+
+    @staticmethod
+    def duplicate_line_ratio(text: str) -> float:
+        lines = [line for line in text.splitlines() if line.strip()]
+        if not lines:
+            return 0.0
+        return 1.0 - len(set(lines)) / len(lines)
+
+    @staticmethod
+    def mean_line_length(
+            codepoints: np.ndarray,
+            ids: np.ndarray,
+            n: int,
+    ) -> np.ndarray:
+        """
+        to_codepoints()の結果から、textごとに空行（空白だけの行を含む）以外の行の平均文字数を計算する
+        duplicate_line_ratio()と同じく、splitlines()で分けた行のうち strip() が空でない行の len() の平均になる
+        """
+        if not len(codepoints):
+            return np.zeros(n, dtype=np.float64)
+        is_break = np.isin(codepoints, LINE_BREAKS)
+        # \r\n は1つの区切りなので、\n の位置では行を進めない
+        continued = np.zeros(len(codepoints), dtype=bool)
+        continued[1:] = (codepoints[1:] == 0x0a) & (codepoints[:-1] == 0x0d) & (ids[1:] == ids[:-1])
+        # 行の番号（全体で一意。textが変わるとidsが1つ増えるので、前のtextの最後の行と重ならない）
+        line_ids = np.cumsum(is_break & ~continued) + ids
+        line_count = int(line_ids[-1]) + 1
+        has_content = np.zeros(line_count, dtype=bool)
+        has_content[line_ids[~np.isin(codepoints, WHITESPACES)]] = True
+        line_text = np.zeros(line_count, dtype=np.int64)
+        line_text[line_ids] = ids
+
+        chars = np.bincount(ids[~is_break & has_content[line_ids]], minlength=n)
+        lines = np.bincount(line_text[has_content], minlength=n)
+        return chars / np.maximum(lines, 1)
+
+    def signals_batch(
+            self,
+            texts: List[str],
+    ) -> Dict[str, np.ndarray]:
+        """ textsの信号をまとめて計算し、信号の名前 -> 配列 を返す """
+        n = len(texts)
+        codepoints, lengths = to_codepoints(texts)
+        counts = count_codepoint_classes(codepoints, lengths, self._table, len(self._class_names))
+        ids = segment_ids(lengths)
+
+        non_space = lengths - counts[:, self._space]
+        denominator = np.maximum(non_space, 1)
+        signals = {'length': lengths.astype(np.float64)}
+        for name, i in self._classes.items():
+            signals[f'{name}_ratio'] = counts[:, i] / denominator
+        signals['symbol_ratio'] = counts[:, self._symbols].sum(axis=1) / denominator
+
+        is_ascii = (codepoints < 0x80) & (self._table[np.minimum(codepoints, 0x7f)] != self._space)
+        signals['ascii_ratio'] = np.bincount(ids[is_ascii], minlength=n) / denominator
+        signals['kuten_density'] = np.bincount(ids[codepoints == ord('。')], minlength=n) / denominator
+
+        signals['mean_line_length'] = self.mean_line_length(codepoints, ids, n)
+
+        if 'duplicate_line_ratio' in self._rules:
+            signals['duplicate_line_ratio'] = np.fromiter(map(self.duplicate_line_ratio, texts),
+                                                          dtype=np.float64, count=n)
+        return signals
+
+    def keep_mask(
+            self,
+            texts: List[str],
+    ) -> np.ndarray:
+        """ 残す文書のマスク（self.reasonsも数える） """
+        signals = self.signals_batch(texts)
+        keep = np.ones(len(texts), dtype=bool)
+        for name, (low, high) in self._rules.items():
+            violated = np.zeros(len(texts), dtype=bool)
+            if low is not None:
+                violated |= signals[name] < low
+            if high is not None:
+                violated |= signals[name] > high
+            violated &= keep
+            if violated.any():
+                self.reasons[name] += int(violated.sum())
+                keep &= ~violated
+        return keep
+
+    def process_handling(
+            self,
+            text: str,
+    ) -> str:
+        return self.process_batch([text])[0]
+
+    def process_batch(
+            self,
+            texts: List[str],
+    ) -> List[str]:
+        results = [""] * len(texts)
+        targets = [i for i, text in enumerate(texts) if text]
+        for head in range(0, len(targets), self._batch_size):
+            indices = targets[head:head + self._batch_size]
+            batch = [texts[i] for i in indices]
+            for i, text, kept in zip(indices, batch, self.keep_mask(batch).tolist()):
+                if kept:
+                    results[i] = text
+        return results
+
+    def process(
+            self,
+            input_data: Union[str, List[str], Iterator[str]],
+    ) -> Generator[str, None, None]:
+        """ batch_size個ずつまとめて処理し、入力の順番で返す """
+        texts = iter([input_data]) if isinstance(input_data, str) else iter(input_data)
+        while True:
+            window = list(itertools.islice(texts, self._batch_size))
+            if not window:
+                return
+            yield from self.process_batch(window)
+
+
+if __name__ == "__main__":
+    '''
+    > python -m cleaner.filter_quality_signal
+    '''
+
+    from util.text_tool_base import make_pipeline
+    from util.versatile_tool import stop_watch
+    from cleaner.filter_mecab import PartsFilterMecab
+    from cleaner.filter_norm_jp import NormalizeFilterJp
+    from cleaner.splitter_fused_ja import FusedSplitJa
+    from cleaner.director_paragraph_filter import ParagraphCleaningDirector
+
+    texts = [
+        "生八つ橋のタグまとめ | エキサイトブログ 生八つ橋のタグまとめ 「生八つ橋」のタグがついている新着記事と人気記事をまとめました。\nブログ（日記、記録、写真、レビュー、噂、まとめ）投稿。\n 京都旅行のお土産(我が家用)に色々な生八つ橋を買ってきました。我が家はみんな八つ橋ファンなのです～。",
+        "【エロ動画】くりくり瞳のショートヘアの女の子(*ﾟ∀ﾟ)=3 アダルトMAX-無修正と無料動画- TOP > エロ *ﾟ∀ﾟ =3 投稿日:2015-08-02 01:00:16 カテゴリー エロ*ﾟ∀ﾟ=3 [1]«73298 73299 73300 73301 73302 73303 73304»[138086]",
+        "ホーム\nニュース\nホーム\nニュース\nお問い合わせ\nホーム\nニュース",
+        "2015-08-02 01:00:16 | 73298 | 73299 | 73300 | 73301 | 73302 | 73303 | 73304",
+        "吾輩は猫である。名前はまだ無い。\nどこで生れたかとんと見当がつかぬ。何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。",
+        "Between the golden-yellow lotus leaves and stalks, we see swaying white lotus flowers with thick black.",
+    ]
+
+    quality_filter = QualitySignalFilter(rules=JA_RULES)
+    signals = quality_filter.signals_batch(texts)
+    for k, (text, kept) in enumerate(zip(texts, quality_filter.keep_mask(texts).tolist())):
+        print(kept, text[:20], {name: round(float(values[k]), 3) for name, values in signals.items()})
+    print(dict(quality_filter.reasons))
+
+    en_filter = QualitySignalFilter(rules=EN_RULES)
+    assert en_filter.process_batch(texts) == ["", "", "", "", "", texts[5]]
+
+    # 1件ずつ計算した場合と同じ
+    for k, text in enumerate(texts):
+        single = quality_filter.signals_batch([text])
+        assert all(np.isclose(single[name][0], signals[name][k]) for name in signals)
+
+    # 空白だけの行は空行として数えない（duplicate_line_ratio()と同じ行の分け方）
+    line_texts = ['あいう\n   \n   \n   \nかきく。', 'あいう\r\n\r\nかきく。\u3000\n', ' \n\t', '', 'a\x85bc\u2028\rd']
+    line_signals = quality_filter.signals_batch(line_texts)
+    assert line_signals['mean_line_length'][0] == 3.5
+    for k, text in enumerate(line_texts):
+        lines = [line for line in text.splitlines() if line.strip()]
+        assert line_signals['mean_line_length'][k] == (sum(map(len, lines)) / len(lines) if lines else 0.0), text
+
+    # 孤立したサロゲートを含む文書でも落ちない
+    assert quality_filter.process_batch(['ok\ud800', texts[4] + '\udc00']) == ['', texts[4] + '\udc00']
+
+    # MeCabの前に明らかに質の低い文書を除去した場合の比較
+    many_texts = texts * 1_000
+    director = ParagraphCleaningDirector(
+        paragraph_splitter=FusedSplitJa(punctuations=r"。!?"),
+        sentence_cleaner=PartsFilterMecab(threshold=0.9, min_length=10, parts_index=4, split_key="-"),
+    )
+    processor = make_pipeline(NormalizeFilterJp(), director)
+    filtered_processor = make_pipeline(NormalizeFilterJp(), QualitySignalFilter(rules=JA_RULES), director)
+
+
+    @stop_watch
+    def func_signals():
+        return quality_filter.process_batch(many_texts)
+
+
+    @stop_watch
+    def func_director():
+        return list(processor(many_texts))
+
+
+    @stop_watch
+    def func_filtered():
+        return list(filtered_processor(many_texts))
+
+
+    func_signals()
+    func_director()
+    func_filtered()
+    # signals: 0.04s, director: 1.5s, 信号で除去してからdirector: 1.0s 程度
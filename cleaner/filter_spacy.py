@@ -1,12 +1,12 @@
-from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload
+from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload, Any
 from collections import Counter
 
 import spacy
 
-from util.text_tool_base import TextProcessorBase
+from cleaner.parts_filter_base import PartsFilterBase
 
 
-class PartsFilterSpacy(TextProcessorBase):
+class PartsFilterSpacy(PartsFilterBase):
     """
     以下を参考にしました
     https://spacy.io/usage/models
@@ -39,11 +39,19 @@ class PartsFilterSpacy(TextProcessorBase):
             threshold: float = 0.9,
             min_length: int = 10,
             model_name: str = 'en_core_web_sm',
+            batch_size: int = 256,
     ):
-        self._target_parts: List[str] = ['NOUN', 'PROPN', 'SYM', 'PUNCT', 'X'] if target_parts is None else target_parts
-        self._threshold: float = threshold
-        self._min_length: int = min_length
+        """
+        batch_size:
+            process_batch()でnlp.pipe()に渡すbatch_size
+        """
+        super().__init__(
+            target_parts=['NOUN', 'PROPN', 'SYM', 'PUNCT', 'X'] if target_parts is None else target_parts,
+            threshold=threshold,
+            min_length=min_length,
+        )
         self._nlp_name:str = model_name
+        self._batch_size: int = batch_size
         self._nlp = spacy.load(self._nlp_name)
 
     def parts_count(
@@ -52,7 +60,14 @@ class PartsFilterSpacy(TextProcessorBase):
             return_word_count: bool
     ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
         parsed = self._nlp(text)
+        return self.count_doc(parsed, return_word_count)
 
+    @staticmethod
+    def count_doc(
+            parsed: Any,
+            return_word_count: bool
+    ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
+        """ spaCyの解析結果（Doc）の品詞を数える """
         # 品詞をカウントするためのCounterオブジェクト
         pos_counter = Counter()
         word_counter = Counter()
@@ -74,29 +89,17 @@ class PartsFilterSpacy(TextProcessorBase):
 
         return counts
 
-    def process_handling(
-            self,
-            text: str,
-    ) -> str:
-        if text is None:
-            # return None
-            return ""
-
-        pos_counter, all_counts = self.parts_count(text, return_word_count=False)
-
-        parts_counts = 0
-        for parts in self._target_parts:
-            parts_counts += pos_counter.get(parts, 0)
-
-        # print(text, pos_counter, all_counts)
-        ratio = 1.0 if all_counts == 0 else parts_counts / all_counts
-        # ratio = parts_counts / all_counts
-        # print(ratio, pos_counter)
+    def tags(self, text: str) -> List[str]:
+        return [p.pos_ for p in self._nlp(text)]
 
-        if ratio > self._threshold and len(text) > self._min_length:
-            # return None
-            return ""
-        return text
+    def tags_batch(
+            self,
+            texts: List[str],
+    ) -> List[List[str]]:
+        """
+        nlp.pipe()でself._batch_size文ずつまとめて解析する
+        """
+        return [[p.pos_ for p in parsed] for parsed in self._nlp.pipe(texts, batch_size=self._batch_size)]
 
 
 if __name__ == "__main__":
@@ -125,3 +128,11 @@ if __name__ == "__main__":
 
     func()
 
+
+    @stop_watch
+    def func_batch():
+        return parts_filter.process_batch(texts)
+
+
+    assert func_batch() == list(parts_filter(texts))
+
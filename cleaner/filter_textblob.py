@@ -2,11 +2,13 @@ from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, over
 from collections import Counter
 
 from textblob import TextBlob
+from textblob.tokenizers import SentenceTokenizer, WordTokenizer
+from nltk.tag import PerceptronTagger
 
-from util.text_tool_base import TextProcessorBase
+from cleaner.parts_filter_base import PartsFilterBase
 
 
-class PartsFilterTextblob(TextProcessorBase):
+class PartsFilterTextblob(PartsFilterBase):
     """
     以下を参考にしました
     https://textblob.readthedocs.io/en/dev/quickstart.html#part-of-speech-tagging
@@ -23,6 +25,13 @@ class PartsFilterTextblob(TextProcessorBase):
         Noun Phrase Extraction
         wiki.noun_phrases
         -> WordList(['python'])
+
+    shared_tagger=Trueの場合は、TextBlobを文ごとに作らずに、
+    TextBlob.tagsと同じ処理（SentenceTokenizerで文分割 -> WordTokenizerで単語分割 -> NLTKのPerceptronTaggerで文ごとにタグ付け）を
+    1つずつ保持したtokenizer, taggerで行います。process_batch()（tags_batch()）では複数のtextの文をまとめてtag_sents()に渡します
+    TextBlob.tagsは文ごとにSentence, TextBlob, tokenizer, taggerのラッパーのオブジェクトを作ってから nltk.pos_tag() を呼ぶので、
+    その分を省きます（古いNLTKでは nltk.pos_tag() の呼び出しごとに学習済みの重みも読み込み直す）
+    速度の比較は __main__ を参照。計測するまでは既定は False（TextBlobを使う処理）のままにしています
     """
 
     def __init__(
@@ -30,24 +39,67 @@ class PartsFilterTextblob(TextProcessorBase):
             target_parts: Optional[List[str]] = None,
             threshold: float = 0.9,
             min_length: int = 10,
+            shared_tagger: bool = False,
+            batch_size: int = 1000,
     ):
-        self._target_parts: List[str] = ['NN', 'NNS', 'NNPS', 'NNP', 'SYM'] if target_parts is None else target_parts
-        self._threshold: float = threshold
-        self._min_length: int = min_length
+        super().__init__(
+            target_parts=['NN', 'NNS', 'NNPS', 'NNP', 'SYM'] if target_parts is None else target_parts,
+            threshold=threshold,
+            min_length=min_length,
+        )
+        self._shared_tagger: bool = shared_tagger
+        self._batch_size: int = batch_size
+
+        if self._shared_tagger:
+            # TextBlobの既定（NLTKTagger -> nltk.pos_tag）と同じtokenizer, tagger
+            self._sentence_tokenizer = SentenceTokenizer()
+            self._word_tokenizer = WordTokenizer()
+            self._tagger = PerceptronTagger()
+
+    def tokenize(
+            self,
+            text: str,
+    ) -> List[List[str]]:
+        """ TextBlob(text).sentences の各文の tokens """
+        return [self._word_tokenizer.tokenize(sentence) for sentence in self._sentence_tokenizer.tokenize(text)]
+
+    def tag(
+            self,
+            text: str,
+    ) -> List[Tuple[str, str]]:
+        """ TextBlob(text).tags と同じ品詞が付く（句読点の除去はcount_tags(), count_tag()の isalpha() で行う） """
+        if not self._shared_tagger:
+            return TextBlob(text).tags
+        return [tagged for tagged_sentence in self._tagger.tag_sents(self.tokenize(text)) for tagged in tagged_sentence]
+
+    def tag_batch(
+            self,
+            texts: List[str],
+    ) -> List[List[Tuple[str, str]]]:
+        """ 複数のtextの文をまとめて1回のtag_sents()でタグ付けし、textごとに戻す """
+        group_of_sentences = [self.tokenize(text) for text in texts]
+        tagged_sentences = iter(self._tagger.tag_sents(
+            [tokens for sentences in group_of_sentences for tokens in sentences]))
+        return [[tagged for _ in sentences for tagged in next(tagged_sentences)] for sentences in group_of_sentences]
 
-    @staticmethod
     def parts_count(
+            self,
             text: str,
             return_word_count: bool
     ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
-        parsed = TextBlob(text)
+        return self.count_tags(self.tag(text), return_word_count)
 
+    @staticmethod
+    def count_tags(
+            tags: List[Tuple[str, str]],
+            return_word_count: bool = False,
+    ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
         # 品詞をカウントするためのCounterオブジェクト
         pos_counter = Counter()
         word_counter = Counter()
 
         all_counts = 0
-        for word, pos in parsed.tags:
+        for word, pos in tags:
             if not pos.isalpha():
                 continue
             if return_word_count:
@@ -61,30 +113,23 @@ class PartsFilterTextblob(TextProcessorBase):
 
         return counts
 
+    def tags(self, text: str) -> List[str]:
+        return [pos for _, pos in self.tag(text)]
 
-    def process_handling(
+    def tags_batch(
             self,
-            text: str,
-    ) -> str:
-        if text is None:
-            # return None
-            return ""
-
-        pos_counter, all_counts = self.parts_count(text, return_word_count=False)
-
-        parts_counts = 0
-        for parts in self._target_parts:
-            parts_counts += pos_counter.get(parts, 0)
+            texts: List[str],
+    ) -> List[List[str]]:
+        """
+        shared_tagger=Trueの場合は self._batch_size 個ずつまとめてタグ付けする
+        """
+        if not self._shared_tagger:
+            return super().tags_batch(texts)
 
-        # print(text, pos_counter, all_counts)
-        ratio = 1.0 if all_counts == 0 else parts_counts / all_counts
-        # ratio = parts_counts / all_counts
-        # print(ratio, pos_counter)
-
-        if ratio > self._threshold and len(text) > self._min_length:
-            # return None
-            return ""
-        return text
+        tags_list = []
+        for head in range(0, len(texts), self._batch_size):
+            tags_list.extend([pos for _, pos in tags] for tags in self.tag_batch(texts[head:head + self._batch_size]))
+        return tags_list
 
 
 if __name__ == "__main__":
@@ -102,7 +147,7 @@ if __name__ == "__main__":
 
     # texts = texts * 3
 
-    parts_filter = PartsFilterTextblob(threshold=0.9, min_length=10)
+    parts_filter = PartsFilterTextblob(threshold=0.9, min_length=10, shared_tagger=False)
 
 
     @stop_watch
@@ -113,4 +158,37 @@ if __name__ == "__main__":
 
 
     func()
+
+    # TextBlobを文ごとに作る場合と、tokenizer, taggerを使い回す場合の比較
+    # 複数の文、句読点、短縮形（don't -> do n't）、記号だけの文を含むtextでも同じ品詞・判定になること
+    shared_filter = PartsFilterTextblob(threshold=0.9, min_length=10, shared_tagger=True)
+    texts = texts + [
+        "I don't think so. Book car ship dog cat bed sea! Is it a dog's bed?",
+        'Price: $3.50 (tax incl.) -- see www.example.com for details... OK.',
+        '!!! ... ???',
+        '',
+    ]
+    for text in texts:
+        assert parts_filter.parts_count(text, True) == shared_filter.parts_count(text, True), text
+    assert [parts_filter.process_handling(text) for text in texts] == shared_filter.process_batch(texts)
+
+    texts = texts * 1_000
+
+
+    @stop_watch
+    def func_textblob():
+        return [parts_filter.process_handling(text) for text in texts]
+
+
+    @stop_watch
+    def func_shared():
+        return [shared_filter.process_handling(text) for text in texts]
+
+
+    @stop_watch
+    def func_shared_batch():
+        return shared_filter.process_batch(texts)
+
+
+    assert func_textblob() == func_shared() == func_shared_batch()
     #
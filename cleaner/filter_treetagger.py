@@ -3,10 +3,10 @@ from collections import Counter
 
 import treetaggerwrapper as ttw
 
-from util.text_tool_base import TextProcessorBase
+from cleaner.parts_filter_base import PartsFilterBase
 
 
-class PartsFilterTreetagger(TextProcessorBase):
+class PartsFilterTreetagger(PartsFilterBase):
     """
     遅い
 
@@ -19,31 +19,97 @@ class PartsFilterTreetagger(TextProcessorBase):
     https://www.cis.uni-muenchen.de/%7Eschmid/tools/TreeTagger/
 
     windowsの場合はパッケージのダウンロードなどが必要
+
+    TreeTaggerのプロセスは1つを使い回し、終了していた場合は起動し直します
+    process_batch()（tags_batch()）では複数の文を文区切りのSGMLタグを挟んで1回のTagText()で処理し、
+    出力をタグの位置で文ごとに分けます
     """
 
+    # 文の区切りとして挟むSGMLタグ（TreeTaggerはSGMLタグをそのまま1行として出力する）
+    SENTENCE_MARKER: str = '<sentence-boundary/>'
+
     def __init__(
             self,
             target_parts: Optional[List[str]] = None,
             threshold: float = 0.9,
             min_length: int = 10,
             language: str = 'en',
+            batch_size: int = 500,
     ):
-        self._target_parts: List[str] = ['NN', 'NNS', 'NPS', 'NP', ':', '$'] if target_parts is None else target_parts
-        self._threshold: float = threshold
-        self._min_length: int = min_length
+        super().__init__(
+            target_parts=['NN', 'NNS', 'NPS', 'NP', ':', '$'] if target_parts is None else target_parts,
+            threshold=threshold,
+            min_length=min_length,
+        )
         self._language: str = language
+        self._batch_size: int = batch_size
+
+        self._tagger = ttw.TreeTagger(TAGLANG=self._language)
 
+    def is_alive(self) -> bool:
+        """ TreeTaggerのサブプロセスが動いているか """
+        popen = getattr(self._tagger, 'tagpopen', None)
+        return popen is None or popen.poll() is None
+
+    def close(self):
+        """
+        TreeTaggerのサブプロセスを終了させ、終了を待つ
+        TreeTagger.__del__()はterminate()するだけでwait()しないので、起動し直すたびにゾンビプロセスが残らないようにする
+        """
+        for name in ('taginput', 'tagoutput'):
+            pipe = getattr(self._tagger, name, None)
+            if pipe is not None:
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+                setattr(self._tagger, name, None)
+        popen = getattr(self._tagger, 'tagpopen', None)
+        if popen is not None:
+            if popen.poll() is None:
+                popen.kill()
+            popen.wait()
+            self._tagger.tagpopen = None
+
+    def restart(self):
+        """ TreeTaggerのサブプロセスを終了させてから起動し直す """
+        self.close()
         self._tagger = ttw.TreeTagger(TAGLANG=self._language)
 
+    def tag_text(
+            self,
+            text: Union[str, List[str]],
+    ) -> List[str]:
+        """
+        TagText()の呼び出し
+        プロセスが終了していた場合や、パイプが壊れていた場合は起動し直して1回だけ再実行する
+        """
+        if not self.is_alive():
+            self.restart()
+        try:
+            return self._tagger.TagText(text)
+        except (OSError, ttw.TreeTaggerError):
+            self.restart()
+            return self._tagger.TagText(text)
+
     def parts_count(
             self,
             text: str,
             return_word_count: bool
     ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
 
-        parsed = self._tagger.TagText(text)
+        parsed = self.tag_text(text)
         # print(parsed)
+        return self.count_tags(parsed, return_word_count)
 
+    @staticmethod
+    def count_tags(
+            parsed: List[str],
+            return_word_count: bool = False,
+    ) -> Union[Tuple[Counter, int], Tuple[Counter, int, Counter]]:
+        """
+        TagText()の結果（"単語\t品詞\t見出し語"の行）から品詞を数える
+        """
         # pos = pos.split(self._split_key)[0]
 
         # 品詞をカウントするためのCounterオブジェクト
@@ -74,27 +140,51 @@ class PartsFilterTreetagger(TextProcessorBase):
 
         return counts
 
-    def process_handling(
+    def tag_batch(
             self,
-            text: str,
-    ) -> str:
-        if text is None:
-            # return None
-            return ""
-
-        pos_counter, all_counts = self.parts_count(text, return_word_count=False)
-
-        parts_counts = 0
-        for parts in self._target_parts:
-            parts_counts += pos_counter.get(parts, 0)
-
-        ratio = parts_counts / all_counts
-        print(ratio, pos_counter)
-
-        if ratio > self._threshold and len(text) > self._min_length:
-            # return None
-            return ""
-        return text
+            texts: List[str],
+    ) -> List[List[str]]:
+        """
+        texts を SENTENCE_MARKER を挟んで1回のTagText()で処理し、文ごとのTagText()の結果に分ける
+        区切りの数が合わない場合は1文ずつ処理する
+        """
+        lines: List[str] = []
+        for text in texts:
+            lines.append(text)
+            lines.append(self.SENTENCE_MARKER)
+
+        tagged: List[List[str]] = [[]]
+        for line in self.tag_text(lines):
+            if line == self.SENTENCE_MARKER:
+                tagged.append([])
+            else:
+                tagged[-1].append(line)
+        # 最後の区切りの後ろは空
+        tagged.pop()
+
+        if len(tagged) != len(texts):
+            return [self.tag_text(text) for text in texts]
+        return tagged
+
+    @staticmethod
+    def parsed_tags(parsed: List[str]) -> List[str]:
+        """ TagText()の結果（"単語\t品詞\t見出し語"の行）の品詞のリスト """
+        return [line.split('\t')[1] for line in parsed if line != 'EOS' and line != '']
+
+    def tags(self, text: str) -> List[str]:
+        return self.parsed_tags(self.tag_text(text))
+
+    def tags_batch(
+            self,
+            texts: List[str],
+    ) -> List[List[str]]:
+        """
+        self._batch_size文ずつまとめてTreeTaggerに流す
+        """
+        tags_list = []
+        for head in range(0, len(texts), self._batch_size):
+            tags_list.extend(self.parsed_tags(parsed) for parsed in self.tag_batch(texts[head:head + self._batch_size]))
+        return tags_list
 
 
 if __name__ == "__main__":
@@ -123,3 +213,26 @@ if __name__ == "__main__":
 
 
     func()
+
+    # 1文ずつTagText()した場合と、まとめてTagText()した場合の比較
+    texts = texts * 1_000
+
+
+    @stop_watch
+    def func_each():
+        return [parts_filter.process_handling(text) for text in texts]
+
+
+    @stop_watch
+    def func_batch():
+        return parts_filter.process_batch(texts)
+
+
+    assert func_each() == func_batch()
+
+    # 起動し直した場合に、古いプロセスが終了して回収されていること
+    old_popen = parts_filter._tagger.tagpopen
+    parts_filter.restart()
+    assert old_popen.returncode is not None
+    assert parts_filter.is_alive()
+    assert func_each() == func_batch()
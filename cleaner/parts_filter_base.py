@@ -0,0 +1,221 @@
+# coding: UTF-8
+
+from typing import Generator, Iterator, List, Dict, Tuple, Union, Optional, overload
+from collections import Counter
+
+import numpy as np
+
+from util.text_tool_base import TextProcessorBase
+
+
+class _TagIds(dict):
+    """ 品詞 -> 整数ID（初めて出てきた品詞には新しいIDを割り当てる。0は数えない品詞） """
+
+    def __init__(self, filter_: 'PartsFilterBase'):
+        super().__init__()
+        self._filter = filter_
+
+    def __missing__(self, tag: str) -> int:
+        tag_id = self._filter.add_tag(tag)
+        self[tag] = tag_id
+        return tag_id
+
+
+class PartsFilterBase(TextProcessorBase):
+    """
+    品詞の割合で文を除去するフィルタ（PartsFilterMecab, PartsFilterNltk など）の共通部分
+
+    対象の品詞（target_parts）の数 / 数える品詞の数 が threshold を超え、文字数が min_length を超える文を除去する
+    サブクラスは tags()（1文の品詞のリスト）を実装し、まとめて処理できる場合は tags_batch() をオーバーライドしてください
+
+    品詞は小さな整数IDに変換し、複数の文の品詞IDを1つの配列にまとめて
+    np.bincount() で文ごとの対象の品詞の数・全体の数を数え、割合と判定を1回で計算します
+    数える品詞が1つもない文は、割合を1.0とします
+    """
+
+    def __init__(
+            self,
+            target_parts: List[str],
+            threshold: float = 0.9,
+            min_length: int = 10,
+    ):
+        self._target_parts: List[str] = target_parts
+        self._threshold: float = threshold
+        self._min_length: int = min_length
+
+        self._tag_ids: _TagIds = _TagIds(self)
+        # IDごとに、対象の品詞か（ID 0 は数えない品詞）
+        self._is_target: np.ndarray = np.zeros(1, dtype=bool)
+
+    def count_tag(self, tag: str) -> bool:
+        """ 割合の計算に含める品詞か（既定では記号などのアルファベット以外の品詞は含めない） """
+        return tag.isalpha()
+
+    def add_tag(self, tag: str) -> int:
+        if not self.count_tag(tag):
+            return 0
+        tag_id = len(self._is_target)
+        self._is_target = np.append(self._is_target, tag in self._target_parts)
+        return tag_id
+
+    def tags(self, text: str) -> List[str]:
+        """ textの品詞のリスト """
+        raise NotImplementedError
+
+    def tags_batch(self, texts: List[str]) -> List[List[str]]:
+        """ 複数のtextの品詞のリスト（まとめて解析できるサブクラスはオーバーライドしてください） """
+        return [self.tags(text) for text in texts]
+
+    def count_batch(
+            self,
+            tags_list: List[List[str]],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (文ごとの対象の品詞の数, 数える品詞の数) の配列を返す
+        """
+        n = len(tags_list)
+        tag_ids = self._tag_ids.__getitem__
+        flat_ids: List[int] = []
+        lengths = np.empty(n, dtype=np.int64)
+        for k, tags in enumerate(tags_list):
+            flat_ids.extend(map(tag_ids, tags))
+            lengths[k] = len(tags)
+
+        ids = np.array(flat_ids, dtype=np.int64)
+        segments = np.repeat(np.arange(n), lengths)
+        totals = np.bincount(segments, weights=ids != 0, minlength=n).astype(np.int64)
+        targets = np.bincount(segments, weights=self._is_target[ids], minlength=n).astype(np.int64)
+        return targets, totals
+
+    @staticmethod
+    def ratios(
+            targets: np.ndarray,
+            totals: np.ndarray,
+    ) -> np.ndarray:
+        """ 対象の品詞の割合（数える品詞が1つもない文は1.0） """
+        return np.divide(targets, totals, out=np.ones(len(totals)), where=totals > 0)
+
+    @staticmethod
+    def drop_mask(
+            ratios: np.ndarray,
+            text_lengths: np.ndarray,
+            threshold: float,
+            min_length: int,
+    ) -> np.ndarray:
+        """ 除去する文のマスク（記録した特徴量に別の閾値を適用する場合にも使う） """
+        return (ratios > threshold) & (text_lengths > min_length)
+
+    def features_batch(
+            self,
+            texts: List[str],
+    ) -> Dict[str, np.ndarray]:
+        """
+        判定に使う特徴量（文字数, 対象の品詞の数, 数える品詞の数, 割合）を文ごとに返す（除去はしない）
+        閾値を変えて何度も判定する場合に、品詞の解析を1回で済ませるためのもの
+        """
+        targets, totals = self.count_batch(self.tags_batch(texts))
+        return {
+            'length': np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)),
+            'target_count': targets,
+            'token_count': totals,
+            'ratio': self.ratios(targets, totals),
+        }
+
+    def score_batch(
+            self,
+            texts: List[str],
+            tags_list: List[List[str]],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (文ごとの対象の品詞の割合, 除去するか) の配列を返す
+        """
+        ratios = self.ratios(*self.count_batch(tags_list))
+        text_lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        return ratios, self.drop_mask(ratios, text_lengths, self._threshold, self._min_length)
+
+    def judge(
+            self,
+            text: str,
+            pos_counter: Counter,
+            all_counts: int,
+    ) -> str:
+        """
+        品詞の割合から、textを残す（textを返す）か除去する（""を返す）かを判定（parts_count()の結果から判定する場合）
+        """
+        parts_counts = 0
+        for parts in self._target_parts:
+            parts_counts += pos_counter.get(parts, 0)
+
+        ratio = 1.0 if all_counts == 0 else parts_counts / all_counts
+        if ratio > self._threshold and len(text) > self._min_length:
+            return ""
+        return text
+
+    def process_handling(
+            self,
+            text: str,
+    ) -> str:
+        # 1文だけの場合は、NumPyの配列を作るよりCounterで数えた方が速い
+        if text is None:
+            return ""
+        tag_ids = self._tag_ids
+        tags = [tag for tag in self.tags(text) if tag_ids[tag]]
+        return self.judge(text, Counter(tags), len(tags))
+
+    def process_batch(
+            self,
+            texts: List[str],
+    ) -> List[str]:
+        results = [""] * len(texts)
+        targets = [i for i, text in enumerate(texts) if text is not None]
+        if not targets:
+            return results
+        batch = [texts[i] for i in targets]
+        _, drop = self.score_batch(batch, self.tags_batch(batch))
+        for i, text, dropped in zip(targets, batch, drop.tolist()):
+            results[i] = "" if dropped else text
+        return results
+
+
+if __name__ == "__main__":
+    '''
+    > python -m cleaner.parts_filter_base
+    '''
+    import random
+
+    from util.versatile_tool import stop_watch
+
+
+    class PartsFilterWhitespace(PartsFilterBase):
+        """ 空白で区切った単語の先頭の文字を品詞とみなす例 """
+
+        def tags(self, text: str) -> List[str]:
+            return ['NN' if word[0].islower() else 'VB' if word[0].isupper() else '.' for word in text.split()]
+
+
+    rng = random.Random(0)
+    words = ['book', 'car', 'Run', 'Walk', '.', ',', 'ship', 'See']
+    texts = [' '.join(rng.choice(words) for _ in range(rng.randint(0, 20))) for _ in range(100_000)] + [None, '']
+
+    parts_filter = PartsFilterWhitespace(target_parts=['NN'], threshold=0.6, min_length=10)
+
+
+    def judge_with_counter(text: Optional[str]) -> str:
+        if text is None:
+            return ""
+        tags = [tag for tag in parts_filter.tags(text) if parts_filter.count_tag(tag)]
+        return parts_filter.judge(text, Counter(tags), len(tags))
+
+
+    @stop_watch
+    def func_counter():
+        return [judge_with_counter(text) for text in texts]
+
+
+    @stop_watch
+    def func_bincount():
+        return parts_filter.process_batch(texts)
+
+
+    assert func_counter() == func_bincount()
+    # counter: 0.66s, bincount: 0.45s 程度（tags()の時間を含む）
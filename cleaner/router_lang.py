@@ -0,0 +1,219 @@
+# coding: UTF-8
+
+from typing import Callable, Generator, Iterator, List, Dict, Tuple, Union, Optional, overload, Any
+from collections import Counter
+import itertools
+
+import numpy as np
+
+from util.text_tool_base import TextProcessorBase
+from util.codepoint_tool import make_class_table, count_classes, to_codepoints, segment_ids
+
+
+class LanguageRouter(TextProcessorBase):
+    """
+    文字種の割合で文書の言語を判定し、言語ごとのパイプラインに振り分ける
+
+        router = LanguageRouter(routes={
+            'ja': make_pipeline(NormalizeFilterJp(), ja_cleaner, FilterHojichar(filter_list=JA_LIST)),
+            'en': make_pipeline(en_cleaner, FilterHojichar(filter_list=EN_LIST)),
+        })
+        for text in router(texts):
+            ...
+
+    batch_size個ずつ文字種をnumpyでまとめて数えて判定し、言語ごとにまとめてパイプラインに流したのち、元の順番に戻して返します
+    言語ごとのパイプラインがTextProcessorBaseの場合はprocess_batch()を、それ以外は "".join(pipeline(text)) を使います
+    routesにない言語の文書は、default_routeを指定していればそのパイプラインへ、指定していなければ""を返します
+
+    判定（判定できない場合は'other'）
+    - 'ja': 仮名が文字の ja_min_kana_ratio 以上、かつ 仮名+漢字が文字の ja_min_ratio 以上
+    - 'en': ASCIIの英字が文字の en_min_ratio 以上、かつ 文字数がen_ngram_min_letters以上の場合は
+            英語に多い文字bigram "th" が文字の en_min_th_ratio 以上（ドイツ語・フランス語などのラテン文字の言語を除くため）
+    """
+
+    def __init__(
+            self,
+            routes: Dict[str, Callable[..., Any]],
+            default_route: Optional[str] = None,
+            batch_size: int = 1000,
+            ja_min_kana_ratio: float = 0.05,
+            ja_min_ratio: float = 0.5,
+            en_min_ratio: float = 0.95,
+            en_ngram_min_letters: int = 100,
+            en_min_th_ratio: float = 0.005,
+    ):
+        self._routes: Dict[str, Callable[..., Any]] = routes
+        self._default_route: Optional[str] = default_route
+        self._batch_size: int = batch_size
+        self._ja_min_kana_ratio: float = ja_min_kana_ratio
+        self._ja_min_ratio: float = ja_min_ratio
+        self._en_min_ratio: float = en_min_ratio
+        self._en_ngram_min_letters: int = en_ngram_min_letters
+        self._en_min_th_ratio: float = en_min_th_ratio
+
+        self._table, self._class_names = make_class_table()
+        index = {name: i for i, name in enumerate(self._class_names)}
+        self._kana = [index['hiragana'], index['katakana']]
+        self._kanji = [index['kanji']]
+        self._latin = [index['latin']]
+        self._letters = [index[name] for name in ['latin', 'latin_ext', 'hiragana', 'katakana', 'kanji', 'hangul', 'cyrillic']]
+
+        # 言語ごとの文書数
+        self.counts: Counter = Counter()
+
+    @staticmethod
+    def count_th(
+            texts: List[str],
+    ) -> np.ndarray:
+        """ textごとの文字bigram "th"（大文字小文字を区別しない）の数 """
+        codepoints, lengths = to_codepoints(texts)
+        ids = segment_ids(lengths)
+        lower = codepoints | 0x20
+        is_th = (lower[:-1] == ord('t')) & (lower[1:] == ord('h')) & (ids[:-1] == ids[1:])
+        return np.bincount(ids[:-1][is_th], minlength=len(texts))
+
+    def detect_batch(
+            self,
+            texts: List[str],
+    ) -> List[str]:
+        """ textsの言語をまとめて判定する """
+        if not texts:
+            return []
+        counts = count_classes(texts, self._table, len(self._class_names))
+        letters = counts[:, self._letters].sum(axis=1)
+        kana = counts[:, self._kana].sum(axis=1)
+        kanji = counts[:, self._kanji].sum(axis=1)
+        latin = counts[:, self._latin].sum(axis=1)
+
+        denominator = np.maximum(letters, 1)
+        is_ja = (letters > 0) & (kana >= self._ja_min_kana_ratio * denominator) \
+            & (kana + kanji >= self._ja_min_ratio * denominator)
+        is_en = (letters > 0) & (latin >= self._en_min_ratio * denominator) & ~is_ja
+        long_latin = is_en & (letters >= self._en_ngram_min_letters)
+        if long_latin.any():
+            th = self.count_th(texts)
+            is_en &= ~long_latin | (th >= self._en_min_th_ratio * denominator)
+
+        languages = np.full(len(texts), 'other', dtype=object)
+        languages[is_ja] = 'ja'
+        languages[is_en] = 'en'
+        return languages.tolist()
+
+    def detect(
+            self,
+            text: str,
+    ) -> str:
+        return self.detect_batch([text])[0]
+
+    def route(
+            self,
+            language: str,
+    ) -> Optional[Callable[..., Any]]:
+        """ 言語に対応するパイプライン（なければNone） """
+        if language in self._routes:
+            return self._routes[language]
+        if self._default_route is not None:
+            return self._routes[self._default_route]
+        return None
+
+    @staticmethod
+    def run_pipeline(
+            pipeline: Callable[..., Any],
+            texts: List[str],
+    ) -> List[str]:
+        if isinstance(pipeline, TextProcessorBase):
+            return pipeline.process_batch(texts)
+        return ["".join(list(pipeline(text))) for text in texts]
+
+    def process_batch(
+            self,
+            texts: List[str],
+    ) -> List[str]:
+        """ 言語ごとにまとめてパイプラインに流し、textsの順番に戻す """
+        texts = ["" if text is None else text for text in texts]
+        languages = self.detect_batch(texts)
+        self.counts.update(languages)
+
+        groups: Dict[str, List[int]] = {}
+        for i, language in enumerate(languages):
+            groups.setdefault(language, []).append(i)
+
+        results = [""] * len(texts)
+        for language, indices in groups.items():
+            pipeline = self.route(language)
+            if pipeline is None:
+                continue
+            for i, text in zip(indices, self.run_pipeline(pipeline, [texts[i] for i in indices])):
+                results[i] = text
+        return results
+
+    def process_handling(
+            self,
+            text: str,
+    ) -> str:
+        return self.process_batch([text])[0]
+
+    def process(
+            self,
+            input_data: Union[str, List[str], Iterator[str]],
+    ) -> Generator[str, None, None]:
+        """ batch_size個ずつまとめて処理し、入力の順番で返す """
+        texts = iter([input_data]) if isinstance(input_data, str) else iter(input_data)
+        while True:
+            batch = list(itertools.islice(texts, self._batch_size))
+            if not batch:
+                return
+            yield from self.process_batch(batch)
+
+    def report(self) -> Dict[str, Any]:
+        """ 言語ごとの文書数と割合 """
+        total = sum(self.counts.values())
+        return {
+            language: {'documents': count, 'ratio': count / total}
+            for language, count in self.counts.most_common()
+        }
+
+
+if __name__ == "__main__":
+    '''
+    > python -m cleaner.router_lang
+    '''
+
+    from util.text_tool_base import make_pipeline
+    from util.versatile_tool import stop_watch
+    from cleaner.filter_hojichar import FilterHojichar, JA_LIST, EN_LIST
+
+    texts = [
+        "生八つ橋のタグまとめ | エキサイトブログ 生八つ橋のタグまとめ 「生八つ橋」のタグがついている新着記事と人気記事をまとめました。エキサイトブログには生八つ橋に関連するブログ（日記、記録、写真、レビュー、噂、まとめ）がたくさん投稿されています。",
+        'Between the golden-yellow lotus leaves and stalks, we see swaying white lotus flowers with thick black. book car ship world text, and school hole dog cat bed car sea.',
+        '北京是中华人民共和国的首都，也是全国的政治中心、文化中心。',
+        'Der schnelle braune Fuchs springt über den faulen Hund. Größe, Übung, Straße, schön, müssen.',
+        '',
+    ]
+
+    router = LanguageRouter(routes={
+        'ja': make_pipeline(FilterHojichar(filter_list=JA_LIST)),
+        'en': make_pipeline(FilterHojichar(filter_list=EN_LIST)),
+    })
+
+    print(router.detect_batch(texts))
+    # 孤立したサロゲートを含む文書があっても、判定は失敗しない（'\ud800'は'other'の文字として数える）
+    print(router.detect_batch(texts + ['ok\ud800', '吾輩は猫である。\udc00']))
+
+    texts = texts * 2_000
+
+
+    @stop_watch
+    def func_detect():
+        router.detect_batch(texts)
+
+
+    @stop_watch
+    def func():
+        for text in router(texts):
+            pass
+
+
+    func_detect()
+    func()
+    print(router.report())
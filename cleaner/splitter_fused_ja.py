@@ -0,0 +1,268 @@
+
+from typing import Dict, Generator, Iterator, List, Tuple, Union, Optional, overload, Type
+import re
+import unicodedata
+
+from util.text_tool_base import TextSplitterBase, iter_line_spans
+
+'''
+ja_sentence_segmenterの normalize（neologd）の処理を、結果が変わらない範囲でまとめたテーブルと正規表現
+https://github.com/wwwcojp/ja_sentence_segmenter/blob/main/ja_sentence_segmenter/normalize/neologd_normalizer.py
+'''
+
+# 全角英数字 -> 半角（NFKC）
+_FULLWIDTH_ALNUM = ''.join(map(chr, list(range(0xff10, 0xff1a)) + list(range(0xff21, 0xff3b)) + list(range(0xff41, 0xff5b))))
+# ASCII記号 -> 全角記号（neologdの maketrans）
+_ASCII_PUNCT = '!"#$%&\'()*+,-./:;<=>?@[¥]^_`{|}~'
+_FULLWIDTH_PUNCT = '！”＃＄％＆’（）＊＋，－．／：；＜＝＞？＠［￥］＾＿｀｛｜｝〜'
+# チルダ類
+_TILDES = '~∼∾〜〰～'
+# 最後にNFKCで半角に戻す全角記号（＝,・,「,」は残す）
+_FULLWIDTH_PUNCT_BACK = '！”＃＄％＆’（）＊＋，－．／：；＜＞？＠［￥］＾＿｀｛｜｝〜'
+
+_HALFWIDTH_KANA_RE = re.compile('[｡-ﾟ]+')
+_HYPHENS_RE = re.compile('[˗֊‐‑‒–⁃⁻₋−]+')
+# neologdの長音記号の集合から "－" を除いたもの（ここでは"－"はASCIIの"-"由来のため）
+_CHOONPUS_RE = re.compile('[﹣—―─━ー]+')
+_SPACES_RE = re.compile('[ 　]+')
+_BLOCKS = '\u4e00-\u9fff\u3040-\u309f\u30a0-\u30ff\u3000-\u303f\uff00-\uffef'
+_BASIC_LATIN = '\u0000-\u007f'
+_EXTRA_SPACE_RE = re.compile(f'(?<=[{_BLOCKS}]) (?=[{_BLOCKS}{_BASIC_LATIN}])|(?<=[{_BASIC_LATIN}]) (?=[{_BLOCKS}])')
+
+
+def _compile_tables(remove_tildes: bool) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """
+    1文字単位の変換をまとめた str.translate() 用のテーブルを作る
+    - 前段：全角英数字のNFKC, "－"->"-", チルダ, ASCII記号の全角化 を合成したもの
+    - 後段：全角記号のNFKC, "’"->"'", "”"->'"'
+    """
+    def step_b(c: str) -> str:
+        if c in _FULLWIDTH_ALNUM:
+            return unicodedata.normalize('NFKC', c)
+        return '-' if c == '－' else c
+
+    def step_e(c: str) -> str:
+        if c in _TILDES:
+            return '' if remove_tildes else '～'
+        return c
+
+    step_f = dict(zip(_ASCII_PUNCT, _FULLWIDTH_PUNCT))
+
+    front: Dict[int, str] = {}
+    for c in set(_FULLWIDTH_ALNUM + _ASCII_PUNCT + _TILDES + '－'):
+        out = ''.join(step_f.get(x, x) for x in ''.join(step_e(x) for x in step_b(c)))
+        if out != c:
+            front[ord(c)] = out
+
+    back: Dict[int, str] = {}
+    for c in _FULLWIDTH_PUNCT_BACK:
+        out = unicodedata.normalize('NFKC', c).replace('－', '-').replace('’', "'").replace('”', '"')
+        if out != c:
+            back[ord(c)] = out
+    return front, back
+
+
+BETWEEN_QUOTE_JA_RE = re.compile(r"「[^「」]*」")
+BETWEEN_PARENS_JA_RE = re.compile(r"\([^()]*\)")
+ESCAPE_CHAR = "∯"
+
+
+class FusedSplitJa(TextSplitterBase):
+    """
+    ja_sentence_segmenterの以下のパイプラインを1つにまとめた日本語文分割
+
+        split_punc = functools.partial(split_punctuation, punctuations=r"。!?")
+        concat_tail_te = functools.partial(concatenate_matching, remove_former_matched=False)
+        splitter = make_pipeline(normalize, split_newline, concat_tail_te, split_punc)
+
+    4段のジェネレータと中間文字列を作らずに、
+    正規化（translateテーブル2回 + 正規表現数回）-> 行ごとに句読点位置を1回走査 で文を切り出す。
+    split_with_offsets()で正規化後のtextに対する(start, end)も得られます。
+
+    concatenate_matching()はルールを指定しない場合は何もしない（行をそのまま返す）ので、
+    former_matching_rule/latter_matching_ruleを指定した場合のみ行の結合を行います。
+
+    入力にU+222F(∯)が含まれる場合、ja_sentence_segmenterは内部のエスケープ文字として扱うため、
+    結果が一致しないことがあります。
+    """
+
+    def __init__(
+            self,
+            punctuations: str = r"。!?",
+            remove_tildes: bool = False,
+            split_between_quote: bool = False,
+            split_between_parens: bool = False,
+            former_matching_rule: Optional[str] = None,
+            latter_matching_rule: Optional[str] = None,
+            remove_former_matched: bool = True,
+            remove_latter_matched: bool = True,
+    ):
+        self._punctuations: str = punctuations
+        self._split_between_quote: bool = split_between_quote
+        self._split_between_parens: bool = split_between_parens
+        self._front_table, self._back_table = _compile_tables(remove_tildes)
+        self._punct_re = re.compile(f"[{punctuations}]")
+
+        self._former_re = re.compile(former_matching_rule) if former_matching_rule else None
+        self._latter_re = re.compile(latter_matching_rule) if latter_matching_rule else None
+        self._remove_former_matched: bool = remove_former_matched
+        self._remove_latter_matched: bool = remove_latter_matched
+
+    def normalize_text(
+            self,
+            text: str,
+    ) -> str:
+        """
+        ja_sentence_segmenter.normalize.neologd_normalizer.normalize() と同じ結果を返す
+        """
+        s = text.strip().translate(self._front_table)
+        if _HALFWIDTH_KANA_RE.search(s):
+            s = _HALFWIDTH_KANA_RE.sub(lambda m: unicodedata.normalize('NFKC', m.group()), s)
+        s = _HYPHENS_RE.sub('－', s)
+        s = _CHOONPUS_RE.sub('ー', s)
+        s = _SPACES_RE.sub(' ', s)
+        s = _EXTRA_SPACE_RE.sub('', s)
+        return s.translate(self._back_table)
+
+    def concatenate_lines(
+            self,
+            lines: Iterator[str],
+    ) -> Generator[str, None, None]:
+        """
+        ja_sentence_segmenter.concatenate.simple_concatenator.concatenate_matching() と同じ処理
+        """
+        former = next(lines, None)
+        if former is None:
+            return
+        for latter in lines:
+            former_match = self._former_re.match(former) if self._former_re else None
+            latter_match = self._latter_re.match(latter) if self._latter_re else None
+
+            if self._former_re and self._latter_re and former_match and latter_match:
+                tmp_former = former_match.group("result") if self._remove_former_matched else former
+                tmp_latter = latter_match.group("result") if self._remove_latter_matched else latter
+                former = tmp_former + tmp_latter
+            elif self._former_re and not self._latter_re and former_match:
+                tmp_former = former_match.group("result") if self._remove_former_matched else former
+                former = tmp_former + latter
+            elif not self._former_re and self._latter_re and latter_match:
+                tmp_latter = latter_match.group("result") if self._remove_latter_matched else latter
+                former += tmp_latter
+            else:
+                yield former
+                former = latter
+        yield former
+
+    def punctuation_spans(
+            self,
+            line: str,
+            offset: int = 0,
+    ) -> Generator[Tuple[int, int], None, None]:
+        """
+        1行を句読点で分割した(start, end)を返す
+        「」や()の中の句読点では分割しない（split_between_quote/split_between_parensがFalseの場合）
+        """
+        protected: List[Tuple[int, int]] = []
+        if not self._split_between_quote:
+            protected.extend(m.span() for m in BETWEEN_QUOTE_JA_RE.finditer(line))
+        if not self._split_between_parens:
+            protected.extend(m.span() for m in BETWEEN_PARENS_JA_RE.finditer(line))
+
+        start = 0
+        n = len(line)
+        for m in self._punct_re.finditer(line):
+            i = m.start()
+            if protected and any(s < i < e for s, e in protected):
+                continue
+            if (i > 0 and line[i - 1] == ESCAPE_CHAR) or (i + 1 < n and line[i + 1] == ESCAPE_CHAR):
+                continue
+            yield offset + start, offset + i + 1
+            start = i + 1
+        if start < n:
+            yield offset + start, offset + n
+
+    def split_with_offsets(
+            self,
+            text: str,
+    ) -> Generator[Tuple[int, int, str], None, None]:
+        """
+        (start, end, 文)を返す。start, endは normalize_text(text) に対する位置
+        行の結合ルールを指定している場合は位置が対応しないので使えません
+        """
+        if self._former_re or self._latter_re:
+            raise ValueError('offsets are not available when concatenation rules are given')
+        normalized = self.normalize_text(text)
+        for line_start, line_end in iter_line_spans(normalized):
+            line = normalized[line_start:line_end]
+            for start, end in self.punctuation_spans(line, line_start):
+                yield start, end, normalized[start:end]
+
+    def split_handling(
+            self,
+            text: str,
+    ) -> Generator[str, None, None]:
+        normalized = self.normalize_text(text)
+        if self._former_re or self._latter_re:
+            lines = self.concatenate_lines(iter(normalized.splitlines()))
+            for line in lines:
+                for start, end in self.punctuation_spans(line):
+                    yield line[start:end]
+        else:
+            for line_start, line_end in iter_line_spans(normalized):
+                line = normalized[line_start:line_end]
+                for start, end in self.punctuation_spans(line):
+                    yield line[start:end]
+
+
+if __name__ == "__main__":
+    '''
+    > python -m cleaner.splitter_fused_ja
+    '''
+
+    import functools
+    from ja_sentence_segmenter.concatenate.simple_concatenator import concatenate_matching
+    from ja_sentence_segmenter.normalize.neologd_normalizer import normalize
+    from ja_sentence_segmenter.split.simple_splitter import split_newline, split_punctuation
+
+    from util.text_tool_base import make_pipeline
+    from util.versatile_tool import stop_watch
+
+    texts = [
+        "まとめ | エキサイトブログ 生八つ橋のタグまとめ。ブログ、生八つ橋、日記、記録、写真、レビュー、噂、まとめ。\n「生八つ橋」タグの記事（4）。 色々な生八つ橋を買ってきました。我が家はみんな八つ橋ファンなのです～。我が家はみんな八つ橋ファンなのです～。色々な生八つ橋を買ってきました。\n Yさんは。「八つ橋なんてもう何年も食べたことないわ～～～」と仰っていましたが、いや",
+        "【エロ動画】くりくり瞳のショートヘアの女の子(*ﾟ∀ﾟ)=3 アダルトMAX-無修正と無料動画- エロ くりくり瞳のショートヘアの女の子ムハァーーーーーー *ﾟ∀ﾟ =3 TOP > エロ 投稿日:2015-08-02 01:00:16 カテゴリー エロ*ﾟ∀ﾟ=3 [1]«73298 73299 73300»[138086]",
+        "ｶﾞｷﾞｸﾞ ｰｰ ＡＢＣ１２３　全角　スペース！？ 「括弧の中。です！」（括弧。の中）と言った。\r\n半角ｶﾅ､句読点｡ a , b ‐‐ c —— d 〜〰～ e \"quote\" 'single'",
+        "Clinical Stanford Emergency Medicine Dept. 300 Pasteur Dr Rm M121 Additional Info. Stanford Medicine! Your Librarian? Log in with your SUNet ID.",
+        "",
+        "   \n\n  ",
+    ]
+
+    split_punc = functools.partial(split_punctuation, punctuations=r"。!?")
+    concat_tail_te = functools.partial(concatenate_matching, remove_former_matched=False)
+    reference = make_pipeline(normalize, split_newline, concat_tail_te, split_punc)
+
+    splitter = FusedSplitJa(punctuations=r"。!?")
+
+    # 既存のパイプラインとの一致確認
+    for text in texts:
+        expected = list(reference(text))
+        actual = list(splitter(text))
+        assert expected == actual, (expected, actual)
+    print('equivalent to make_pipeline(normalize, split_newline, concat_tail_te, split_punc)')
+
+    texts = texts[:3] * 1_000
+
+
+    @stop_watch
+    def func_reference():
+        for text in texts:
+            list(reference(text))
+
+
+    @stop_watch
+    def func():
+        for text in texts:
+            list(splitter(text))
+
+
+    func_reference()
+    func()
@@ -20,11 +20,17 @@ class WtpSplit(TextSplitterBase):
             lang_doce: str = 'en',
             model_name: str = "wtp-bert-mini",
             do_paragraph_segmentation: bool = False,
+            batch_size: int = 32,
     ):
+        """
+        batch_size:
+            split_batch()でWtP.split()に渡すbatch_size
+        """
         self._lang_code: str = lang_doce
         self._model_name: str = model_name
         self._model: Optional[Type[WtP]] = None
         self._do_parag_seg = do_paragraph_segmentation
+        self._batch_size: int = batch_size
         self.init_model()
 
     def init_model(self):
@@ -46,6 +52,19 @@ class WtpSplit(TextSplitterBase):
         for line in res:
             yield line
 
+    def split_batch(
+            self,
+            texts: List[str],
+    ) -> List[List[str]]:
+        """ WtP.split()にtextのリストを渡して、まとめて分割する """
+        res = self._model.split(
+            texts,
+            lang_code=self._lang_code,
+            do_paragraph_segmentation=self._do_parag_seg,
+            batch_size=self._batch_size,
+        )
+        return [list(lines) for lines in res]
+
 
 if __name__ == "__main__":
     '''
@@ -76,3 +95,11 @@ if __name__ == "__main__":
 
 
     func()
+
+
+    @stop_watch
+    def func_batch():
+        return splitter.split_batch(texts)
+
+
+    assert func_batch() == [list(splitter(text)) for text in texts]
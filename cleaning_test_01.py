@@ -1,12 +1,5 @@
 # coding: UTF-8
 
-import functools
-from ja_sentence_segmenter.concatenate.simple_concatenator import concatenate_matching
-from ja_sentence_segmenter.normalize.neologd_normalizer import normalize
-from ja_sentence_segmenter.split.simple_splitter import split_newline, split_punctuation
-
-
-
 from util.text_tool_base import make_pipeline
 from util.versatile_tool import stop_watch
 from cleaner.filter_mecab import PartsFilterMecab
@@ -16,6 +9,9 @@ from cleaner.filter_spacy import PartsFilterSpacy
 from cleaner.director_paragraph_filter import ParagraphCleaningDirector
 from cleaner.filter_norm_jp import NormalizeFilterJp
 from cleaner.filter_hojichar import FilterHojichar, JA_LIST, EN_LIST
+from cleaner.splitter_fused_ja import FusedSplitJa
+from cleaner.filter_quality_signal import QualitySignalFilter, JA_RULES, EN_RULES
+from cleaner.filter_keyword import JA_LIST_FAST
 
 
 def japanese():
@@ -30,10 +26,13 @@ def japanese():
     ''' normalize '''
     text_normalizer = NormalizeFilterJp()
 
+    ''' quality signals '''
+    # 文字種の割合などで明らかに質の低い文書を、MeCabの前に除去する
+    quality_filter = QualitySignalFilter(rules=JA_RULES)
+
     ''' paragraph cleaning '''
-    split_punc = functools.partial(split_punctuation, punctuations=r"。!?")
-    concat_tail_te = functools.partial(concatenate_matching, remove_former_matched=False)
-    paragraph_splitter = make_pipeline(normalize, split_newline, concat_tail_te, split_punc)
+    # make_pipeline(normalize, split_newline, concat_tail_te, split_punc) と同じ結果
+    paragraph_splitter = FusedSplitJa(punctuations=r"。!?")
 
     # mecabの導入方法によって、解析結果を分割する文字などを変える必要がある
     sentence_cleaner = PartsFilterMecab(threshold=0.9, min_length=10, parts_index=4, split_key="-")
@@ -45,11 +44,13 @@ def japanese():
     )
 
     ''' text filter '''
-    text_filter = FilterHojichar(filter_list=JA_LIST)
+    # JA_LISTのキーワードのフィルタを1つのAho-Corasickのオートマトンにまとめたもの（判定は同じ）
+    text_filter = FilterHojichar(filter_list=JA_LIST_FAST)
 
     ''' make pipline '''
     processor = make_pipeline(
         text_normalizer,
+        quality_filter,
         paragraph_cleaner,
         text_filter,
     )
@@ -76,10 +77,12 @@ def english():
     ''' normalize '''
     text_normalizer = NormalizeFilterJp()
 
+    ''' quality signals '''
+    quality_filter = QualitySignalFilter(rules=EN_RULES)
+
     ''' paragraph cleaning '''
-    split_punc = functools.partial(split_punctuation, punctuations=r".!?")
-    concat_tail_te = functools.partial(concatenate_matching, remove_former_matched=False)
-    paragraph_splitter = make_pipeline(normalize, split_newline, concat_tail_te, split_punc)
+    # make_pipeline(normalize, split_newline, concat_tail_te, split_punc) と同じ結果
+    paragraph_splitter = FusedSplitJa(punctuations=r".!?")
 
     sentence_cleaner = PartsFilterNltk(threshold=0.9, min_length=10)
     # sentence_cleaner = PartsFilterTextblob(threshold=0.9, min_length=10)
@@ -88,9 +91,11 @@ def english():
     # # sentence_cleaner = PartsFilterMecab(threshold=0.9, min_length=10, parts_index=4, split_key="-")
     # sentence_cleaner = PartsFilterMecab(threshold=0.9, min_length=10, parts_index=1, split_key=",")
 
+    # 1,000文書ずつ、文をまとめてsentence_cleaner.process_batch()（NLTKのpos_tag_sents()など）に渡す
     paragraph_cleaner = ParagraphCleaningDirector(
         paragraph_splitter=paragraph_splitter,
-        sentence_cleaner=sentence_cleaner
+        sentence_cleaner=sentence_cleaner,
+        window_size=1_000,
     )
 
     ''' text filter '''
@@ -99,6 +104,7 @@ def english():
     ''' make pipline '''
     processor = make_pipeline(
         text_normalizer,
+        quality_filter,
         paragraph_cleaner,
         text_filter,
     )
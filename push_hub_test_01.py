@@ -1,33 +1,10 @@
-from cleantext import clean
-
 from util.text_tool_base import make_pipeline
-from util.datasets_tool import DatasetFileInfoMediator, HubPushProcessedParquetFile
+from util.datasets_tool import DatasetFileInfoMediator, HubPushProcessedParquetFile, BatchedMapFunction
+from util.shard_cache import ShardCache
+from util.shard_queue import SharedShardQueue, make_shard_tasks
+from util.telemetry import ProgressReporter
 from cleaner.filter_hojichar import FilterHojichar, JA_LIST, EN_LIST
-
-
-def normalize_text(original_text):
-    clean_text = clean(original_text,
-                       fix_unicode=True,  # fix various unicode errors
-                       to_ascii=True,  # transliterate to closest ASCII representation
-                       lower=False,  # lowercase text
-                       no_line_breaks=False,  # fully strip line breaks as opposed to only normalizing them
-                       no_urls=True,  # replace all URLs with a special token
-                       no_emails=True,  # replace all email addresses with a special token
-                       no_phone_numbers=True,  # replace all phone numbers with a special token
-                       no_numbers=False,  # replace all numbers with a special token
-                       no_digits=False,  # replace all digits with a special token
-                       no_currency_symbols=False,  # replace all currency symbols with a special token
-                       no_punct=False,  # remove punctuations
-                       replace_with_punct="",  # instead of removing punctuations you may replace them
-                       replace_with_url="",
-                       replace_with_email="",
-                       replace_with_phone_number="",
-                       replace_with_number="",
-                       replace_with_digit="",
-                       replace_with_currency_symbol="",
-                       lang="en"  # set to 'de' for German special handling
-                       )
-    return clean_text
+from cleaner.filter_cleantext import FilterCleantext
 
 
 def main():
@@ -64,7 +41,7 @@ def main():
     file_info_dict = fm.get_parquet_info()
     print(file_info_dict)
 
-    # このリストの内容を複数人数で分担すれば良いかと思います
+    # このリストの内容は、５．のSharedShardQueueで複数のノードに分担させます
     # ここではテスト用にリストを絞る
     file_info_dict = {
         'train': [
@@ -75,36 +52,58 @@ def main():
 
     ''' ３．クリーニング用のmap関数を用意 '''
 
+    ''' normalize '''
+    # clean()と同じ結果（ASCIIのtextはftfy, unidecodeを飛ばす）
+    text_normalizer = FilterCleantext(lang="en")
+
     ''' text filter '''
     text_filter = FilterHojichar(filter_list=EN_LIST)
 
     ''' make pipline '''
     processor = make_pipeline(
+        text_normalizer,
         text_filter,
     )
 
-    ''' dataset.map() に渡す関数を定義 
-    !!! ここ(cleaning_tool())の処理内容を任意に書き換えてください !!!
+    ''' dataset.map(batched=True) に渡す関数を定義
+    !!! ここ(processor)の処理内容を任意に書き換えてください !!!
+    処理後に空になった行は、同じmapの中で除去されます
     '''
-
-    def cleaning_tool(example):
-        text = normalize_text(example["text"])
-        example["text"] = "".join(list(processor(text)))
-        return example
+    cleaning_tool = BatchedMapFunction(processor)
 
     ''' ４．クリーニング処理を適用しpushする '''
+    # 進捗（docs/s, bytes/s, 処理中のシャード, キューの状態, RSS）を60秒ごとに書き出す
+    # *.promはnode_exporterのtextfile collector用、*.jsonlにすると1行ずつ追記
+    reporter = ProgressReporter('progress.prom', interval=60)
+
     upload_repo = 'ttaront/filtered_clx'  # push先のRepository
     push_file = HubPushProcessedParquetFile(
         map_func=cleaning_tool,
         api_token=api_token,
         upload_repo=upload_repo,
+        # 同じシャードでクリーニング処理を試し直す場合に、再ダウンロードしないようにする
+        shard_cache=ShardCache(cache_dir='shard_cache', max_bytes=50 * 1024 ** 3),
+        # 出力ファイルのサイズ・row group・圧縮の設定
+        writer_options={'target_bytes': 512 * 1024 ** 2, 'row_group_size': 100_000,
+                        'compression': 'zstd', 'compression_level': 3},
+        # dataset.map(batched=True)の設定
+        batch_size=1000,
+        num_proc=4,
+        writer_batch_size=1000,
+        reporter=reporter,
         file_name_head='en_part_',  # オリジナルのファイル名の先頭に名前を追加。任意。
     )
 
-    for key, val in file_info_dict.items():
-        for org_path in val:
-            upload_dir = 'en'  # アップロードファイルを格納するRepositoryのディレクトリを指定
-            push_file(parquet_path=org_path, upload_dir=upload_dir)
+    ''' ５．シャードを分担して処理する
+    queue_dirを共有ファイルシステム（NFSなど）に置き、複数のノードで同じスクリプトを実行すると、
+    各ノードがシャードを1つずつ取り合って分担します（途中で止まったノードのシャードは lease_ttl 秒後に他のノードが処理する）
+    処理済みのシャードは記録されるので、再実行しても飛ばされます
+    '''
+    queue = SharedShardQueue(queue_dir='shard_queue', lease_ttl=30 * 60)
+    queue.publish(make_shard_tasks(file_info_dict, upload_dir='en'))  # アップロードファイルを格納するRepositoryのディレクトリを指定
+    with reporter:
+        queue.run(lambda task: push_file(**task), reporter=reporter)
+    print(queue.status())
 
 
 if __name__ == "__main__":
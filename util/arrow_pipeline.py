@@ -0,0 +1,186 @@
+import sys
+from typing import Callable, Dict, Generator, Iterator, List, Tuple, Union, Optional, Any
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from util.text_tool_base import TextProcessorBase
+
+'''
+pyarrowのRecordBatch（またはTable）のtext列をまとめて処理するパイプライン
+arrow_handling()を持つ処理はpyarrow.computeで列のまま処理し、それ以外は1行ずつPythonで処理する
+'''
+
+# str.strip()が除去する空白文字（pyarrow.compute.utf8_trim()に渡す）
+PY_WHITESPACE: str = ''.join(chr(c) for c in range(sys.maxunicode + 1) if chr(c).isspace())
+
+# 前後の文字によってPythonのstr.lower()の結果が変わる文字（語末のΣはςになるFinal_Sigma）
+# pyarrowのutf8_lower()は常にσにする。1文字ずつ比べるdivergent_chars()では見つからないので、別に指定する
+CONTEXT_SENSITIVE_LOWER: str = '\u03a3'
+
+_DIVERGENT_CHARS_CACHE: Dict[Any, str] = {}
+
+
+def to_re2_class(chars: str) -> str:
+    """ 文字の集合をRE2（pyarrow.computeの正規表現）の文字クラスにする """
+    return '[' + ''.join(f'\\x{{{ord(c):x}}}' for c in chars) + ']'
+
+
+def divergent_chars(
+        key: Any,
+        steps: List[Tuple[Callable[[pa.Array], pa.Array], Callable[[str], str]]],
+) -> str:
+    """
+    全ての文字を1文字ずつ (pyarrowの処理, Pythonの処理) の組で順に処理し、
+    途中のどこかで結果が異なる文字を返す（keyごとに1回だけ計算）
+    pyarrowとPythonの unicodedata ではUnicodeのバージョンが違うため、新しく追加された文字などで結果が変わる
+    """
+    if key not in _DIVERGENT_CHARS_CACHE:
+        chars = [chr(c) for c in range(sys.maxunicode + 1) if not 0xd800 <= c < 0xe000]
+        arrow_results = pa.array(chars)
+        python_results = chars
+        divergent = set()
+        for arrow_func, python_func in steps:
+            arrow_results = arrow_func(arrow_results)
+            python_results = [python_func(text) for text in python_results]
+            divergent.update(c for c, a, b in zip(chars, arrow_results.to_pylist(), python_results) if a != b)
+        _DIVERGENT_CHARS_CACHE[key] = ''.join(sorted(divergent))
+    return _DIVERGENT_CHARS_CACHE[key]
+
+
+def fix_divergent_rows(
+        texts: pa.Array,
+        results: pa.Array,
+        chars: str,
+        python_func: Callable[[str], str],
+) -> pa.Array:
+    """ textsのうちcharsを含む行だけ、python_funcで処理し直した結果に置き換える """
+    if not chars:
+        return results
+    mask = pc.match_substring_regex(texts, pattern=to_re2_class(chars))
+    if not pc.any(mask).as_py():
+        return results
+    fixed = [python_func(text) for text in pc.filter(texts, mask).to_pylist()]
+    return pc.replace_with_mask(results, mask, pa.array(fixed, type=results.type))
+
+
+def run_python_stage(
+        stage: Callable[..., Any],
+        texts: List[str],
+) -> List[str]:
+    if isinstance(stage, TextProcessorBase):
+        return stage.process_batch(texts)
+    return ["".join(list(stage(text))) for text in texts]
+
+
+class ArrowPipeline(object):
+    def __init__(
+            self,
+            *stages: Callable[..., Any],
+            column: str = 'text',
+            drop_empty: bool = True,
+    ):
+        """
+        pyarrow.RecordBatch / pyarrow.Table のcolumn列に、stagesを順に適用する
+
+            pipeline = ArrowPipeline(TextLengthFilter(min_length=100), NormalizeFilterJp(accent=False), parts_filter)
+            for batch in pipeline(dataset.with_format('arrow').iter(batch_size=10_000)):
+                writer.write_table(batch)
+
+        - arrow_handling(array)がNoneでない値を返すstageは、pyarrow.computeで列のまま処理する
+        - それ以外のstageは、Pythonのstrのリストに変換して process_batch() または "".join(stage(text)) で処理する
+        - drop_empty=Trueの場合は、最後にtextが""になった行を除去する（他の列も同じ行を除去）
+        """
+        self._stages = stages
+        self._column = column
+        self._drop_empty = drop_empty
+
+    def process_array(
+            self,
+            texts: Union[pa.Array, pa.ChunkedArray],
+    ) -> pa.Array:
+        if isinstance(texts, pa.ChunkedArray):
+            texts = texts.combine_chunks()
+        texts = texts.fill_null('')
+        for stage in self._stages:
+            arrow_handling = getattr(stage, 'arrow_handling', None)
+            results = arrow_handling(texts) if arrow_handling else None
+            if results is None:
+                results = pa.array(run_python_stage(stage, texts.to_pylist()), type=texts.type)
+            texts = results
+        return texts
+
+    def process_batch(
+            self,
+            batch: Union[pa.RecordBatch, pa.Table],
+    ) -> Union[pa.RecordBatch, pa.Table]:
+        index = batch.schema.get_field_index(self._column)
+        texts = self.process_array(batch.column(index))
+        arrays = list(batch.columns)
+        arrays[index] = texts
+        if isinstance(batch, pa.Table):
+            new_batch = pa.Table.from_arrays(arrays, schema=batch.schema)
+        else:
+            new_batch = pa.RecordBatch.from_arrays(arrays, schema=batch.schema)
+        if self._drop_empty:
+            new_batch = new_batch.filter(pc.not_equal(texts, ''))
+        return new_batch
+
+    def __call__(
+            self,
+            batches: Iterator[Union[pa.RecordBatch, pa.Table]],
+    ) -> Generator[Union[pa.RecordBatch, pa.Table], None, None]:
+        for batch in batches:
+            yield self.process_batch(batch)
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.arrow_pipeline
+    '''
+
+    from util.text_tool_base import make_pipeline
+    from util.versatile_tool import stop_watch
+    from cleaner.filter_length import TextLengthFilter
+    from cleaner.filter_norm_jp import NormalizeFilterJp
+
+    texts = [
+        '  まとめ|エキサイトブログ生八つ橋のタグまとめ. 2015年8月2日\x07 ',
+        'ブログ、生八つ橋、日記,記録、写真、レビュー、噂、まとめ。ＡＢＣ１２３ ｶﾀｶﾅ',
+        'ブログ。',
+        'Between the golden-yellow lotus leaves and stalks, we see swaying white lotus flowers with thick black.',
+        'İstanbul ŞEHİR 123 ๎ Ɤ',
+        'ΟΔΟΣ ΚΑΙ ΣΟΦΙΑ',
+        None,
+    ]
+
+    stages = [
+        TextLengthFilter(min_length=5, max_length=1000),
+        NormalizeFilterJp(accent=True, case=True, numbers=True, punct=1),
+    ]
+    arrow_pipeline = ArrowPipeline(*stages)
+    python_pipeline = make_pipeline(*stages)
+
+    table = pa.table({'text': texts * 20_000, 'id': list(range(len(texts) * 20_000))})
+    batches = table.to_batches(max_chunksize=10_000)
+
+    # PythonとpyarrowでUnicodeの結果が異なる文字の一覧を先に計算しておく（初回のみ数秒）
+    arrow_pipeline.process_batch(batches[0])
+
+
+    @stop_watch
+    def func_python():
+        results = []
+        for batch in batches:
+            processed = [''.join(python_pipeline(text or '')) for text in batch.column(0).to_pylist()]
+            results.extend(text for text in processed if text != '')
+        return results
+
+
+    @stop_watch
+    def func_arrow():
+        return [text for batch in arrow_pipeline(iter(batches)) for text in batch.column(0).to_pylist()]
+
+
+    assert func_python() == func_arrow()
+    # python: 1.24s, arrow: 0.46s 程度
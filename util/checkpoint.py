@@ -0,0 +1,351 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import random
+import threading
+import uuid
+from typing import Callable, Generator, Iterable, Iterator, List, Dict, Tuple, Union, Optional, Any
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from util.parquet_writer import RollingParquetWriter
+
+# 設定として扱わない属性（処理中に変わる統計・キャッシュ・直前の文書の判定結果・ロガー・乱数など）
+# 処理済みのステージを使ってパイプラインを作り直しても、フィンガープリントが変わらないようにする
+IGNORED_ATTRIBUTES: frozenset = frozenset([
+    'logger', '_statistics', 'statistics', 'reasons', 'counts', '_tag_ids', '_is_target', 'rng', '_rng',
+    'matched_category', 'matched_text', 'matched_text_neighbor',
+])
+
+# 中身ではなく型の名前だけを設定として扱う型（実行ごとに変わる乱数の状態・ロックなど）
+_OPAQUE_TYPES: Tuple[type, ...] = (
+    logging.Logger, random.Random, np.random.Generator, np.random.RandomState, type(threading.Lock()),
+)
+
+SUCCESS_FILE = '_SUCCESS.json'
+
+
+def _type_name(obj: Any) -> str:
+    return f'{type(obj).__module__}.{type(obj).__qualname__}'
+
+
+def describe_config(
+        obj: Any,
+        ignored: frozenset = IGNORED_ATTRIBUTES,
+) -> Any:
+    """
+    オブジェクト（TextProcessorBaseなど）の設定を、JSONにできる値として再帰的に取り出す
+    属性（vars()）, list, dict, numpy配列（sha256）, 正規表現（パターンとフラグ）を辿り、
+    辿れないもの（MeCab.Taggerなど）は型の名前だけにする
+    """
+    seen = set()
+
+    def describe(value: Any) -> Any:
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if isinstance(value, bytes):
+            return hashlib.sha256(value).hexdigest()
+        if isinstance(value, np.ndarray):
+            return [str(value.dtype), list(value.shape), hashlib.sha256(np.ascontiguousarray(value)).hexdigest()]
+        if isinstance(value, re.Pattern):
+            return ['re', value.pattern if isinstance(value.pattern, str) else value.pattern.hex(), value.flags]
+        if isinstance(value, _OPAQUE_TYPES) or callable(value) and not hasattr(value, '__dict__'):
+            return _type_name(value)
+        if isinstance(value, type) or hasattr(value, '__code__'):
+            return f'{getattr(value, "__module__", "")}.{getattr(value, "__qualname__", repr(value))}'
+
+        if id(value) in seen:
+            return ['ref', _type_name(value)]
+        seen.add(id(value))
+        if isinstance(value, (list, tuple)):
+            return [describe(item) for item in value]
+        if isinstance(value, (set, frozenset)):
+            return sorted(json.dumps(describe(item), sort_keys=True, ensure_ascii=False) for item in value)
+        if isinstance(value, dict):
+            return sorted([json.dumps(describe(key), sort_keys=True, ensure_ascii=False), describe(item)]
+                          for key, item in value.items())
+        attributes = getattr(value, '__dict__', None)
+        if attributes is None:
+            return _type_name(value)
+        return [_type_name(value), {key: describe(item) for key, item in attributes.items() if key not in ignored}]
+
+    return describe(obj)
+
+
+def fingerprint(
+        previous: str,
+        name: str,
+        config: Any,
+) -> str:
+    """ 1つ前のステージのフィンガープリントと、このステージの名前・設定から、このステージのフィンガープリントを作る """
+    payload = json.dumps([previous, name, config], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CheckpointedPipeline(object):
+    def __init__(
+            self,
+            stages: List[Union[Tuple[str, Callable[..., Iterator[str]]], Tuple[str, Callable[..., Iterator[str]], Any]]],
+            checkpoint_dir: str,
+            source_id: str,
+            checkpoints: Optional[List[str]] = None,
+            batch_rows: int = 10_000,
+            target_bytes: int = 512 * 1024 ** 2,
+            row_group_size: int = 100_000,
+    ):
+        """
+        make_pipeline()と同じようにステージ（TextProcessorBaseなど）を順につなぎ、
+        指定したステージの出力をparquetに保存（チェックポイント）しておき、再実行時にそこから再開するパイプライン
+
+            pipeline = CheckpointedPipeline(
+                stages=[('normalize', NormalizeFilterJp()), ('director', director), ('hojichar', text_filter)],
+                checkpoint_dir='checkpoints', source_id='corpus.jsonl@2024-05-01', checkpoints=['director'],
+            )
+            for text in pipeline(texts):
+                ...
+
+        - チェックポイントは {checkpoint_dir}/{ステージ名}-{フィンガープリント}/ にparquetのシャードとして保存する
+          （入力と同じ順番・同じ行数。除去されたtextは""のまま残す）
+        - フィンガープリントは source_id と、そのステージまでの全てのステージの名前・設定のsha256
+          （最後のステージの設定だけを変えた場合は、その前のチェックポイントのフィンガープリントは変わらない）
+        - 再実行時は、フィンガープリントが一致する最も後ろのチェックポイントを読み、その後のステージだけを実行する
+          （その場合、渡したtextsは読まないので、入力が変わったらsource_idも変えること）
+        - 書き込み中のチェックポイントは一時ディレクトリに書き、全ての行を書き終えたらos.replace()で置き換える
+          （途中で止まった場合は使われない）
+
+        ステージの設定は describe_config() でオブジェクトの属性から取り出す
+        MeCabの辞書など属性から辿れないものを変えた場合のために、(名前, ステージ, 設定) として設定を明示することもできる
+
+        Parameters
+        ----------
+        stages: list
+            (ステージ名, ステージ) または (ステージ名, ステージ, 設定) のリスト
+        checkpoint_dir: str
+            チェックポイントを保存するディレクトリ
+        source_id: str
+            入力を識別する文字列（ファイルのパスと更新時刻など）。必須
+            再開時は入力を読まずにチェックポイントを返すため、別の入力には別のsource_idを指定してください
+        checkpoints: list
+            出力を保存するステージ名のリスト（指定しない場合は保存しない）
+        batch_rows: int
+            チェックポイントに書き込む・読み込む単位の行数
+        target_bytes, row_group_size:
+            RollingParquetWriterの1ファイルの目標サイズとrow groupの行数
+        """
+        self._names: List[str] = [stage[0] for stage in stages]
+        assert len(set(self._names)) == len(self._names), f'duplicate stage names: {self._names}'
+        self._checkpoints: List[str] = checkpoints if checkpoints else []
+        unknown = [name for name in self._checkpoints if name not in self._names]
+        assert not unknown, f'unknown stages: {unknown}'
+
+        self._stages: List[Callable[..., Iterator[str]]] = [stage[1] for stage in stages]
+        self._checkpoint_dir: str = checkpoint_dir
+        self._batch_rows: int = batch_rows
+        self._target_bytes: int = target_bytes
+        self._row_group_size: int = row_group_size
+
+        # ステージごとのフィンガープリント（作った時点の設定から計算する）
+        self.fingerprints: List[str] = []
+        previous = hashlib.sha256(source_id.encode('utf-8')).hexdigest()
+        for stage in stages:
+            config = stage[2] if len(stage) > 2 else describe_config(stage[1])
+            previous = fingerprint(previous, stage[0], config)
+            self.fingerprints.append(previous)
+
+        # 直前の実行で再開したステージ名（最初から実行した場合はNone）
+        self.resumed_from: Optional[str] = None
+
+    def __call__(
+            self,
+            input_data: Union[str, List[str], Iterator[str]],
+    ) -> Generator[str, None, None]:
+        return self.process(input_data)
+
+    def checkpoint_path(self, index: int) -> str:
+        return os.path.join(self._checkpoint_dir, f'{self._names[index]}-{self.fingerprints[index][:16]}')
+
+    def is_complete(self, index: int) -> bool:
+        """ index番目のステージのチェックポイントが、全ての行を書き終えて保存されているか """
+        try:
+            with open(os.path.join(self.checkpoint_path(index), SUCCESS_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return meta.get('fingerprint') == self.fingerprints[index]
+
+    def resume_index(self) -> int:
+        """ 一致するチェックポイントがある最も後ろのステージの番号（ない場合は-1） """
+        for index in reversed(range(len(self._names))):
+            if self._names[index] in self._checkpoints and self.is_complete(index):
+                return index
+        return -1
+
+    def read_checkpoint(
+            self,
+            index: int,
+    ) -> Generator[str, None, None]:
+        path = self.checkpoint_path(index)
+        with open(os.path.join(path, SUCCESS_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        for file_name in meta['files']:
+            parquet_file = pq.ParquetFile(os.path.join(path, file_name))
+            for batch in parquet_file.iter_batches(batch_size=self._batch_rows, columns=['text']):
+                yield from batch.column(0).to_pylist()
+
+    def write_checkpoint(
+            self,
+            index: int,
+            texts: Iterator[str],
+    ) -> Generator[str, None, None]:
+        """ textsをそのまま返しながらチェックポイントに書き込み、最後まで読まれたら保存する """
+        path = self.checkpoint_path(index)
+        tmp_path = os.path.join(self._checkpoint_dir, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+        writer = RollingParquetWriter(tmp_path, target_bytes=self._target_bytes, row_group_size=self._row_group_size)
+        rows = 0
+        buffer: List[str] = []
+        try:
+            for text in texts:
+                buffer.append(text)
+                if len(buffer) >= self._batch_rows:
+                    writer.write_table(pa.table({'text': pa.array(buffer, type=pa.string())}))
+                    rows += len(buffer)
+                    buffer = []
+                yield text
+            if buffer:
+                writer.write_table(pa.table({'text': pa.array(buffer, type=pa.string())}))
+                rows += len(buffer)
+            paths = writer.close()
+        except BaseException:
+            # 途中で止まった（GeneratorExitを含む）場合は保存しない
+            writer.abort()
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        meta = {
+            'stage': self._names[index],
+            'fingerprint': self.fingerprints[index],
+            'rows': rows,
+            'files': [os.path.basename(p) for p in paths],
+        }
+        with open(os.path.join(tmp_path, SUCCESS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+
+    def process(
+            self,
+            input_data: Union[str, List[str], Iterator[str]],
+    ) -> Generator[str, None, None]:
+        os.makedirs(self._checkpoint_dir, exist_ok=True)
+        start = self.resume_index()
+        self.resumed_from = self._names[start] if start >= 0 else None
+        if start >= 0:
+            texts: Iterator[str] = self.read_checkpoint(start)
+        else:
+            texts = iter([input_data]) if isinstance(input_data, str) else iter(input_data)
+
+        for index in range(start + 1, len(self._stages)):
+            texts = self._stages[index](texts)
+            if self._names[index] in self._checkpoints:
+                texts = self.write_checkpoint(index, texts)
+        yield from texts
+
+    def prune(self) -> List[str]:
+        """ 現在の設定と一致しない古いチェックポイント（と書き込み途中で止まった一時ディレクトリ）を削除する """
+        if not os.path.isdir(self._checkpoint_dir):
+            return []
+        current = {os.path.basename(self.checkpoint_path(index)) for index in range(len(self._names))}
+        removed = []
+        for dir_name in os.listdir(self._checkpoint_dir):
+            stage = dir_name.lstrip('.').rsplit('-', 1)[0]
+            if stage not in self._names or dir_name in current:
+                continue
+            shutil.rmtree(os.path.join(self._checkpoint_dir, dir_name), ignore_errors=True)
+            removed.append(dir_name)
+        return removed
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.checkpoint
+    '''
+    import tempfile
+
+    from hojichar import document_filters
+
+    from util.text_tool_base import make_pipeline
+    from util.versatile_tool import stop_watch
+    from cleaner.filter_mecab import PartsFilterMecab
+    from cleaner.filter_norm_jp import NormalizeFilterJp
+    from cleaner.filter_hojichar import FilterHojichar
+    from cleaner.filter_keyword import DiscardKeywords, JA_KEYWORD_CATEGORIES
+    from cleaner.splitter_fused_ja import FusedSplitJa
+    from cleaner.director_paragraph_filter import ParagraphCleaningDirector
+
+    texts = [
+        "生八つ橋のタグまとめ | エキサイトブログ 生八つ橋のタグまとめ 「生八つ橋」のタグがついている新着記事と人気記事をまとめました。\nブログ（日記、記録、写真、レビュー、噂、まとめ）投稿。\n 京都旅行のお土産(我が家用)に色々な生八つ橋を買ってきました。我が家はみんな八つ橋ファンなのです～。",
+        "吾輩は猫である。名前はまだ無い。\nどこで生れたかとんと見当がつかぬ。何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。",
+        "【エロ動画】くりくり瞳のショートヘアの女の子(*ﾟ∀ﾟ)=3 アダルトMAX-無修正と無料動画- TOP > エロ *ﾟ∀ﾟ =3 投稿日:2015-08-02",
+    ] * 1_000
+
+
+    def make_stages(threshold: float, min_doc_len: int) -> List[Tuple[str, Callable[..., Iterator[str]]]]:
+        director = ParagraphCleaningDirector(
+            paragraph_splitter=FusedSplitJa(punctuations=r"。!?"),
+            sentence_cleaner=PartsFilterMecab(threshold=threshold, min_length=10, parts_index=4, split_key="-"),
+        )
+        text_filter = FilterHojichar(filter_list=[
+            document_filters.JSONLoader(key="text"),
+            document_filters.DocumentLengthFilter(min_doc_len=min_doc_len, max_doc_len=50000),
+            DiscardKeywords(JA_KEYWORD_CATEGORIES),
+            document_filters.JSONDumper(),
+        ])
+        return [('normalize', NormalizeFilterJp()), ('director', director), ('hojichar', text_filter)]
+
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        for threshold, min_doc_len, expected_resume in [
+            (0.9, 10, None),  # 最初は全て実行してチェックポイントを保存
+            (0.9, 10, 'director'),  # 同じ設定: directorの出力から再開
+            (0.9, 100, 'director'),  # hojicharの設定だけ変更: directorの出力から再開
+            (0.5, 100, 'normalize'),  # directorの設定を変更: normalizeの出力から再開
+        ]:
+            stages = make_stages(threshold, min_doc_len)
+            pipeline = CheckpointedPipeline(stages, checkpoint_dir, source_id='demo',
+                                            checkpoints=['normalize', 'director'], batch_rows=1000)
+
+
+            @stop_watch
+            def func():
+                return list(pipeline(texts))
+
+
+            results = func()
+            assert pipeline.resumed_from == expected_resume, (pipeline.resumed_from, expected_resume)
+            assert results == list(make_pipeline(*[stage for _, stage in make_stages(threshold, min_doc_len)])(texts))
+            print(threshold, min_doc_len, pipeline.resumed_from, sum(1 for text in results if text))
+
+            # 文書を処理した後のステージで作り直しても、フィンガープリントは変わらない
+            assert CheckpointedPipeline(stages, checkpoint_dir, source_id='demo').fingerprints == pipeline.fingerprints
+
+        # source_idが違う（別の入力の）場合は再開しない
+        pipeline = CheckpointedPipeline(make_stages(0.5, 100), checkpoint_dir, source_id='other corpus',
+                                        checkpoints=['normalize', 'director'])
+        assert pipeline.resume_index() == -1
+
+        # 途中で読むのをやめた場合は保存しない
+        pipeline = CheckpointedPipeline(make_stages(0.7, 10), checkpoint_dir, source_id='demo',
+                                        checkpoints=['director'], batch_rows=100)
+        generator = pipeline(texts)
+        next(generator)
+        generator.close()
+        assert pipeline.resume_index() == -1
+        print('pruned:', pipeline.prune())
+        print(sorted(os.listdir(checkpoint_dir)))
+    # 全て実行: 1.3s, directorから再開: 0.15s, normalizeから再開: 1.0s 程度
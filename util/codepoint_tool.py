@@ -0,0 +1,112 @@
+from typing import Dict, Generator, Iterator, List, Tuple, Union, Optional
+
+import numpy as np
+
+'''
+複数のtextをまとめてnumpyのコードポイント配列に変換し、文字種などを一括で数えるためのツール
+'''
+
+# 基本多言語面（BMP）の外の文字は、テーブルの最後の要素（その他）として扱う
+TABLE_SIZE: int = 0x10000 + 1
+
+# 文字種の名前 -> コードポイントの範囲（開始, 終了を含む）のリスト
+CHAR_CLASS_RANGES: Dict[str, List[Tuple[int, int]]] = {
+    'space': [(0x0009, 0x000d), (0x0020, 0x0020), (0x00a0, 0x00a0), (0x3000, 0x3000)],
+    'digit': [(0x0030, 0x0039), (0xff10, 0xff19)],
+    'latin': [(0x0041, 0x005a), (0x0061, 0x007a)],
+    'latin_ext': [(0x00c0, 0x00d6), (0x00d8, 0x00f6), (0x00f8, 0x024f), (0x1e00, 0x1eff)],
+    'hiragana': [(0x3041, 0x309f)],
+    'katakana': [(0x30a0, 0x30ff), (0x31f0, 0x31ff), (0xff66, 0xff9f)],
+    'kanji': [(0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xf900, 0xfaff)],
+    'hangul': [(0x1100, 0x11ff), (0x3130, 0x318f), (0xac00, 0xd7af)],
+    'cyrillic': [(0x0400, 0x04ff)],
+    'punct': [(0x0021, 0x002f), (0x003a, 0x0040), (0x005b, 0x0060), (0x007b, 0x007e),
+              (0x2000, 0x206f), (0x3001, 0x303f), (0xff01, 0xff0f), (0xff1a, 0xff20)],
+}
+
+
+def make_class_table(
+        class_ranges: Optional[Dict[str, List[Tuple[int, int]]]] = None,
+) -> Tuple[np.ndarray, List[str]]:
+    """
+    コードポイント -> 文字種の番号 の変換テーブルを作る
+    番号0は'other'（どの範囲にも含まれない文字）。範囲が重なる場合は後に指定したものが優先されます
+    """
+    class_ranges = CHAR_CLASS_RANGES if class_ranges is None else class_ranges
+    names = ['other'] + list(class_ranges.keys())
+    if len(names) > 255:
+        raise ValueError('too many character classes')
+
+    table = np.zeros(TABLE_SIZE, dtype=np.uint8)
+    for index, name in enumerate(names[1:], start=1):
+        for start, end in class_ranges[name]:
+            table[start:end + 1] = index
+    return table, names
+
+
+def to_codepoints(
+        texts: List[str],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    textsを連結してUTF-32に変換し、(コードポイントの配列, 各textの文字数) を返す
+    ウェブの文書に含まれる孤立したサロゲート（e.g. '\\ud800'）もそのままコードポイントにする（文字種は'other'）
+    """
+    lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+    joined = ''.join(texts)
+    codepoints = np.frombuffer(joined.encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+    return codepoints, lengths
+
+
+def segment_ids(
+        lengths: np.ndarray,
+) -> np.ndarray:
+    """ 連結したコードポイントの配列の各要素が、何番目のtextのものか """
+    return np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+
+
+def lookup_classes(
+        codepoints: np.ndarray,
+        table: np.ndarray,
+) -> np.ndarray:
+    """ 各コードポイントの文字種の番号 """
+    return table[np.minimum(codepoints, TABLE_SIZE - 1)]
+
+
+def count_codepoint_classes(
+        codepoints: np.ndarray,
+        lengths: np.ndarray,
+        table: np.ndarray,
+        n_classes: int,
+) -> np.ndarray:
+    """
+    to_codepoints()の結果から、textごとの文字種の出現数を数え、shape (len(lengths), n_classes) の配列を返す
+    コードポイントの配列を他の信号の計算にも使う場合は、to_codepoints()を1回だけ呼んでこちらに渡す
+    """
+    classes = lookup_classes(codepoints, table).astype(np.int64)
+    keys = segment_ids(lengths) * n_classes + classes
+    counts = np.bincount(keys, minlength=len(lengths) * n_classes)
+    return counts.reshape(len(lengths), n_classes)
+
+
+def count_classes(
+        texts: List[str],
+        table: np.ndarray,
+        n_classes: int,
+) -> np.ndarray:
+    """
+    textごとの文字種の出現数を数え、shape (len(texts), n_classes) の配列を返す
+    """
+    return count_codepoint_classes(*to_codepoints(texts), table, n_classes)
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.codepoint_tool
+    '''
+
+    table, names = make_class_table()
+    texts = ['吾輩は猫である。', 'Hello, world! 123', '', 'Привет мир', 'ｶﾀｶﾅ 𠮷', 'ok\ud800']
+    counts = count_classes(texts, table, len(names))
+    for text, row in zip(texts, counts):
+        print(repr(text), {name: int(c) for name, c in zip(names, row) if c})
+    assert counts[5, names.index('other')] == 1 and counts[5, names.index('latin')] == 2
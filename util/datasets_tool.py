@@ -1,7 +1,17 @@
 import os
-from typing import List, Dict, Optional, Callable, Type
+import json
+import time
+import uuid
+import tempfile
+import hashlib
+import threading
+import multiprocessing
+from typing import List, Dict, Optional, Callable, Type, Any
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import datasets
 from datasets import load_dataset
@@ -10,6 +20,73 @@ from datasets.iterable_dataset import IterableDataset
 from huggingface_hub import HfApi
 from huggingface_hub import login
 
+from util.parquet_writer import RollingParquetWriter
+from util.text_tool_base import TextProcessorBase
+
+
+def make_session(
+        retries: int = 5,
+        backoff_factor: float = 0.5,
+        pool_maxsize: int = 16,
+) -> requests.Session:
+    """
+    接続を使い回し、429や5xxの場合はbackoff_factor * 2^(n-1) 秒待って再試行するrequests.Session
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class ResponseCache(object):
+    def __init__(
+            self,
+            cache_dir: str,
+            ttl: float = 3600.0,
+    ):
+        """
+        web-apiのjsonレスポンスをURLごとにローカルのファイルに保存するキャッシュ
+        保存してからttl秒を過ぎたものは使いません
+
+        Parameters
+        ----------
+        cache_dir: str
+            キャッシュファイルを保存するディレクトリ
+        ttl: float
+            キャッシュの有効期間（秒）
+        """
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self._cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url: str) -> Optional[Any]:
+        path = self._path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self._ttl:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)['data']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def set(self, url: str, data: Any):
+        path = self._path(url)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'data': data}, f)
+        os.replace(tmp_path, path)
+
 
 class DatasetFileInfoMediator(object):
     def __init__(
@@ -17,6 +94,15 @@ class DatasetFileInfoMediator(object):
             path: str,
             name: Optional[str] = None,
             api_token: Optional[str] = None,
+            api_endpoint: str = "https://huggingface.co",
+            datasets_server_endpoint: str = "https://datasets-server.huggingface.co",
+            timeout: float = 30.0,
+            retries: int = 5,
+            backoff_factor: float = 0.5,
+            max_workers: int = 8,
+            cache_dir: Optional[str] = None,
+            cache_ttl: float = 3600.0,
+            session: Optional[requests.Session] = None,
     ):
         """
         Huggingface datasetのparquetファイルリストを取得するためのクラス
@@ -29,26 +115,63 @@ class DatasetFileInfoMediator(object):
             huggingface dataset repository の name e.g. 'en'
         api_token: str
             huggingface アクセス用のAPIトークン
+        api_endpoint, datasets_server_endpoint: str
+            問い合わせ先（ローカルのテスト用サーバーなどに差し替え可能）
+        timeout, retries, backoff_factor:
+            1回の問い合わせのタイムアウト（秒）と、429/5xxの場合の再試行の回数・間隔
+        max_workers: int
+            get_parquet_info_for_configs()で同時に問い合わせる数
+        cache_dir: str
+            指定した場合はレスポンスをローカルに保存し、cache_ttl秒の間は使い回す
+        session: requests.Session
+            指定しない場合はmake_session()で作る
         """
         self._path = path
         self._name = name
         self._api_token = api_token
+        self._api_endpoint = api_endpoint.rstrip('/')
+        self._datasets_server_endpoint = datasets_server_endpoint.rstrip('/')
+        self._timeout = timeout
+        self._max_workers = max_workers
+        self._session = session if session else make_session(retries, backoff_factor, pool_maxsize=max_workers)
+        self._cache = ResponseCache(cache_dir, cache_ttl) if cache_dir else None
 
     @staticmethod
     def get_web_response(
             url: str,
             api_token: Optional[str],
+            session: Optional[requests.Session] = None,
+            timeout: Optional[float] = None,
     ):
         headers = {"Authorization": f"Bearer {api_token}"} if api_token else None
-        response = requests.get(url, headers=headers)
+        getter = session.get if session else requests.get
+        response = getter(url, headers=headers, timeout=timeout)
         msg = f'''
-          Failed to access.
+          Failed to access. (status code: {response.status_code}, url: {url})
           Check to see if you need an api-token to access information.
           The currently designated api-token is {api_token}.
         '''
-        assert response, msg
+        if not response:
+            raise requests.HTTPError(msg, response=response)
         return response
 
+    def get_json(
+            self,
+            url: str,
+            api_token: Optional[str] = None,
+    ) -> Any:
+        """ キャッシュがあればそれを、なければ問い合わせた結果（json）を返す """
+        if self._cache:
+            data = self._cache.get(url)
+            if data is not None:
+                return data
+
+        token = api_token if api_token else self._api_token
+        data = self.get_web_response(url, token, session=self._session, timeout=self._timeout).json()
+        if self._cache:
+            self._cache.set(url, data)
+        return data
+
     def get_api_parquet_info(
             self,
             api_token: Optional[str] = None,
@@ -58,30 +181,31 @@ class DatasetFileInfoMediator(object):
         e.g.
         'https://huggingface.co/api/datasets/DKYoon/SlimPajama-6B/parquet/default/test/0.parquet'
         """
-        token = api_token if api_token else self._api_token
         file_type: str = 'parquet'
-        url = f"https://huggingface.co/api/datasets/{self._path}/{file_type}"
+        url = f"{self._api_endpoint}/api/datasets/{self._path}/{file_type}"
 
-        response = self.get_web_response(url, token)
-        urls_dict = response.json()
+        urls_dict = self.get_json(url, api_token)
         name = self._name if self._name else 'default'
         return urls_dict.get(name)
 
     def get_parquet_info(
             self,
             api_token: Optional[str] = None,
+            name: Optional[str] = None,
     ) -> Dict[str, List[str]]:
         """
         dataset_load()などを介してdatasetをダウンロードするためのアドレスを取得
         e.g.
         'https://huggingface.co/datasets/DKYoon/SlimPajama-6B/resolve/refs%2Fconvert%2Fparquet/default/test/0000.parquet'
+
+        nameを指定した場合は、self._nameの代わりにそのconfigのアドレスを取得
         """
-        token = api_token if api_token else self._api_token
         file_type: str = 'parquet'
-        url = f"https://datasets-server.huggingface.co/{file_type}?dataset={self._path}"
+        url = f"{self._datasets_server_endpoint}/{file_type}?dataset={self._path}"
+        if name:
+            url += f"&config={name}"
 
-        response = self.get_web_response(url, token)
-        urls_dict = response.json()
+        urls_dict = self.get_json(url, api_token)
 
         parquet_list: List[Dict] = urls_dict.get('parquet_files')
         '''
@@ -93,7 +217,7 @@ class DatasetFileInfoMediator(object):
         {'config': 'af','split': 'train', 'url': 'https://huggingface.co/datasets/.../0047.parquet', 'size': 296397064}
         {'config': 'af','split': 'validation', 'url': 'https://huggingface.co/datasets/.../0000.parquet', 'size': 23013126}
         '''
-        name = self._name if self._name else 'default'
+        name = name if name else (self._name if self._name else 'default')
         new_dict = defaultdict(list)
         for rec in parquet_list:
             if rec['config'] != name:
@@ -101,6 +225,141 @@ class DatasetFileInfoMediator(object):
             new_dict[rec['split']].append(rec['url'])
         return dict(new_dict)
 
+    def get_config_names(
+            self,
+            api_token: Optional[str] = None,
+    ) -> List[str]:
+        """ datasetのconfig（name）の一覧を取得 """
+        url = f"{self._datasets_server_endpoint}/splits?dataset={self._path}"
+        splits = self.get_json(url, api_token).get('splits', [])
+        return list(dict.fromkeys(rec['config'] for rec in splits))
+
+    def get_parquet_info_for_configs(
+            self,
+            names: Optional[List[str]] = None,
+            api_token: Optional[str] = None,
+    ) -> Dict[str, Dict[str, List[str]]]:
+        """
+        複数のconfigのparquetファイルリストを、最大self._max_workers並列で取得
+        namesを指定しない場合は全てのconfig
+
+        Returns
+        -------
+        {config: {split: [url, ...]}}
+        """
+        names = names if names is not None else self.get_config_names(api_token)
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            infos = executor.map(lambda name: self.get_parquet_info(api_token, name=name), names)
+            return dict(zip(names, infos))
+
+
+class BatchedMapFunction(object):
+    def __init__(
+            self,
+            processor: Callable[..., Any],
+            column: str = 'text',
+            drop_empty: bool = True,
+    ):
+        """
+        make_pipeline()で作ったパイプラインやTextProcessorBaseを、dataset.map(batched=True)に渡す関数にする
+
+            map_func = BatchedMapFunction(make_pipeline(text_normalizer, text_filter))
+            ds = ds.map(map_func, batched=True, batch_size=1000, num_proc=4)
+
+        processorがTextProcessorBaseの場合はprocess_batch()を、それ以外は "".join(processor(text)) を使います
+        drop_empty=Trueの場合は、処理後のtextが""の行を同じmapの中で除去します（filter()を別に行う必要がない）
+
+        Parameters
+        ----------
+        processor:
+            textを処理するパイプライン
+        column: str
+            処理する列の名前
+        drop_empty: bool
+            処理後に空になった行を除去するか
+        """
+        self._processor = processor
+        self._column = column
+        self._drop_empty = drop_empty
+
+    def process_texts(self, texts: List[str]) -> List[str]:
+        if isinstance(self._processor, TextProcessorBase):
+            return self._processor.process_batch(texts)
+        return ["".join(list(self._processor(text))) for text in texts]
+
+    def __call__(self, batch: Dict[str, List]) -> Dict[str, List]:
+        texts = self.process_texts(batch[self._column])
+        if not self._drop_empty:
+            return {**batch, self._column: texts}
+
+        keep = [i for i, text in enumerate(texts) if text != ""]
+        if len(keep) == len(texts):
+            return {**batch, self._column: texts}
+        new_batch = {key: [values[i] for i in keep] for key, values in batch.items()}
+        new_batch[self._column] = [texts[i] for i in keep]
+        return new_batch
+
+
+class ReportingMapFunction(object):
+    def __init__(
+            self,
+            func: Callable[[Dict], Dict],
+            batched: bool,
+            column: str = 'text',
+            on_progress: Optional[Callable[[int, int], Any]] = None,
+            queue: Optional[Any] = None,
+            flush_every: int = 1,
+    ):
+        """
+        dataset.map()に渡す関数を包み、mapの途中で処理した件数（処理前, 処理後に""でない件数）を知らせる
+        （シャード全体のmapが終わるまで進捗が0のままにならないようにする）
+
+        - 同じプロセスでmapする場合は on_progress(docs, kept) を呼ぶ
+        - num_proc>1の場合は、ワーカーのプロセスから queue（multiprocessing.Manager().Queue()）に (docs, kept) を送る
+        - flush_every件以上たまったらまとめて知らせる。最後の端数と、キャッシュを読んでmap_funcが呼ばれなかった分は
+          呼び出し側でmapの後に合わせる
+        - datasetsのキャッシュ用のハッシュとワーカーに送るpickleには、on_progressを含めない
+
+        Parameters
+        ----------
+        func:
+            包む関数（dataset.map()に渡す関数）
+        batched: bool
+            dataset.map(batched=True)で呼ぶ関数か
+        column: str
+            処理後に""かどうかを見る列の名前
+        """
+        self._func = func
+        self._batched = batched
+        self._column = column
+        self._on_progress = on_progress
+        self._queue = queue
+        self._flush_every = flush_every
+        self._docs = 0
+        self._kept = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_on_progress'] = None
+        state['_docs'], state['_kept'] = 0, 0
+        return state
+
+    def __call__(self, examples: Dict) -> Dict:
+        result = self._func(examples)
+        if self._batched:
+            self._docs += len(next(iter(examples.values()))) if examples else 0
+            self._kept += sum(1 for text in result.get(self._column, []) if text != "")
+        else:
+            self._docs += 1
+            self._kept += int(result.get(self._column) != "")
+        if self._docs >= self._flush_every:
+            if self._on_progress is not None:
+                self._on_progress(self._docs, self._kept)
+            elif self._queue is not None:
+                self._queue.put((self._docs, self._kept))
+            self._docs, self._kept = 0, 0
+        return result
+
 
 class HubPushProcessedParquetFile(object):
     def __init__(
@@ -110,6 +369,14 @@ class HubPushProcessedParquetFile(object):
             upload_repo: str,  # 'ttaront/filted_clx'
             # upload_dir:str,  # 'en', 'train/chunk'
             file_name_head: str = '',
+            shard_cache: Optional[Any] = None,
+            writer_options: Optional[Dict[str, Any]] = None,
+            output_batch_size: int = 10_000,
+            merge_shards: bool = False,
+            batch_size: int = 1000,
+            num_proc: Optional[int] = None,
+            writer_batch_size: Optional[int] = 1000,
+            reporter: Optional[Any] = None,
     ):
         """
         参照するdatasetのparquetファイルパスを与えてデータをダウンロードし、
@@ -128,11 +395,151 @@ class HubPushProcessedParquetFile(object):
         file_name_head:
             アップロードするファイル名の先頭に追加する文字（任意）
             オリジナルのファイル名の先頭に名前を追加する
+        shard_cache: util.shard_cache.ShardCache
+            指定した場合は、参照するparquetファイルをキャッシュ経由でダウンロードして使い回す
+        writer_options: Dict
+            RollingParquetWriterに渡す設定 e.g. {'target_bytes': 512 * 1024 ** 2, 'row_group_size': 100_000,
+            'compression': 'zstd', 'compression_level': 3}
+        output_batch_size: int
+            処理後のdatasetをRollingParquetWriterに渡す時の行数
+        merge_shards: bool
+            Trueの場合は、upload_dirごとに1つのRollingParquetWriterで複数のシャードの出力をまとめて書き、
+            目標サイズに達したファイルから順にアップロードする（フィルタで小さくなったファイルが大量にできないようにする）
+            最後にclose()を呼んで残りを書き出してください
+            書き出す前の行はメモリと一時ファイルにしかないので、途中で落ちると失われる
+            SharedShardQueueは__call__()が返った時点でシャードを完了とするため、merge_shards=Trueとは組み合わせないこと
+        batch_size, num_proc, writer_batch_size:
+            map_funcがBatchedMapFunctionの場合に dataset.map(batched=True) に渡す設定
+            （1回に処理する行数, プロセス数, キャッシュファイルに1回に書き込む行数（少ないほど省メモリ））
+        reporter: util.telemetry.ProgressReporter
+            指定した場合は、シャードごとの件数（処理前・処理後）とバイト数（処理前のArrowのサイズ）を記録する
+            件数はmapの途中でもバッチごと（map_funcがBatchedMapFunctionでない場合は1000件ごと）に加える
         """
         self._map_func = map_func
         self._token = api_token
         self._upload_repo = upload_repo
         self._name_head = file_name_head
+        self._shard_cache = shard_cache
+        self._writer_options = writer_options if writer_options else {}
+        self._output_batch_size = output_batch_size
+        self._batch_size = batch_size
+        self._num_proc = num_proc
+        self._writer_batch_size = writer_batch_size
+        self._merge_shards = merge_shards
+        self._reporter = reporter
+        # merge_shards=Trueの場合の upload_dir -> (出力先の一時ディレクトリ, RollingParquetWriter)
+        self._writers: Dict[str, Any] = {}
+        # num_proc>1の場合に、ワーカーのプロセスから件数を受け取るためのmultiprocessing.Manager
+        self._manager: Optional[Any] = None
+
+    def upload(
+            self,
+            local_path: str,
+            path_in_repo: str,
+    ):
+        api = HfApi()
+        api.upload_file(
+            path_or_fileobj=local_path,
+            path_in_repo=path_in_repo,
+            repo_id=self._upload_repo,
+            repo_type="dataset",
+        )
+        os.remove(local_path)
+
+    def get_merging_writer(
+            self,
+            upload_dir: str,
+            name_head: str,
+    ) -> RollingParquetWriter:
+        """ upload_dirごとに使い回すRollingParquetWriter（閉じたファイルはすぐにアップロードする） """
+        if upload_dir not in self._writers:
+            output_dir = tempfile.TemporaryDirectory(dir='.')
+            writer = RollingParquetWriter(
+                output_dir.name,
+                # 複数のジョブが同じrepositoryに書いても名前が衝突しないようにする
+                name_format=f'{name_head}{uuid.uuid4().hex[:8]}-{{index:05d}}.parquet',
+                on_file_closed=lambda path: self.upload(path, f'/{upload_dir}/{os.path.basename(path)}'),
+                **self._writer_options,
+            )
+            self._writers[upload_dir] = (output_dir, writer)
+        return self._writers[upload_dir][1]
+
+    def close(self):
+        """ merge_shards=Trueの場合に、書き込み途中のファイルを書き出してアップロードする """
+        login(token=self._token)
+        for output_dir, writer in self._writers.values():
+            writer.close()
+            output_dir.cleanup()
+        self._writers = {}
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def map_with_progress(
+            self,
+            ds: Dataset,
+            shard: str,
+    ) -> Dataset:
+        """
+        self._map_funcでmapし（BatchedMapFunctionでない場合は空要素の除去も行う）、
+        mapの途中でself._reporterに処理した件数を加える
+        """
+        batched = isinstance(self._map_func, BatchedMapFunction)
+        reporter = self._reporter
+        if reporter is None:
+            map_func = self._map_func
+        else:
+            bytes_per_doc = ds.data.nbytes / ds.num_rows if ds.num_rows else 0.0
+            counted = {'docs': 0, 'kept': 0}
+
+            def on_progress(docs: int, kept: int):
+                counted['docs'] += docs
+                counted['kept'] += kept
+                reporter.add(docs=docs, kept=kept, nbytes=int(docs * bytes_per_doc))
+                reporter.update_shard(shard, done=counted['docs'])
+
+            queue, thread = None, None
+            if batched and self._num_proc is not None and self._num_proc > 1:
+                # ワーカーのプロセスから送られた件数を、このプロセスのスレッドでreporterに加える
+                if self._manager is None:
+                    self._manager = multiprocessing.Manager()
+                queue = self._manager.Queue()
+
+                def drain():
+                    for item in iter(queue.get, None):
+                        on_progress(*item)
+
+                thread = threading.Thread(target=drain, daemon=True)
+                thread.start()
+            map_func = ReportingMapFunction(
+                self._map_func, batched=batched, column=getattr(self._map_func, '_column', 'text'),
+                on_progress=None if queue is not None else on_progress, queue=queue,
+                flush_every=1 if batched else 1000,
+            )
+
+        if batched:
+            # クリーニング処理と空要素の除去を1回のmapで行う
+            filtered_ds = ds.map(
+                map_func,
+                batched=True,
+                batch_size=self._batch_size,
+                num_proc=self._num_proc,
+                writer_batch_size=self._writer_batch_size,
+            )
+        else:
+            # クリーニング処理
+            filtered_ds = ds.map(map_func)
+
+            # 空要素の場合除去
+            filtered_ds = filtered_ds.filter(lambda example: example['text'] != "")
+
+        if reporter is not None:
+            if thread is not None:
+                queue.put(None)
+                thread.join()
+            # 最後の端数と、キャッシュを読んだ場合などmapの途中で数えられなかった分
+            on_progress(ds.num_rows - counted['docs'], filtered_ds.num_rows - counted['kept'])
+        return filtered_ds
 
     def __call__(
             self,
@@ -152,7 +559,12 @@ class HubPushProcessedParquetFile(object):
             オリジナルのファイル名の先頭に名前を追加する
         """
         login(token=self._token)
-        org_dataset_dict = load_dataset('parquet', data_files=parquet_path)
+        if self._shard_cache:
+            # 読み込み終わるまで、他のプロセスがキャッシュから削除しないようにする
+            with self._shard_cache.lease(parquet_path, self._token) as data_files:
+                org_dataset_dict = load_dataset('parquet', data_files=data_files)
+        else:
+            org_dataset_dict = load_dataset('parquet', data_files=parquet_path)
         org_name = parquet_path.split('/')[-1]  # *.parquet
 
         ''' 
@@ -167,26 +579,149 @@ class HubPushProcessedParquetFile(object):
         ds_group = org_dataset_dict.values()
         assert len(ds_group) == 1, f"The number of loaded dataset is not 1. ({len(ds_group)} datasets)"
         ds = next(iter(ds_group))
+        if self._reporter is not None:
+            self._reporter.update_shard(parquet_path, total=ds.num_rows)
 
-        # クリーニング処理
-        filtered_ds = ds.map(self._map_func)
+        filtered_ds = self.map_with_progress(ds, parquet_path)
 
-        # 空要素の場合除去
-        filtered_ds = filtered_ds.filter(lambda example: example['text'] != "")
+        name_head = file_name_head if file_name_head else self._name_head
+        tables = filtered_ds.with_format('arrow').iter(batch_size=self._output_batch_size)
 
-        # parquetファイルをローカルに保存
-        chash_file = "tmp.parquet"
-        filtered_ds.to_parquet(chash_file)
-        org_dataset_dict.cleanup_cache_files()
+        if self._merge_shards:
+            self.get_merging_writer(upload_dir, name_head).write_tables(tables)
+            org_dataset_dict.cleanup_cache_files()
+            return
 
-        # 処理後のparquetファイルをアップロード
-        name_head = file_name_head if file_name_head else self._name_head
-        upload_path = f'/{upload_dir}/{name_head}{org_name}'
-        api = HfApi()
-        api.upload_file(
-            path_or_fileobj=chash_file,
-            path_in_repo=upload_path,
-            repo_id=self._upload_repo,
-            repo_type="dataset",
+        # parquetファイルをローカルの一意な一時ディレクトリに保存（目標サイズを超える場合は複数のファイルに分ける）
+        stem = org_name[:-len('.parquet')] if org_name.endswith('.parquet') else org_name
+        with tempfile.TemporaryDirectory(dir='.') as output_dir:
+            with RollingParquetWriter(
+                    output_dir,
+                    name_format=f'{name_head}{stem}-{{index:05d}}.parquet',
+                    **self._writer_options,
+            ) as writer:
+                writer.write_tables(tables)
+            org_dataset_dict.cleanup_cache_files()
+
+            # 処理後のparquetファイルをアップロード（1ファイルの場合はオリジナルのファイル名のまま）
+            for local_path in writer.paths:
+                file_name = f'{name_head}{org_name}' if len(writer.paths) == 1 else os.path.basename(local_path)
+                self.upload(local_path, f'/{upload_dir}/{file_name}')
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.datasets_tool
+
+    ローカルのHTTPサーバーをdatasets-serverの代わりにして、再試行・並列取得・キャッシュの動作を確認する
+    '''
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    from util.versatile_tool import stop_watch
+
+    config_names = [f'lang{i:03d}' for i in range(64)]
+    request_counts: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with lock:
+                request_counts[self.path] += 1
+                count = request_counts[self.path]
+            time.sleep(0.05)
+            # 各URLの最初の問い合わせは一時的なエラーにする
+            if count == 1:
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/splits':
+                body = {'splits': [{'dataset': query['dataset'][0], 'config': name, 'split': 'train'}
+                                   for name in config_names]}
+            elif url.path == '/parquet':
+                names = query.get('config', config_names)
+                body = {'parquet_files': [
+                    {'config': name, 'split': 'train', 'url': f'http://stand-in/{name}/train/{i:04d}.parquet'}
+                    for name in names for i in range(3)]}
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_address[1]}'
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        fm = DatasetFileInfoMediator(
+            'uonlp/CulturaX', datasets_server_endpoint=endpoint,
+            backoff_factor=0.1, max_workers=16, cache_dir=cache_dir,
         )
-        os.remove(chash_file)
+
+
+        @stop_watch
+        def func_first():
+            return fm.get_parquet_info_for_configs()
+
+
+        @stop_watch
+        def func_cached():
+            return fm.get_parquet_info_for_configs()
+
+
+        first = func_first()
+        assert first == func_cached()
+        assert len(first) == len(config_names)
+        print(first['lang000'])
+        print('requests to the stand-in server:', sum(request_counts.values()))
+
+    server.shutdown()
+
+    # mapの途中でも、処理した件数がreporterに加えられる（同じプロセス / num_proc=2）
+    from util.telemetry import ProgressReporter
+    from cleaner.filter_length import TextLengthFilter
+
+
+
+    class SlowLengthFilter(TextLengthFilter):
+        """ 時間のかかる処理の代わり """
+
+        def process_batch(self, texts: List[str]) -> List[str]:
+            time.sleep(0.02)
+            return super().process_batch(texts)
+
+
+    ds = Dataset.from_dict({'text': ['ブログ。', 'ブログ、生八つ橋、日記、記録、写真、レビュー、噂、まとめ。'] * 20_000})
+    for num_proc in (None, 2):
+        with tempfile.TemporaryDirectory() as work_dir:
+            reporter = ProgressReporter(os.path.join(work_dir, 'progress.jsonl'), interval=0.05)
+            pusher = HubPushProcessedParquetFile(
+                BatchedMapFunction(SlowLengthFilter(min_length=5)), api_token='', upload_repo='',
+                batch_size=1000, num_proc=num_proc, reporter=reporter,
+            )
+            with reporter:
+                filtered_ds = pusher.map_with_progress(ds, 'shard-0')
+            if pusher._manager is not None:
+                pusher._manager.shutdown()
+            with open(os.path.join(work_dir, 'progress.jsonl'), 'r', encoding='utf-8') as f:
+                done = [json.loads(line)['docs'] for line in f]
+            print(f'num_proc={num_proc}: docs reported during map: {done}')
+            assert (reporter.docs, reporter.kept) == (ds.num_rows, filtered_ds.num_rows) == (40_000, 20_000)
+            assert any(0 < docs < ds.num_rows for docs in done)
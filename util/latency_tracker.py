@@ -0,0 +1,236 @@
+import json
+import heapq
+import random
+import itertools
+from time import perf_counter
+from typing import Callable, Generator, Iterator, List, Dict, Tuple, Union, Optional, Any
+
+
+class TimedStage(object):
+    def __init__(
+            self,
+            tracker: 'LatencyTracker',
+            stage: Callable[..., Any],
+            name: str,
+            starts_document: bool = False,
+            inner: bool = False,
+    ):
+        """
+        stageを1件ずつ呼び、かかった時間をtrackerに記録するラッパー（LatencyTracker.wrap()で作る）
+        starts_document=Trueのstage（パイプラインの先頭）に1件入るたびに、新しい文書として記録を始める
+        inner=Trueのstage（他のstageの内側で呼ばれるもの）の時間は、文書の合計時間に加えない
+        """
+        self._tracker = tracker
+        self._stage = stage
+        self.name = name
+        self._starts_document = starts_document
+        self._inner = inner
+
+    def __call__(
+            self,
+            input_data: Union[str, List[str], Iterator[str]],
+    ) -> Generator[str, None, None]:
+        texts = [input_data] if isinstance(input_data, str) else input_data
+        for text in texts:
+            if self._starts_document:
+                self._tracker.start_document(text)
+            start = perf_counter()
+            outputs = list(self._stage(text))
+            self._tracker.record(self.name, perf_counter() - start, self._inner)
+            yield from outputs
+
+
+class LatencyTracker(object):
+    def __init__(
+            self,
+            top_k: int = 50,
+            reservoir_size: int = 10_000,
+            head_chars: int = 200,
+            keep_text: bool = False,
+            seed: int = 0,
+    ):
+        """
+        パイプラインの各stageで1文書ごとにかかった時間を記録し、最も遅かった文書をtop_k件残すクラス（計測用）
+
+            tracker = LatencyTracker(top_k=50)
+            processor = make_pipeline(*tracker.wrap_all(text_normalizer, paragraph_cleaner, text_filter))
+            for text in processor(texts):
+                ...
+            tracker.dump('slowest.jsonl')
+            print(tracker.summary())
+
+        - 文書ごとの合計時間で上位top_k件をヒープで残す（文字数・stageごとの時間・先頭head_chars文字）
+        - stageごとの時間は、reservoir_size件の無作為抽出（reservoir sampling）からパーセンタイルを計算する
+        - 1件ずつstageを呼ぶため、process_batch()によるまとめ処理は使われない
+        - ParagraphCleaningDirectorのsentence_cleanerなど、内側のstageを wrap(stage, inner=True) して渡すと、
+          その時間も同じ文書に記録する（外側のstageの時間は内側の時間を含むので、合計時間には加えない）
+
+        Parameters
+        ----------
+        top_k: int
+            残す文書の数
+        reservoir_size: int
+            stageごとに残す時間のサンプル数
+        head_chars: int
+            残す文書の先頭の文字数
+        keep_text: bool
+            Trueの場合は文書の全文を残す
+        seed: int
+            reservoir samplingの乱数のシード
+        """
+        self._top_k = top_k
+        self._reservoir_size = reservoir_size
+        self._head_chars = head_chars
+        self._keep_text = keep_text
+        self._random = random.Random(seed)
+        self._counter = itertools.count()
+
+        # (合計時間, 通し番号, 記録) の最小ヒープ
+        self._heap: List[Tuple[float, int, Dict[str, Any]]] = []
+        # stage名 -> {'count', 'total', 'max'}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._reservoirs: Dict[str, List[float]] = {}
+        self._current: Optional[Dict[str, Any]] = None
+        self.documents: int = 0
+
+    def wrap(
+            self,
+            stage: Callable[..., Any],
+            name: Optional[str] = None,
+            starts_document: bool = False,
+            inner: bool = False,
+    ) -> TimedStage:
+        name = name if name else type(stage).__name__
+        return TimedStage(self, stage, name, starts_document, inner)
+
+    def wrap_all(
+            self,
+            *stages: Callable[..., Any],
+    ) -> List[TimedStage]:
+        """ make_pipeline()に渡すstagesを全てwrap()する（先頭のstageで文書の区切りを判定） """
+        names = [type(stage).__name__ for stage in stages]
+        return [self.wrap(stage, f'{i}:{name}', starts_document=(i == 0)) for i, (stage, name) in
+                enumerate(zip(stages, names))]
+
+    def start_document(self, text: str):
+        self.finish_document()
+        record = {'index': self.documents, 'length': len(text), 'total_sec': 0.0, 'stages': {},
+                  'head': text[:self._head_chars]}
+        if self._keep_text:
+            record['text'] = text
+        self._current = record
+        self.documents += 1
+
+    def record(self, name: str, elapsed: float, inner: bool = False):
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+            self._reservoirs[name] = []
+        stats['count'] += 1
+        stats['total'] += elapsed
+        if elapsed > stats['max']:
+            stats['max'] = elapsed
+
+        reservoir = self._reservoirs[name]
+        if len(reservoir) < self._reservoir_size:
+            reservoir.append(elapsed)
+        else:
+            j = self._random.randrange(int(stats['count']))
+            if j < self._reservoir_size:
+                reservoir[j] = elapsed
+
+        if self._current is not None:
+            stages = self._current['stages']
+            stages[name] = stages.get(name, 0.0) + elapsed
+            if not inner:
+                self._current['total_sec'] += elapsed
+
+    def finish_document(self):
+        """ 記録中の文書を閉じ、合計時間が上位top_k件に入ればヒープに残す """
+        record, self._current = self._current, None
+        if record is None:
+            return
+        item = (record['total_sec'], next(self._counter), record)
+        if len(self._heap) < self._top_k:
+            heapq.heappush(self._heap, item)
+        elif item[0] > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+
+    def slowest(self) -> List[Dict[str, Any]]:
+        """ 最も遅かった文書の記録（遅い順） """
+        self.finish_document()
+        return [record for _, _, record in sorted(self._heap, key=lambda item: (-item[0], item[1]))]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ stageごとの件数・合計・平均・最大と、p50/p90/p99（秒） """
+        summary = {}
+        for name, stats in self._stats.items():
+            samples = sorted(self._reservoirs[name])
+            summary[name] = {
+                'count': int(stats['count']),
+                'total_sec': stats['total'],
+                'mean_sec': stats['total'] / stats['count'],
+                'max_sec': stats['max'],
+                **{f'p{q}_sec': samples[min(len(samples) - 1, int(len(samples) * q / 100))] for q in (50, 90, 99)},
+            }
+        return summary
+
+    def dump(self, path: str):
+        """ 最も遅かった文書を遅い順にJSON Linesで書き出す """
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in self.slowest():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.latency_tracker
+    '''
+    import os
+    import tempfile
+
+    from util.text_tool_base import make_pipeline
+    from util.versatile_tool import stop_watch
+    from cleaner.filter_norm_jp import NormalizeFilterJp
+    from cleaner.filter_mecab import PartsFilterMecab
+    from cleaner.filter_hojichar import FilterHojichar, JA_LIST
+    from cleaner.splitter_fused_ja import FusedSplitJa
+    from cleaner.director_paragraph_filter import ParagraphCleaningDirector
+
+    texts = [
+        "生八つ橋のタグまとめ | エキサイトブログ 生八つ橋のタグまとめ 「生八つ橋」のタグがついている新着記事と人気記事をまとめました。\nブログ（日記、記録、写真、レビュー、噂、まとめ）投稿。",
+        "京都旅行のお土産(我が家用)に色々な生八つ橋を買ってきました。我が家はみんな八つ橋ファンなのです～。",
+    ] * 200
+    # タグだらけの長いページ
+    texts.insert(123, ' '.join(f'<div class="tag">タグ{i}</div>' for i in range(3_000)))
+
+    tracker = LatencyTracker(top_k=5)
+    sentence_cleaner = tracker.wrap(PartsFilterMecab(threshold=0.9, min_length=10, parts_index=4, split_key="-"),
+                                    'PartsFilterMecab(sentence)', inner=True)
+    stages = [
+        NormalizeFilterJp(),
+        ParagraphCleaningDirector(paragraph_splitter=FusedSplitJa(punctuations=r"。!?"),
+                                  sentence_cleaner=sentence_cleaner),
+        FilterHojichar(filter_list=JA_LIST),
+    ]
+    processor = make_pipeline(*tracker.wrap_all(*stages))
+
+
+    @stop_watch
+    def func():
+        return list(processor(texts))
+
+
+    func()
+    for name, stats in tracker.summary().items():
+        print(name, {key: round(val, 6) for key, val in stats.items()})
+    for record in tracker.slowest()[:3]:
+        print(record['index'], record['length'], round(record['total_sec'], 4),
+              {key: round(val, 4) for key, val in record['stages'].items()})
+    assert tracker.slowest()[0]['index'] == 123
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'slowest.jsonl')
+        tracker.dump(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            assert len(f.readlines()) == 5
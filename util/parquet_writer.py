@@ -0,0 +1,205 @@
+import os
+import uuid
+from typing import List, Dict, Optional, Callable, Iterator, Union, Any
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class RollingParquetWriter(object):
+    def __init__(
+            self,
+            output_dir: str,
+            name_format: str = 'part-{index:05d}.parquet',
+            target_bytes: int = 512 * 1024 ** 2,
+            max_rows: Optional[int] = None,
+            row_group_size: int = 100_000,
+            compression: str = 'zstd',
+            compression_level: Optional[int] = 3,
+            on_file_closed: Optional[Callable[[str], Any]] = None,
+    ):
+        """
+        pyarrow.Tableを順に書き込み、ファイルサイズか行数が目標に達したら次のファイルに切り替えるparquetライター
+
+        - 書き込み中は一意な一時ファイル名（.*.tmp）で書き、閉じた時にos.replace()で最終的な名前にする
+        - 行はrow_group_size行ずつrow groupにまとめて書き込む（小さいTableは溜めてから書く）
+        - ファイルを閉じるたびに on_file_closed(path) を呼ぶ（アップロードなどに使う）
+
+        Parameters
+        ----------
+        output_dir: str
+            出力先のディレクトリ
+        name_format: str
+            出力ファイル名。{index}にファイルの通し番号が入る
+        target_bytes: int
+            1ファイルの目標サイズ。超えたら次のファイルに切り替える
+        max_rows: int
+            1ファイルの最大行数（指定しない場合は行数では切り替えない）
+        row_group_size: int
+            row groupの行数
+        compression, compression_level:
+            圧縮方式と圧縮レベル e.g. 'zstd', 3
+        """
+        self._output_dir = output_dir
+        self._name_format = name_format
+        self._target_bytes = target_bytes
+        self._max_rows = max_rows
+        self._row_group_size = row_group_size
+        self._compression = compression
+        self._compression_level = compression_level
+        self._on_file_closed = on_file_closed
+        os.makedirs(self._output_dir, exist_ok=True)
+
+        self._index: int = 0
+        self._schema: Optional[pa.Schema] = None
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._sink: Optional[pa.OSFile] = None
+        self._tmp_path: Optional[str] = None
+        self._file_rows: int = 0
+        self._pending: List[pa.Table] = []
+        self._pending_rows: int = 0
+
+        # 書き込みを終えたファイルのパス
+        self.paths: List[str] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open(self):
+        final_name = self._name_format.format(index=self._index)
+        self._tmp_path = os.path.join(self._output_dir, f'.{final_name}.{uuid.uuid4().hex}.tmp')
+        self._sink = pa.OSFile(self._tmp_path, 'wb')
+        self._writer = pq.ParquetWriter(
+            self._sink, self._schema,
+            compression=self._compression,
+            compression_level=self._compression_level,
+        )
+        self._file_rows = 0
+
+    def _close_file(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._sink.close()
+        path = os.path.join(self._output_dir, self._name_format.format(index=self._index))
+        os.replace(self._tmp_path, path)
+        self._writer, self._sink, self._tmp_path = None, None, None
+        self._file_rows = 0
+        self._index += 1
+        self.paths.append(path)
+        if self._on_file_closed:
+            self._on_file_closed(path)
+
+    def _write_row_group(self, table: pa.Table):
+        """ 1つのrow groupを書き込み、目標に達していればファイルを閉じる """
+        if self._writer is None:
+            self._open()
+        self._writer.write_table(table, row_group_size=self._row_group_size)
+        self._file_rows += table.num_rows
+        if self._sink.tell() >= self._target_bytes or \
+                (self._max_rows is not None and self._file_rows >= self._max_rows):
+            self._close_file()
+
+    def _flush_pending(self, force: bool):
+        """ 溜めている行をrow_group_size行（最後はforceの場合のみ端数も）ずつ書き込む """
+        if not self._pending:
+            return
+        table = pa.concat_tables(self._pending)
+        self._pending, self._pending_rows = [], 0
+        offset = 0
+        while offset < table.num_rows:
+            size = self._row_group_size
+            if self._max_rows is not None:
+                size = min(size, self._max_rows - self._file_rows)
+            if table.num_rows - offset < size and not force:
+                break
+            self._write_row_group(table.slice(offset, size))
+            offset += size
+        if offset < table.num_rows:
+            self._pending, self._pending_rows = [table.slice(offset)], table.num_rows - offset
+
+    def write_table(self, table: pa.Table):
+        if table.num_rows == 0:
+            return
+        if self._schema is None:
+            self._schema = table.schema
+        elif not table.schema.equals(self._schema):
+            table = table.cast(self._schema)
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        if self._pending_rows >= self._row_group_size or \
+                (self._max_rows is not None and self._file_rows + self._pending_rows >= self._max_rows):
+            self._flush_pending(force=False)
+
+    def write_tables(self, tables: Iterator[pa.Table]):
+        for table in tables:
+            self.write_table(table)
+
+    def flush(self):
+        """ 溜めている行を書き込み、書き込み中のファイルを閉じる """
+        self._flush_pending(force=True)
+        self._close_file()
+
+    def close(self) -> List[str]:
+        self.flush()
+        return self.paths
+
+    def abort(self):
+        """ 書き込み中のファイルを破棄する """
+        self._pending, self._pending_rows = [], 0
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            os.remove(self._tmp_path)
+            self._writer, self._sink, self._tmp_path = None, None, None
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.parquet_writer
+    '''
+    import tempfile
+
+    from util.versatile_tool import stop_watch
+
+    texts = [
+        'Between the golden-yellow lotus leaves and stalks, we see swaying white lotus flowers with thick black.',
+        'book car ship world text, and school hole dog cat bed car sea.',
+        'まとめ | エキサイトブログ 生八つ橋のタグまとめ。ブログ、生八つ橋、日記、記録、写真、レビュー、噂、まとめ。',
+    ]
+    tables = [pa.table({'text': [f'{i} {texts[i % 3]}' for i in range(head, head + 7_000)]})
+              for head in range(0, 700_000, 7_000)]
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        @stop_watch
+        def func():
+            with RollingParquetWriter(output_dir, target_bytes=256 * 1024, row_group_size=50_000) as writer:
+                writer.write_tables(iter(tables))
+            return writer.paths
+
+
+        paths = func()
+        for path in paths:
+            meta = pq.ParquetFile(path).metadata
+            print(os.path.basename(path), os.path.getsize(path), meta.num_rows, meta.num_row_groups)
+            assert all(meta.row_group(i).num_rows > 0 for i in range(meta.num_row_groups))
+
+        assert pq.read_table(paths).column('text').to_pylist() == pa.concat_tables(tables).column('text').to_pylist()
+        assert not [name for name in os.listdir(output_dir) if name.endswith('.tmp')]
+
+    # 行数で切り替えた場合も、次のファイルの先頭に空のrow groupができない
+    with tempfile.TemporaryDirectory() as output_dir:
+        with RollingParquetWriter(output_dir, max_rows=250, row_group_size=100) as writer:
+            writer.write_tables(pa.table({'text': [str(i) for i in range(head, head + 50)]})
+                                for head in range(0, 600, 50))
+        row_groups = [[pq.ParquetFile(path).metadata.row_group(i).num_rows
+                       for i in range(pq.ParquetFile(path).metadata.num_row_groups)] for path in writer.paths]
+        print(row_groups)
+        assert row_groups == [[100, 100, 50], [100, 100, 50], [100]]
+        assert pq.read_table(writer.paths).column('text').to_pylist() == [str(i) for i in range(600)]
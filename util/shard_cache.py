@@ -0,0 +1,353 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Optional, Tuple, Any
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+from util.datasets_tool import make_session
+
+
+class ShardCache(object):
+    def __init__(
+            self,
+            cache_dir: str,
+            max_bytes: int = 100 * 1024 ** 3,
+            timeout: float = 60.0,
+            chunk_size: int = 8 * 1024 ** 2,
+            verify_on_hit: bool = False,
+            session: Optional[requests.Session] = None,
+    ):
+        """
+        ダウンロードした*.parquetファイル（シャード）をローカルに保存して使い回すキャッシュ
+
+        - URLとETagの組をキーにして保存（同じURLでも中身が更新されれば別のファイルになる）
+        - 合計サイズがmax_bytesを超えたら、最後に使ってから時間が経ったものから削除（LRU）
+        - 一時ファイルに書き込んでからos.replace()するので、途中で止まっても壊れたファイルは残らない
+        - キーごとのファイルロックで、複数プロセスが同じシャードを同時にダウンロードしないようにする
+        - lease()で使っている間は共有ロックを持ち、他のプロセスのevict()で削除されないようにする
+        - ダウンロード時にsha256を計算して保存し、ETagがsha256（LFSのファイル）の場合は照合する
+
+        Parameters
+        ----------
+        cache_dir: str
+            キャッシュファイルを保存するディレクトリ
+        max_bytes: int
+            キャッシュの合計サイズの上限
+        timeout: float
+            問い合わせのタイムアウト（秒）
+        chunk_size: int
+            ダウンロード時に1回に読み込むバイト数
+        verify_on_hit: bool
+            Trueの場合は、キャッシュを使う時にもsha256を計算し直して照合する（Falseの場合はサイズのみ照合）
+        session: requests.Session
+            指定しない場合はmake_session()で作る
+        """
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._timeout = timeout
+        self._chunk_size = chunk_size
+        self._verify_on_hit = verify_on_hit
+        self._session = session if session else make_session()
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize_etag(etag: Optional[str]) -> str:
+        if not etag:
+            return ''
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        return etag.strip('"')
+
+    @staticmethod
+    def make_key(url: str, etag: str) -> str:
+        return hashlib.sha256(f'{url}\n{etag}'.encode('utf-8')).hexdigest()
+
+    def _paths(self, key: str) -> Tuple[str, str, str]:
+        base = os.path.join(self._cache_dir, key)
+        return base + '.parquet', base + '.json', base + '.lock'
+
+    @contextmanager
+    def _lock(self, path: str, blocking: bool = True, shared: bool = False):
+        """ ファイルロック（shared=Trueの場合は共有ロック。取れなかった場合はFalseを渡す） """
+        with open(path, 'a') as f:
+            if fcntl is None:
+                yield True
+                return
+            operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(f, operation if blocking else operation | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_etag(
+            self,
+            url: str,
+            headers: Optional[Dict[str, str]] = None,
+    ) -> str:
+        """ HEADでETagを取得（huggingfaceのLFSファイルは X-Linked-Etag がsha256） """
+        response = self._session.head(url, headers=headers, timeout=self._timeout, allow_redirects=False)
+        etag = response.headers.get('X-Linked-Etag') or response.headers.get('ETag')
+        if not etag and response.is_redirect:
+            response = self._session.head(url, headers=headers, timeout=self._timeout, allow_redirects=True)
+            etag = response.headers.get('ETag')
+        if not response:
+            raise requests.HTTPError(f'Failed to access. (status code: {response.status_code}, url: {url})',
+                                     response=response)
+        return self.normalize_etag(etag)
+
+    @staticmethod
+    def file_sha256(path: str, chunk_size: int = 8 * 1024 ** 2) -> str:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def is_valid(self, data_path: str, meta_path: str) -> bool:
+        """ 保存済みのファイルがメタ情報（サイズ, sha256）と一致するか """
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if os.path.getsize(data_path) != meta['size']:
+                return False
+        except (OSError, ValueError, KeyError):
+            return False
+        return not self._verify_on_hit or self.file_sha256(data_path, self._chunk_size) == meta['sha256']
+
+    def download(
+            self,
+            url: str,
+            etag: str,
+            data_path: str,
+            meta_path: str,
+            headers: Optional[Dict[str, str]] = None,
+    ):
+        tmp_path = f'{data_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with self._session.get(url, headers=headers, timeout=self._timeout, stream=True) as response:
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self._chunk_size):
+                        sha.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+            digest = sha.hexdigest()
+            if len(etag) == 64 and all(c in '0123456789abcdef' for c in etag) and etag != digest:
+                raise IOError(f'checksum mismatch: {url} (etag: {etag}, sha256: {digest})')
+
+            meta = {'url': url, 'etag': etag, 'size': size, 'sha256': digest}
+            tmp_meta_path = f'{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, data_path)
+            os.replace(tmp_meta_path, meta_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def prepare(
+            self,
+            url: str,
+            api_token: Optional[str] = None,
+    ) -> Tuple[str, str, str, str]:
+        """ urlのファイルをキャッシュに用意し、(キー, ファイル, メタ情報, ロック) のパスを返す """
+        headers = {"Authorization": f"Bearer {api_token}"} if api_token else None
+        etag = self.get_etag(url, headers)
+        key = self.make_key(url, etag)
+        data_path, meta_path, lock_path = self._paths(key)
+
+        with self._lock(lock_path):
+            if self.is_valid(data_path, meta_path):
+                # 最後に使った時刻を更新（LRU用）
+                os.utime(data_path)
+            else:
+                self.download(url, etag, data_path, meta_path, headers)
+        return key, data_path, meta_path, lock_path
+
+    @contextmanager
+    def lease(
+            self,
+            url: str,
+            api_token: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        urlのファイルのローカルパスを渡し、withを抜けるまで共有ロックを持って evict() で削除されないようにする
+
+            with cache.lease(url, api_token) as path:
+                dataset = load_dataset('parquet', data_files=path)
+        """
+        while True:
+            key, data_path, meta_path, lock_path = self.prepare(url, api_token)
+            with self._lock(lock_path, shared=True):
+                # 排他ロックを外してから共有ロックを取るまでの間に削除された場合は、もう一度用意する
+                if not os.path.exists(data_path):
+                    continue
+                self.evict(keep={key})
+                yield data_path
+                return
+
+    def get(
+            self,
+            url: str,
+            api_token: Optional[str] = None,
+    ) -> str:
+        """
+        urlのファイルのローカルパスを返す（キャッシュになければダウンロードする）
+        返した後は他のプロセスのevict()で削除されることがあるので、ファイルを読む間はlease()を使ってください
+        """
+        key, data_path, _, _ = self.prepare(url, api_token)
+        self.evict(keep={key})
+        return data_path
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """ (最後に使った時刻, サイズ, キー) のリスト """
+        entries = []
+        for file_name in os.listdir(self._cache_dir):
+            if not file_name.endswith('.parquet'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self._cache_dir, file_name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_name[:-len('.parquet')]))
+        return entries
+
+    def evict(
+            self,
+            keep: Optional[set] = None,
+    ) -> List[str]:
+        """
+        合計サイズがmax_bytes以下になるまで、最後に使ってから時間が経ったものから削除する
+        ロックされているもの（ダウンロード中・lease()で使用中）は飛ばす
+        """
+        keep = keep if keep else set()
+        removed = []
+        with self._lock(os.path.join(self._cache_dir, '.evict.lock')):
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self._max_bytes:
+                    break
+                if key in keep:
+                    continue
+                data_path, meta_path, lock_path = self._paths(key)
+                with self._lock(lock_path, blocking=False) as locked:
+                    if not locked:
+                        continue
+                    for path in (data_path, meta_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+                total -= size
+                removed.append(key)
+        return removed
+
+    def total_bytes(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.shard_cache
+
+    ローカルのHTTPサーバーから配信したファイルで、キャッシュの再利用・ETagの変化・LRUでの削除・並列取得を確認する
+    '''
+    import tempfile
+    from collections import defaultdict
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from util.versatile_tool import stop_watch
+
+    files: Dict[str, bytes] = {f'/shard/{i:04d}.parquet': os.urandom(1024 ** 2) for i in range(4)}
+    download_counts: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+
+
+    class StandInHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _head(self) -> Optional[bytes]:
+            data = files.get(self.path)
+            if data is None:
+                self.send_response(404)
+                self.end_headers()
+                return None
+            self.send_response(200)
+            self.send_header('X-Linked-Etag', f'"{hashlib.sha256(data).hexdigest()}"')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            return data
+
+        def do_HEAD(self):
+            self._head()
+
+        def do_GET(self):
+            data = self._head()
+            if data is not None:
+                with lock:
+                    download_counts[self.path] += 1
+                time.sleep(0.1)
+                self.wfile.write(data)
+
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f'http://127.0.0.1:{server.server_address[1]}{path}' for path in files]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ShardCache(cache_dir, max_bytes=3 * 1024 ** 2 + 1, verify_on_hit=True)
+
+
+        @stop_watch
+        def func_concurrent():
+            # 同じシャードを8スレッドで同時に取得しても、ダウンロードは1回
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                return list(executor.map(cache.get, [urls[0]] * 8))
+
+
+        paths = func_concurrent()
+        assert len(set(paths)) == 1 and download_counts['/shard/0000.parquet'] == 1
+
+        for _ in range(5):
+            for url in urls[:3]:
+                cache.get(url)
+        assert all(download_counts[path] == 1 for path in list(files)[:3])
+
+        # 4つ目で上限を超え、最も長く使われていないものが削除される
+        cache.get(urls[3])
+        assert cache.total_bytes() <= 3 * 1024 ** 2 + 1
+        print('entries after eviction:', len(cache.entries()))
+
+        # 中身が変わる（ETagが変わる）と別のファイルとしてダウンロードし直す
+        files['/shard/0003.parquet'] = os.urandom(1024 ** 2)
+        cache.get(urls[3])
+        assert download_counts['/shard/0003.parquet'] == 2
+        print('downloads:', dict(download_counts))
+
+        # lease()で使っている間は、上限を超えても削除されない
+        with cache.lease(urls[0]) as leased_path:
+            for url in urls[1:]:
+                cache.get(url)
+                assert os.path.exists(leased_path)
+        cache.get(urls[1])
+        assert not os.path.exists(leased_path)
+
+    server.shutdown()
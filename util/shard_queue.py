@@ -0,0 +1,412 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+import traceback
+from collections import Counter
+from typing import List, Dict, Optional, Callable, Tuple, Any
+
+
+def make_shard_tasks(
+        file_info_dict: Dict[str, List[str]],
+        upload_dir: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    """
+    DatasetFileInfoMediator.get_parquet_info()の結果を、HubPushProcessedParquetFileに渡す引数のリストにする
+    upload_dirを指定しない場合は、split名（'train'など）をupload_dirにする
+    """
+    return [{'parquet_path': url, 'upload_dir': upload_dir if upload_dir else split}
+            for split, urls in file_info_dict.items() for url in urls]
+
+
+class SharedShardQueue(object):
+    def __init__(
+            self,
+            queue_dir: str,
+            lease_ttl: float = 600.0,
+            heartbeat_interval: Optional[float] = None,
+            poll_interval: float = 10.0,
+            max_attempts: int = 3,
+            worker_id: Optional[str] = None,
+    ):
+        """
+        共有ファイルシステム（NFSなど）上のディレクトリだけで、複数ノードにシャードを分担させるキュー（コーディネーター不要）
+
+            queue = SharedShardQueue('/shared/shard_queue', lease_ttl=30 * 60)
+            queue.publish(make_shard_tasks(fm.get_parquet_info(), upload_dir='en'))
+            queue.run(lambda task: push_file(**task))
+
+        queue_dir/
+            tasks.json          最初にpublish()したワーカーのタスクリスト（以降のpublish()はこれを読むだけ）
+            leases/<key>.lease  処理中のタスク。O_EXCLで作成できたワーカーだけが処理する
+            done/<key>.done     処理済みのタスク。O_EXCLで作成するので完了の記録は1回だけ
+            errors/<key>.*.json 失敗の記録。max_attempts回失敗したタスクは諦める
+            clock/<worker>      ファイルサーバーの時刻を知るために触るファイル
+
+        - 処理中はハートビートのスレッドがリースファイルの更新時刻をheartbeat_intervalごとに更新する
+        - 更新時刻がlease_ttlより古いリース（止まったノードのもの）は、rename()で1つのワーカーだけが回収して取り直す
+        - リースを失ったワーカー（lease_ttl以上止まっていたなど）は完了を記録できない
+          このとき処理の副作用（アップロード）が2回行われることがあるので、出力先の名前はシャードごとに決まるものにしておく
+          （HubPushProcessedParquetFileはオリジナルのファイル名でアップロードするので、上書きになるだけ）
+        - func(task)が返った時点で完了を記録するので、funcは返る前に出力を書き終えている必要がある
+          HubPushProcessedParquetFile(merge_shards=True)は、シャードの行をRollingParquetWriterに溜めたまま返るため、
+          このキューとは組み合わせられない（完了を記録した後にノードが落ちると、溜めていた行が失われ、処理し直されない）
+
+        Parameters
+        ----------
+        queue_dir: str
+            全てのワーカーから見える共有ディレクトリ
+        lease_ttl: float
+            リースの有効期限（秒）。ハートビートがこれ以上途絶えたリースは回収される
+        heartbeat_interval: float
+            ハートビートの間隔（秒）。指定しない場合は lease_ttl / 4
+        poll_interval: float
+            他のワーカーが処理中のタスクしか残っていない場合に、次に確認するまで待つ秒数
+        max_attempts: int
+            1つのタスクを試す最大回数
+        worker_id: str
+            ワーカーの名前（指定しない場合は ホスト名-pid-乱数）
+        """
+        self._queue_dir = queue_dir
+        self._lease_ttl = lease_ttl
+        self._heartbeat_interval = heartbeat_interval if heartbeat_interval else lease_ttl / 4
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self.worker_id = worker_id if worker_id else f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+
+        self._tasks_path = os.path.join(queue_dir, 'tasks.json')
+        self._lease_dir = os.path.join(queue_dir, 'leases')
+        self._done_dir = os.path.join(queue_dir, 'done')
+        self._error_dir = os.path.join(queue_dir, 'errors')
+        self._clock_dir = os.path.join(queue_dir, 'clock')
+        for path in (self._lease_dir, self._done_dir, self._error_dir, self._clock_dir):
+            os.makedirs(path, exist_ok=True)
+
+        self._tasks: Optional[Dict[str, Dict[str, Any]]] = None
+        # このワーカーが持っているリース key -> token
+        self._held: Dict[str, str] = {}
+        # ハートビートの時点で他のワーカーに回収されていたリース
+        self._lost: set = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def task_key(task: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(task, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:32]
+
+    def _lease_path(self, key: str) -> str:
+        return os.path.join(self._lease_dir, f'{key}.lease')
+
+    def _done_path(self, key: str) -> str:
+        return os.path.join(self._done_dir, f'{key}.done')
+
+    @staticmethod
+    def _create_exclusive(path: str, data: Dict[str, Any]) -> bool:
+        """ pathが存在しない場合のみ作成してdataを書き込む（既に存在すればFalse） """
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return True
+
+    @staticmethod
+    def _read_json(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _fs_now(self) -> float:
+        """ ファイルサーバーの現在時刻（ノード間の時計のずれの影響を受けないように、ファイルを触って更新時刻を読む） """
+        path = os.path.join(self._clock_dir, self.worker_id)
+        with open(path, 'a'):
+            os.utime(path)
+        return os.stat(path).st_mtime
+
+    def publish(
+            self,
+            tasks: List[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """
+        タスクリストを登録する（既に他のワーカーが登録していれば、そちらを使う）
+        全てのワーカーが同じリストで処理するように、登録されたリストを返す
+        """
+        if not os.path.exists(self._tasks_path):
+            tmp_path = f'{self._tasks_path}.{self.worker_id}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(tasks, f, ensure_ascii=False)
+            try:
+                # link()は既に存在する場合に失敗するので、最初の1つだけが登録される
+                os.link(tmp_path, self._tasks_path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+        return list(self.load_tasks().values())
+
+    def load_tasks(self) -> Dict[str, Dict[str, Any]]:
+        if self._tasks is None:
+            with open(self._tasks_path, 'r', encoding='utf-8') as f:
+                self._tasks = {self.task_key(task): task for task in json.load(f)}
+        return self._tasks
+
+    def attempt_counts(self) -> Counter:
+        """ タスクのkey -> 失敗した回数（errors/を1回だけ読む。共有ファイルシステムではディレクトリの読み込みが遅いため） """
+        return Counter(name.split('.', 1)[0] for name in os.listdir(self._error_dir))
+
+    def attempts(self, key: str) -> int:
+        return self.attempt_counts()[key]
+
+    def _reclaim(self, key: str) -> bool:
+        """ 期限切れのリースを回収する（回収できた場合はTrue） """
+        lease_path = self._lease_path(key)
+        try:
+            if self._fs_now() - os.stat(lease_path).st_mtime <= self._lease_ttl:
+                return False
+            # rename()は1つのワーカーしか成功しない
+            tomb_path = f'{lease_path}.{uuid.uuid4().hex}.expired'
+            os.rename(lease_path, tomb_path)
+        except FileNotFoundError:
+            return False
+        if self._fs_now() - os.stat(tomb_path).st_mtime <= self._lease_ttl:
+            # 確認してからrename()するまでの間に、他のワーカーが取り直した新しいリースだった場合は戻す
+            try:
+                os.link(tomb_path, lease_path)
+            except FileExistsError:
+                pass
+            os.remove(tomb_path)
+            return False
+        os.remove(tomb_path)
+        return True
+
+    def _try_lease(self, key: str) -> bool:
+        token = uuid.uuid4().hex
+        lease = {'worker': self.worker_id, 'token': token, 'claimed_at': time.time()}
+        if not self._create_exclusive(self._lease_path(key), lease):
+            if not self._reclaim(key) or not self._create_exclusive(self._lease_path(key), lease):
+                return False
+        if os.path.exists(self._done_path(key)):
+            # リースを取る直前に他のワーカーが完了していた場合
+            os.remove(self._lease_path(key))
+            return False
+        with self._lock:
+            self._held[key] = token
+        return True
+
+    def claim(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """ 未処理のタスクを1つ取り、(key, task)を返す（取れるタスクがなければNone） """
+        tasks = self.load_tasks()
+        keys = list(tasks)
+        done = {name[:-len('.done')] for name in os.listdir(self._done_dir)}
+        attempts = self.attempt_counts()
+        # ワーカーごとに探し始める位置をずらして、同じタスクの取り合いを減らす
+        offset = int(hashlib.sha256(self.worker_id.encode('utf-8')).hexdigest(), 16) % max(len(keys), 1)
+        for key in keys[offset:] + keys[:offset]:
+            if key in done or key in self._held or attempts[key] >= self._max_attempts:
+                continue
+            if self._try_lease(key):
+                return key, tasks[key]
+        return None
+
+    def owns(self, key: str) -> bool:
+        with self._lock:
+            token = self._held.get(key)
+        if token is None or key in self._lost:
+            return False
+        lease = self._read_json(self._lease_path(key))
+        return lease is not None and lease.get('token') == token
+
+    def heartbeat(self):
+        """ 持っている全てのリースの更新時刻を更新する（回収されていたものはlostにする） """
+        with self._lock:
+            held = list(self._held.items())
+        for key, token in held:
+            lease = self._read_json(self._lease_path(key))
+            if lease is None or lease.get('token') != token:
+                with self._lock:
+                    self._lost.add(key)
+                    self._held.pop(key, None)
+                continue
+            try:
+                os.utime(self._lease_path(key))
+            except FileNotFoundError:
+                pass
+
+    def _heartbeat_loop(self):
+        while not self._stop_event.wait(self._heartbeat_interval):
+            self.heartbeat()
+
+    def start_heartbeat(self):
+        if self._heartbeat_thread is None:
+            self._stop_event.clear()
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+            self._heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        if self._heartbeat_thread is not None:
+            self._stop_event.set()
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+
+    def release(self, key: str):
+        if self.owns(key):
+            os.remove(self._lease_path(key))
+        with self._lock:
+            self._held.pop(key, None)
+            self._lost.discard(key)
+
+    def complete(self, key: str) -> bool:
+        """ 完了を記録してリースを返す（リースを失っていた場合や既に完了していた場合はFalse） """
+        if not self.owns(key):
+            self.release(key)
+            return False
+        recorded = self._create_exclusive(self._done_path(key), {'worker': self.worker_id, 'finished_at': time.time()})
+        self.release(key)
+        return recorded
+
+    def fail(self, key: str, error: str):
+        """ 失敗を記録してリースを返す（max_attempts回までは他のワーカーが試し直す） """
+        error_path = os.path.join(self._error_dir, f'{key}.{uuid.uuid4().hex}.json')
+        with open(error_path, 'w', encoding='utf-8') as f:
+            json.dump({'worker': self.worker_id, 'error': error, 'failed_at': time.time()}, f)
+        self.release(key)
+
+    def status(self) -> Dict[str, int]:
+        keys = set(self.load_tasks())
+        done = {name[:-len('.done')] for name in os.listdir(self._done_dir)} & keys
+        leased = {name[:-len('.lease')] for name in os.listdir(self._lease_dir) if name.endswith('.lease')} & keys
+        attempts = self.attempt_counts()
+        failed = {key for key in keys - done if attempts[key] >= self._max_attempts}
+        return {'total': len(keys), 'done': len(done), 'leased': len(leased - done),
+                'failed': len(failed), 'pending': len(keys - done - leased - failed)}
+
+    def is_finished(self) -> bool:
+        status = self.status()
+        return status['done'] + status['failed'] == status['total']
+
+    def run(
+            self,
+            func: Callable[[Dict[str, Any]], Any],
+            reporter: Optional[Any] = None,
+    ) -> List[str]:
+        """
+        タスクがなくなるまで、取ったタスクをfunc(task)で処理する
+        他のワーカーが処理中のタスクしか残っていない場合は、期限切れで回収できるようになるまで待つ
+        このワーカーが完了を記録したタスクのkeyのリストを返す
+        reporter（util.telemetry.ProgressReporter）を指定した場合は、処理中のシャードとキューの状態を記録する
+        """
+        completed = []
+        if reporter is not None:
+            reporter.add_gauge_func('queue', self.status)
+        self.start_heartbeat()
+        try:
+            while True:
+                claimed = self.claim()
+                if claimed is None:
+                    if self.is_finished():
+                        break
+                    time.sleep(self._poll_interval)
+                    continue
+                key, task = claimed
+                shard_name = task.get('parquet_path', key)
+                if reporter is not None:
+                    reporter.start_shard(shard_name)
+                try:
+                    func(task)
+                except Exception:
+                    self.fail(key, traceback.format_exc())
+                    print(f'[{self.worker_id}] failed: {task}')
+                    if reporter is not None:
+                        reporter.fail_shard(shard_name)
+                    continue
+                if reporter is not None:
+                    reporter.end_shard(shard_name)
+                if self.complete(key):
+                    completed.append(key)
+                else:
+                    print(f'[{self.worker_id}] lost the lease: {task}')
+        finally:
+            self.stop_heartbeat()
+            for key in list(self._held):
+                self.release(key)
+        return completed
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.shard_queue
+
+    ローカルの複数プロセスを別ノードに見立てて、1つのワーカーが処理中に落ちても全てのシャードが1回ずつ処理されることを確認する
+    '''
+    import tempfile
+    import multiprocessing
+
+    from util.versatile_tool import stop_watch
+
+    file_info_dict = {
+        'train': [f'https://huggingface.co/datasets/uonlp/CulturaX/resolve/refs%2Fconvert%2Fparquet/en/train/{i:04d}.parquet'
+                  for i in range(40)],
+    }
+
+
+    def worker(queue_dir: str, output_path: str, crash: bool):
+        queue = SharedShardQueue(queue_dir, lease_ttl=1.0, poll_interval=0.2)
+        queue.publish(make_shard_tasks(file_info_dict, upload_dir='en'))
+
+        def process(task: Dict[str, str]):
+            if crash:
+                # リースを持ったまま落ちる（ハートビートも止まる）
+                os._exit(1)
+            time.sleep(0.05)
+            with open(output_path, 'a', encoding='utf-8') as f:
+                f.write(task['parquet_path'] + '\n')
+
+        queue.run(process)
+
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        queue_dir = os.path.join(work_dir, 'queue')
+        output_path = os.path.join(work_dir, 'processed.txt')
+
+
+        @stop_watch
+        def func():
+            context = multiprocessing.get_context('fork')
+            processes = [context.Process(target=worker, args=(queue_dir, output_path, i == 0)) for i in range(4)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            return [process.exitcode for process in processes]
+
+
+        print('exit codes:', func())
+        with open(output_path, 'r', encoding='utf-8') as f:
+            processed = f.read().splitlines()
+        print(SharedShardQueue(queue_dir).status())
+        assert sorted(processed) == sorted(file_info_dict['train'])
+
+        # 失敗したシャードはshards_doneに数えず、shards_failedに数える
+        from util.telemetry import ProgressReporter
+
+        retry_queue = SharedShardQueue(os.path.join(work_dir, 'retry_queue'), poll_interval=0.1, max_attempts=2)
+        retry_queue.publish(make_shard_tasks({'train': file_info_dict['train'][:4]}, upload_dir='en'))
+        reporter = ProgressReporter(os.path.join(work_dir, 'progress.jsonl'))
+
+
+        def process_odd(task: Dict[str, str]):
+            if int(task['parquet_path'][-12:-8]) % 2:
+                raise ValueError(task['parquet_path'])
+
+
+        retry_queue.run(process_odd, reporter=reporter)
+        assert reporter.shards_done == 2 and reporter.shards_failed == 2 * 2 and not reporter.shards, \
+            (reporter.shards_done, reporter.shards_failed)
+        print(retry_queue.status())
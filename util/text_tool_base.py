@@ -1,8 +1,25 @@
 import functools
+import re
 from typing import Callable, Generator
-from typing import Dict, Generator, Iterator, List, Union, Optional, overload, Type, Any
+from typing import Dict, Generator, Iterator, List, Tuple, Union, Optional, overload, Type, Any
 from abc import ABCMeta, abstractmethod
 
+# str.splitlines()が区切りとして扱う文字
+LINE_BREAK_RE = re.compile('\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+def iter_line_spans(text: str) -> Generator[Tuple[int, int], None, None]:
+    """ text.splitlines()と同じ行を、リストを作らずに(start, end)として順に返す """
+    pos = 0
+    n = len(text)
+    while pos < n:
+        m = LINE_BREAK_RE.search(text, pos)
+        if m is None:
+            yield pos, n
+            return
+        yield pos, m.start()
+        pos = m.end()
+
 
 def make_pipeline(
         *funcs: Callable[..., Generator[str, None, None]]
@@ -40,6 +57,16 @@ class TextProcessorBase(metaclass=ABCMeta):
     ) -> str:
         raise NotImplementedError
 
+    def process_batch(
+            self,
+            texts: List[str],
+    ) -> List[str]:
+        """
+        複数のtextをまとめて処理し、textと同じ順番・同じ数の結果を返す
+        まとめて処理した方が速いサブクラスはオーバーライドしてください
+        """
+        return [self.process_handling(text) for text in texts]
+
     def __process_iter(
             self,
             texts: Iterator[str],
@@ -91,6 +118,16 @@ class TextSplitterBase(metaclass=ABCMeta):
     ) -> Generator[str, None, None]:
         raise NotImplementedError
 
+    def split_batch(
+            self,
+            texts: List[str],
+    ) -> List[List[str]]:
+        """
+        複数のtextをまとめて分割し、textごとの分割結果のリストを返す
+        まとめて処理した方が速いサブクラスはオーバーライドしてください
+        """
+        return [list(self.split_handling(text)) for text in texts]
+
     def __split_iter(
             self,
             texts: Iterator[str],
@@ -0,0 +1,227 @@
+import gc
+import os
+import multiprocessing
+from time import perf_counter
+from typing import Callable, Generator, Iterable, Iterator, List, Dict, Tuple, Union, Optional, Any
+
+# 親プロセスで読み込んだ状態（forkしたワーカーにそのまま引き継がれる）。ワーカーではget_state()で取得する
+_state: Any = None
+
+
+def get_state() -> Any:
+    return _state
+
+
+def read_memory(pid: Union[int, str] = 'self') -> Dict[str, int]:
+    """
+    プロセスのメモリ使用量（バイト）
+    rss: 物理メモリ上のページ, pss: 共有ページを共有しているプロセス数で割ったもの,
+    uss: そのプロセスだけのページ（Private_Clean + Private_Dirty。forkした親と共有していない分）
+    /proc/<pid>/smaps_rollup が読めない場合は rss だけ（/proc/<pid>/statm）
+    """
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 3 and fields[2] == 'kB':
+                    values[fields[0].rstrip(':')] = int(fields[1]) * 1024
+    except (OSError, ValueError):
+        try:
+            with open(f'/proc/{pid}/statm', 'r') as f:
+                return {'rss': int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')}
+        except (OSError, ValueError, IndexError):
+            return {}
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+def _initialize(factory: Optional[Callable[[], Any]]):
+    """ ワーカーの初期化（親で読み込んでいない場合だけ、ワーカーごとに読み込む） """
+    global _state
+    if factory is not None:
+        _state = factory()
+
+
+def _call(args: Tuple[Callable[[Any, Any], Any], Any]) -> Any:
+    func, item = args
+    return func(_state, item)
+
+
+class WorkerBootstrap(object):
+    def __init__(
+            self,
+            factory: Callable[[], Any],
+            processes: Optional[int] = None,
+            preload: bool = True,
+            freeze: bool = True,
+    ):
+        """
+        MeCab.Tagger, spaCyのモデル, hojicharのキーワードのオートマトンなど、重い読み取り専用の状態を
+        親プロセスで1回だけ作ってからforkし、ワーカーでコピーオンライトで共有するプロセスプール
+
+            def make_state():
+                return make_pipeline(NormalizeFilterJp(), director, FilterHojichar(filter_list=JA_LIST_FAST))
+
+            def clean(processor, texts):
+                return list(processor(texts))
+
+            with WorkerBootstrap(make_state, processes=64) as bootstrap:
+                for cleaned in bootstrap.imap(clean, batches):
+                    ...
+                print(bootstrap.memory_report())
+
+        - preload=Trueの場合は、factory()を親で呼んでからforkする（forkできない環境ではワーカーごとに呼ぶ）
+          preload=Falseの場合は、ワーカーごとにfactory()を呼ぶ（比較用）
+        - freeze=Trueの場合は、fork前にgc.freeze()で読み込んだオブジェクトをGCの対象から外す
+          （ワーカーのGCがオブジェクトのヘッダを書き換えて、共有していたページがコピーされるのを減らす）
+        - func(state, item) の func はモジュールのトップレベルの関数にする（pickleして渡すため）
+        - memory_report() で、ワーカーごとのUSS（ワーカーが増やした分のメモリ）を確認できる
+        keyword tablesなどをmultiprocessing.shared_memoryに置く方法は、Pythonのdictで持っている
+        オートマトンを平らな配列に作り直す必要があり、参照も遅くなるので使っていない
+        """
+        self._factory = factory
+        self._processes: int = processes if processes else os.cpu_count()
+        self._preload: bool = preload and 'fork' in multiprocessing.get_all_start_methods()
+        self._freeze: bool = freeze
+        self._pool = None
+        # 親で状態を作るのにかかった秒数, プールの起動にかかった秒数
+        self.load_sec: float = 0.0
+        self.start_sec: float = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        global _state
+        if self._pool is not None:
+            return
+        start = perf_counter()
+        if self._preload:
+            _state = self._factory()
+            self.load_sec = perf_counter() - start
+            gc.collect()
+            if self._freeze:
+                gc.freeze()
+            context = multiprocessing.get_context('fork')
+            self._pool = context.Pool(self._processes, initializer=_initialize, initargs=(None,))
+        else:
+            context = multiprocessing.get_context()
+            self._pool = context.Pool(self._processes, initializer=_initialize, initargs=(self._factory,))
+        # 全てのワーカーの初期化が終わるまで待つ
+        self._pool.map(_call, [(_noop, None)] * self._processes, chunksize=1)
+        self.start_sec = perf_counter() - start
+
+    def close(self):
+        global _state
+        if self._pool is None:
+            return
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+        if self._preload:
+            _state = None
+            if self._freeze:
+                gc.unfreeze()
+
+    def map(
+            self,
+            func: Callable[[Any, Any], Any],
+            items: Iterable[Any],
+            chunksize: int = 1,
+    ) -> List[Any]:
+        return self._pool.map(_call, [(func, item) for item in items], chunksize=chunksize)
+
+    def imap(
+            self,
+            func: Callable[[Any, Any], Any],
+            items: Iterable[Any],
+            chunksize: int = 1,
+    ) -> Iterator[Any]:
+        """ itemsの順番で結果を返す """
+        return self._pool.imap(_call, ((func, item) for item in items), chunksize=chunksize)
+
+    def worker_pids(self) -> List[int]:
+        return [process.pid for process in self._pool._pool] if self._pool is not None else []
+
+    def memory_report(self) -> Dict[str, Any]:
+        """ 親とワーカーごとのメモリ使用量と、ワーカーのUSS・PSSの合計（バイト） """
+        workers = {pid: read_memory(pid) for pid in self.worker_pids()}
+        return {
+            'parent': read_memory(),
+            'workers': workers,
+            'total_worker_uss': sum(memory.get('uss', 0) for memory in workers.values()),
+            'total_worker_pss': sum(memory.get('pss', 0) for memory in workers.values()),
+            'total_worker_rss': sum(memory.get('rss', 0) for memory in workers.values()),
+        }
+
+
+def _noop(state: Any, item: Any) -> None:
+    return None
+
+
+if __name__ == "__main__":
+    '''
+    > python -m util.worker_bootstrap
+    '''
+    from util.text_tool_base import make_pipeline
+    from util.versatile_tool import stop_watch
+    from cleaner.filter_mecab import PartsFilterMecab
+    from cleaner.filter_norm_jp import NormalizeFilterJp
+    from cleaner.filter_hojichar import FilterHojichar
+    from cleaner.filter_keyword import DiscardKeywords, JA_KEYWORD_CATEGORIES
+    from cleaner.splitter_fused_ja import FusedSplitJa
+    from cleaner.director_paragraph_filter import ParagraphCleaningDirector
+    from hojichar import document_filters
+
+
+    def make_processor():
+        director = ParagraphCleaningDirector(
+            paragraph_splitter=FusedSplitJa(punctuations=r"。!?"),
+            sentence_cleaner=PartsFilterMecab(threshold=0.9, min_length=10, parts_index=4, split_key="-"),
+        )
+        # キーワードのオートマトンをワーカーごとに作り直すことになるように、filter_listもここで作る
+        text_filter = FilterHojichar(filter_list=[
+            document_filters.JSONLoader(key="text"),
+            document_filters.DocumentLengthFilter(min_doc_len=10, max_doc_len=50000),
+            DiscardKeywords(JA_KEYWORD_CATEGORIES),
+            document_filters.JSONDumper(),
+        ])
+        return make_pipeline(NormalizeFilterJp(), director, text_filter)
+
+
+    def clean(processor, texts: List[str]) -> List[str]:
+        return list(processor(texts))
+
+
+    texts = [
+        "生八つ橋のタグまとめ | エキサイトブログ 生八つ橋のタグまとめ 「生八つ橋」のタグがついている新着記事と人気記事をまとめました。\nブログ（日記、記録、写真、レビュー、噂、まとめ）投稿。\n 京都旅行のお土産(我が家用)に色々な生八つ橋を買ってきました。我が家はみんな八つ橋ファンなのです～。",
+        "吾輩は猫である。名前はまだ無い。\nどこで生れたかとんと見当がつかぬ。何でも薄暗いじめじめした所でニャーニャー泣いていた事だけは記憶している。",
+    ]
+    batches = [texts * 50 for _ in range(16)]
+    expected = clean(make_processor(), batches[0])
+
+    for preload in (False, True):
+        @stop_watch
+        def func():
+            with WorkerBootstrap(make_processor, processes=4, preload=preload) as bootstrap:
+                results = list(bootstrap.imap(clean, batches))
+                return results, bootstrap.memory_report(), bootstrap.start_sec
+
+
+        results, report, start_sec = func()
+        assert all(result == expected for result in results)
+        print(f'preload={preload}: start {start_sec:.2f}s, '
+              f'workers USS {report["total_worker_uss"] / 1024 ** 2:.1f}MB, '
+              f'PSS {report["total_worker_pss"] / 1024 ** 2:.1f}MB, '
+              f'RSS {report["total_worker_rss"] / 1024 ** 2:.1f}MB')
+        for pid, memory in report['workers'].items():
+            print(' ', pid, {key: f'{value / 1024 ** 2:.1f}MB' for key, value in memory.items()})
+    # 4ワーカー: preload=False USS 計 27MB, preload=True USS 計 16MB 程度（ワーカー数・辞書の大きさに比例して差が増える）